@@ -1,16 +1,46 @@
+import time
 import tkinter as tk
+from typing import Optional
 
 from .chart_widgets.chart import EmptyChart, Chart
 from .chart_widgets.heatmap import Heatmap
+from .chart_widgets.hud import Hud
 from .chart_widgets.progress_bar import DiskProgressBars
 from .chart_widgets.time_series import TimeSeries
+from .data_history import DataSnapshot
+from .logic.instrument import PipelineMetrics
+from .logic.trace import span
+
+# 两次重绘之间的最小间隔（毫秒），多个重绘请求合并为每帧一次
+FRAME_INTERVAL_MS = 33
+# 窗口尺寸停止变化多久之后才重绘（毫秒）
+RESIZE_DEBOUNCE_MS = 100
+# HUD 的尺寸（像素），显示在窗口右上角
+HUD_SIZE = (190, 150)
 
 
 class ChartManager:
-    def __init__(self, root: tk.Tk):
+    def __init__(
+        self,
+        root: tk.Tk,
+        pipeline_metrics: Optional[PipelineMetrics] = None,
+        show_hud: bool = False,
+    ):
+        """
+        :param root: 主窗口
+        :param pipeline_metrics: 记录每个图表的绘制耗时和画布元素数，None 表示不记录
+        :param show_hud: 是否在右上角显示各阶段耗时的 HUD
+        """
         self.root = root
         self.charts = []
+        self.pipeline_metrics = pipeline_metrics
+        self.hud: Optional[Hud] = None
+        self._draw_job = None
+        self._resize_job = None
+        self._last_draw_time = 0.0
         self._init_charts()
+        if show_hud:
+            self._init_hud()
 
     def _init_charts(self):
         self.cpu_chart = TimeSeries(self.root, outline="steelblue", title="CPU Usage")
@@ -69,6 +99,21 @@ class ChartManager:
         )
         self.add_chart(self.gpu_chart)
 
+    def _init_hud(self):
+        # HUD 浮在图表之上，不占用网格
+        self.hud = Hud(self.root)
+        self.hud.place(
+            relx=1.0,
+            rely=0.0,
+            x=-4,
+            y=4,
+            anchor="ne",
+            width=HUD_SIZE[0],
+            height=HUD_SIZE[1],
+        )
+        self.hud.on_resize = self.request_resize_draw
+        self.charts.append(self.hud)
+
     def add_chart(self, chart: Chart):
         """
         添加图表到指定的行和列
@@ -79,11 +124,98 @@ class ChartManager:
         row = len(self.charts) % 2
         column = len(self.charts) // 2
         chart.grid(row=row, column=column, padx=2, pady=2, sticky="nsew")
+        chart.on_resize = self.request_resize_draw
         self.charts.append(chart)
         # 设置行和列的权重，使其可以自适应窗口大小
         self.root.grid_rowconfigure(row, weight=1)
         self.root.grid_columnconfigure(column, weight=1)
 
+    def apply_snapshot(self, snapshot: DataSnapshot):
+        """
+        用快照中的数据更新各个图表（在界面线程中调用），数据有变化的图表会被标记为需要重绘
+        :param snapshot: 引擎线程构建的快照，不会被修改
+        """
+        start_time, end_time = snapshot.start_time, snapshot.end_time
+        self.cpu_chart.update_values(snapshot.cpu_history, start_time, end_time)
+        self.cpu_heatmap_chart.update_values(
+            snapshot.cpu_heatmap_history, start_time, end_time
+        )
+        self.memory_chart.update_values(snapshot.memory_history, start_time, end_time)
+        self.memory_commit_chart.update_values(
+            snapshot.memory_commit_history, start_time, end_time
+        )
+        self.disk0_chart.update_values(snapshot.disk0_history, start_time, end_time)
+        self.disk1_chart.update_values(snapshot.disk1_history, start_time, end_time)
+        self.network_chart_received.update_values(
+            snapshot.network_history_received, start_time, end_time
+        )
+        self.network_chart_sent.update_values(
+            snapshot.network_history_sent, start_time, end_time
+        )
+        if snapshot.logical_disk_space_values is not None:
+            self.logical_disk_usage_chart.update_values(
+                snapshot.logical_disk_space_values
+            )
+        self.gpu_chart.update_values(snapshot.gpu_history, start_time, end_time)
+        if self.hud is not None and snapshot.stage_totals is not None:
+            self.hud.update_values(snapshot.stage_totals)
+
+    def request_draw(self):
+        """
+        请求重绘有变化的图表。
+        已经有待执行的重绘时直接返回，距离上次重绘不足一帧时推迟到下一帧
+        """
+        if self._draw_job is not None:
+            return
+        elapsed_ms = (time.monotonic() - self._last_draw_time) * 1000
+        if elapsed_ms >= FRAME_INTERVAL_MS:
+            self._draw_job = self.root.after_idle(self._draw)
+        else:
+            self._draw_job = self.root.after(
+                int(FRAME_INTERVAL_MS - elapsed_ms) + 1, self._draw
+            )
+
+    def request_resize_draw(self):
+        """
+        图表尺寸变化时调用：每次调用都重新计时，尺寸稳定后才重绘一次
+        """
+        if self._resize_job is not None:
+            self.root.after_cancel(self._resize_job)
+        self._resize_job = self.root.after(RESIZE_DEBOUNCE_MS, self._resize_done)
+
+    def _resize_done(self):
+        self._resize_job = None
+        self.request_draw()
+
+    def _draw(self):
+        self._draw_job = None
+        if self._resize_job is not None:
+            # 尺寸还在变化，等去抖结束后再重绘
+            return
+        self._last_draw_time = time.monotonic()
+        with span("draw_charts"):
+            self.draw_charts()
+
     def draw_charts(self):
+        """
+        重绘有变化的图表（尺寸变化的图表会先重建画布元素）
+        """
+        metrics = self.pipeline_metrics
+        if metrics is None:
+            for chart in self.charts:
+                chart.render()
+            return
+
+        frame_start = time.perf_counter()
         for chart in self.charts:
-            chart.draw_chart()
+            if not (chart.dirty or chart.needs_build):
+                continue
+            name = getattr(chart, "title", "") or type(chart).__name__
+            start = time.perf_counter()
+            chart.render()
+            metrics.chart_draw_duration.labels(name).observe(
+                time.perf_counter() - start
+            )
+            metrics.canvas_items.labels(name).set(chart.item_count)
+        if (time.perf_counter() - frame_start) * 1000 > FRAME_INTERVAL_MS:
+            metrics.frame_overruns.inc()
@@ -1,5 +1,8 @@
 import tkinter as tk
 from abc import abstractmethod
+from typing import Callable, Optional
+
+from ..logic.trace import span
 
 
 class Chart(tk.Canvas):
@@ -11,6 +14,16 @@ class Chart(tk.Canvas):
         super().__init__(master, **kwargs)
 
         self.content_rect = (0, 0, 0, 0)
+        # 画布元素上一次设置的选项，避免重复 itemconfig
+        self._item_options: dict[int, dict] = {}
+        # 数据有变化、需要重绘
+        self.dirty = True
+        # 尺寸有变化、需要重建画布元素
+        self.needs_build = True
+        # 画布元素数，重建后统计一次；在 draw_chart 中增删元素的子类需要自己更新
+        self.item_count = 0
+        # 由 ChartManager 设置，统一调度尺寸变化后的重绘；未设置时图表自己在空闲时重绘
+        self.on_resize: Optional[Callable[[], None]] = None
         self.bind("<Configure>", self.on_configure)
 
     def on_configure(self, _event):
@@ -22,7 +35,38 @@ class Chart(tk.Canvas):
             self.winfo_width() - 2 * (border + highlight),
             self.winfo_height() - 2 * (border + highlight),
         )
-        self.after_idle(self.draw_chart)
+        # 尺寸变化时重建所有画布元素（在 render 中），draw_chart 只原地更新它们
+        self.needs_build = True
+        self.dirty = True
+        if self.on_resize is not None:
+            self.on_resize()
+        else:
+            self.after_idle(self.render)
+
+    def render(self):
+        """
+        需要时重建画布元素，数据有变化时重绘，否则什么也不做
+        """
+        if not (self.needs_build or self.dirty):
+            return
+        with span(getattr(self, "title", "") or type(self).__name__):
+            if self.needs_build:
+                self.needs_build = False
+                with span("build_chart"):
+                    self.draw_clear()
+                    self.build_chart()
+                    self.item_count = len(self.find_all())
+                self.dirty = True
+            if self.dirty:
+                self.dirty = False
+                with span("draw_chart"):
+                    self.draw_chart()
+
+    def build_chart(self):
+        """
+        创建图表的画布元素（网格、边框、标题等），只在尺寸变化时调用。
+        子类在这里创建元素，并在 draw_chart 中用 coords/itemconfig 原地更新
+        """
 
     @abstractmethod
     def draw_chart(self):
@@ -31,25 +75,26 @@ class Chart(tk.Canvas):
         """
         raise NotImplementedError("Subclasses must implement draw_chart method")
 
-    def draw_no_data(self):
+    def draw_no_data(self, state: str = "normal") -> int:
         content_x, content_y, content_w, content_h = self.content_rect
         text = "No Data"
         font_size_h = int(content_h * 0.2)
         max_char_width = 0.7
         font_size_w = int(content_w * 0.8 / (len(text) * max_char_width))
         font_size = max(12, min(font_size_h, font_size_w))
-        self.create_text(
+        return self.create_text(
             content_x + content_w // 2,
             content_y + content_h // 2,
             text=text,
             fill="gray",
             font=("Arial", font_size, "bold"),
+            state=state,
         )
 
-    def draw_border(self):
+    def draw_border(self) -> int:
         content_x, content_y, content_w, content_h = self.content_rect
         # 画边框
-        self.create_rectangle(
+        return self.create_rectangle(
             content_x,
             content_y,
             content_x + content_w - 1,
@@ -60,6 +105,17 @@ class Chart(tk.Canvas):
 
     def draw_clear(self):
         self.delete("all")
+        self._item_options.clear()
+
+    def update_item(self, item: int, **options):
+        """
+        只在选项（text、state、fill 等）与上次不同时才调用 itemconfig
+        """
+        cached = self._item_options.setdefault(item, {})
+        changed = {k: v for k, v in options.items() if cached.get(k) != v}
+        if changed:
+            self.itemconfig(item, **changed)
+            cached.update(changed)
 
 
 class EmptyChart(Chart):
@@ -0,0 +1,124 @@
+import math
+from bisect import bisect_right
+from collections import deque
+from itertools import chain, islice
+from typing import Sequence
+
+Point = tuple[float, float]
+
+
+class M4Downsampler:
+    """
+    Min/max-preserving M4 downsampling of a time series for one chart.
+
+    The time axis is cut into buckets of one pixel column each, aligned to an
+    absolute time grid (bucket index = floor(ts / bucket duration)), so the
+    buckets stay valid while the window scrolls. Each bucket keeps its first,
+    minimum, maximum and last point, which draws exactly like the raw points
+    at that width. The buckets are cached per (window, width) and each call
+    only reduces the points appended since the previous call. The last point
+    is never cached, because the history may replace it on the next call (the
+    open bucket of a rollup tier).
+    """
+
+    def __init__(self):
+        self.key: tuple[float, int] = (0.0, 0)
+        self.bucket_time = 0.0
+        # [index, first, min, max, last]，按 index 递增
+        self.buckets: deque[list] = deque()
+        self.last_time = -math.inf
+
+    def reset(self, window: float, width: int):
+        """
+        Drop all cached buckets.
+
+        Args:
+            window: The length of the time window in seconds.
+            width: The width of the chart in pixels.
+        """
+        self.key = (window, width)
+        self.bucket_time = window / width
+        self.buckets.clear()
+        self.last_time = -math.inf
+
+    def reduce(
+        self, values: Sequence[Point], start_time: float, end_time: float, width: int
+    ) -> list[Point]:
+        """
+        Reduce a series to at most 4 points per pixel column.
+
+        Args:
+            values: The points of the series, sorted by timestamp. New points
+                are expected to be appended at the end, only the last point
+                may be replaced.
+            start_time: The start time of the window.
+            end_time: The end time of the window.
+            width: The width of the chart in pixels.
+
+        Returns:
+            The reduced points, sorted by timestamp.
+        """
+        window = end_time - start_time
+        if not values or window <= 0 or width <= 0:
+            return []
+        if (window, width) != self.key or values[-1][0] < self.last_time:
+            self.reset(window, width)
+
+        # 只处理上次之后追加的点，最后一个点不进缓存
+        stable = len(values) - 1
+        first = bisect_right(values, self.last_time, 0, stable, key=_timestamp)
+        for point in values[first:stable]:
+            self.add(point)
+        if stable:
+            self.last_time = max(self.last_time, values[stable - 1][0])
+
+        # 丢弃窗口左边之外的桶，保留紧邻的一个以便折线从左边缘开始
+        first_index = math.floor(start_time / self.bucket_time) - 1
+        while self.buckets and self.buckets[0][0] < first_index:
+            self.buckets.popleft()
+
+        buckets = self.buckets
+        tail = values[-1]
+        if tail[0] > self.last_time:
+            index = math.floor(tail[0] / self.bucket_time)
+            if buckets and buckets[-1][0] == index:
+                # 把最后一个点合并到最新的桶的副本中
+                open_bucket = list(buckets[-1])
+                _merge(open_bucket, tail)
+                buckets = chain(islice(buckets, len(buckets) - 1), (open_bucket,))
+            else:
+                buckets = chain(buckets, ([index, tail, tail, tail, tail],))
+
+        reduced = []
+        for _, first, low, high, last in buckets:
+            if low[0] > high[0]:
+                low, high = high, low
+            for point in (first, low, high, last):
+                if not reduced or point != reduced[-1]:
+                    reduced.append(point)
+        return reduced
+
+    def add(self, point: Point):
+        """
+        Add one point to its bucket.
+
+        Args:
+            point: The (timestamp, value) point.
+        """
+        index = math.floor(point[0] / self.bucket_time)
+        if self.buckets and self.buckets[-1][0] == index:
+            _merge(self.buckets[-1], point)
+        else:
+            self.buckets.append([index, point, point, point, point])
+
+
+def _merge(bucket: list, point: Point):
+    if point[1] < bucket[2][1]:
+        bucket[2] = point
+    if point[1] > bucket[3][1]:
+        bucket[3] = point
+    bucket[4] = point
+
+
+def _timestamp(point: Point) -> float:
+    return point[0]
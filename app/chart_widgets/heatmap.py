@@ -1,9 +1,21 @@
+import math
+import tkinter as tk
+from typing import Sequence
+
 from .chart import Chart
+from .utils import rgb_to_hex
+
+PALETTE_SIZE = 256
 
 
 class Heatmap(Chart):
     """
     A class to represent a heatmap chart.
+
+    The heatmap is painted into a PhotoImage used as a ring buffer of pixel
+    columns: the column of a sample is its absolute time in pixels modulo the
+    image width, so each tick only paints the columns of the new samples.
+    The image is shown twice side by side and shifted to scroll the window.
     """
 
     def __init__(self, master=None, **kwargs):
@@ -21,13 +33,25 @@ class Heatmap(Chart):
 
         super().__init__(master, **kwargs)
 
-        self.values: list[tuple[float, list[float]]] = []
+        self.values: Sequence[tuple[float, Sequence[float]]] = ()
         self.start_time = 0
         self.end_time = 0
+        self.palette = self.build_palette()
+        self.background = rgb_to_hex(self.winfo_rgb(self["bg"]))
+
+        # 画布元素和图像，在 build_chart 中创建
+        self.image = None
+        self.image_items: tuple[int, int] = (0, 0)
+        self.no_data_item = None
+        self.grid_items: list[int] = []
+        # 已经画到图像中的状态，变化时需要整幅重画
+        self.painted_time = None
+        self.painted_window = 0.0
+        self.painted_rows = 0
 
     def update_values(
         self,
-        values: list[tuple[float, list[float]]],
+        values: Sequence[tuple[float, Sequence[float]]],
         start_time: float,
         end_time: float,
     ):
@@ -40,55 +64,51 @@ class Heatmap(Chart):
             end_time: The end time for the heatmap.
         """
 
+        if (
+            values != self.values
+            or start_time != self.start_time
+            or end_time != self.end_time
+        ):
+            self.dirty = True
         self.values = values
         self.start_time = start_time
         self.end_time = end_time
 
-    def draw_chart(self):
+    def build_palette(self) -> list[str]:
         """
-        Draw the heatmap chart.
-        This method should be overridden in subclasses to provide the actual drawing logic.
+        Precompute the colors of PALETTE_SIZE evenly spaced values.
+
+        Returns:
+            The colors as hex strings, from min_value to max_value.
+        """
+        step = (self.max_value - self.min_value) / (PALETTE_SIZE - 1)
+        return [self.get_color(self.min_value + i * step) for i in range(PALETTE_SIZE)]
+
+    def build_chart(self):
+        """
+        Create the image, the border and the title.
         """
         content_x, content_y, content_w, content_h = self.content_rect
+        self.painted_time = None
+        self.grid_items = []
 
-        if content_w <= 1 or content_h <= 1:
+        if content_w <= 3 or content_h <= 3:
+            self.image = None
             return
 
-        self.draw_clear()
-
-        # Draw the heatmap
-        if self.values and self.values[-1][0] > self.start_time:
-            for value in self.values:
-                timestamp, data = value
-                x = (
-                    int(
-                        (timestamp - self.start_time)
-                        / (self.end_time - self.start_time)
-                        * content_w
-                    )
-                    + content_x
-                )
-                for i, val in enumerate(data):
-                    val = max(self.min_value, min(val, self.max_value))
-                    h = int((content_h - 2) / len(data)) + 1
-                    w = int(content_w / 20)
-                    y = int(i * (content_h - 2) / len(data) + content_y + 1)
-                    color = self.get_color(val)
-                    self.create_rectangle(x, y, x + w, y + h, fill=color, outline="")
-            # 画内部网格
-            series_count = len(self.values[-1][1])
-            for i in range(1, series_count):
-                y = int(i * (content_h - 2) / series_count + content_y + 1)
-                self.create_line(
-                    content_x,
-                    y,
-                    content_x + content_w - 1,
-                    y,
-                    fill="lightgray",
-                    dash=(2, 2),
-                )
-        else:
-            self.draw_no_data()
+        # 图像在边框内侧
+        self.image = tk.PhotoImage(
+            master=self, width=content_w - 2, height=content_h - 2
+        )
+        self.image_items = (
+            self.create_image(
+                content_x + 1, content_y + 1, image=self.image, anchor="nw"
+            ),
+            self.create_image(
+                content_x + 1, content_y + 1, image=self.image, anchor="nw"
+            ),
+        )
+        self.no_data_item = self.draw_no_data(state="hidden")
         self.draw_border()
 
         # 画标题
@@ -100,6 +120,208 @@ class Heatmap(Chart):
                 anchor="nw",
             )
 
+    def build_grid(self, rows: int):
+        """
+        Recreate the grid lines between the rows when the row count changes.
+
+        Args:
+            rows: The number of rows (cores).
+        """
+        content_x, content_y, content_w, content_h = self.content_rect
+        for item in self.grid_items:
+            self.delete(item)
+        self.item_count -= len(self.grid_items)
+        self.grid_items = []
+        # 行太窄时（核心被合并）不画网格线
+        if rows <= 1 or (content_h - 2) / rows < 4:
+            return
+        for i in range(1, rows):
+            y = int(i * (content_h - 2) / rows + content_y + 1)
+            self.grid_items.append(
+                self.create_line(
+                    content_x,
+                    y,
+                    content_x + content_w - 1,
+                    y,
+                    fill="lightgray",
+                    dash=(2, 2),
+                )
+            )
+        self.item_count += len(self.grid_items)
+        # 网格线在图像之上、边框和标题之下
+        for item in self.grid_items + list(self.image_items):
+            self.tag_lower(item)
+
+    def draw_chart(self):
+        """
+        Paint the new samples into the image and scroll it to the current window.
+        """
+        content_x, content_y, content_w, content_h = self.content_rect
+
+        if self.image is None:
+            return
+
+        window = self.end_time - self.start_time
+        if not self.values or self.values[-1][0] <= self.start_time or window <= 0:
+            for item in self.image_items:
+                self.update_item(item, state="hidden")
+            self.update_item(self.no_data_item, state="normal")
+            return
+        self.update_item(self.no_data_item, state="hidden")
+        for item in self.image_items:
+            self.update_item(item, state="normal")
+
+        width = content_w - 2
+        rows = len(self.values[-1][1])
+        if (
+            self.painted_time is None
+            or window != self.painted_window
+            or rows != self.painted_rows
+            or self.values[-1][0] < self.painted_time
+        ):
+            self.repaint(window, rows)
+        else:
+            for timestamp, data in self.values[:-1]:
+                if timestamp > self.painted_time:
+                    self.paint_sample(timestamp, data)
+
+        # 最后一个样本可能在下一帧被替换（聚合层级中还没有结束的桶），
+        # 画出来但不推进 painted_time，下一帧从它之前重新画
+        painted_time = self.painted_time
+        timestamp, data = self.values[-1]
+        if timestamp > painted_time:
+            self.paint_sample(timestamp, data)
+        self.painted_time = painted_time
+
+        # 滚动：把最新的一列对齐到右边缘
+        offset = (self.to_pixel(self.end_time) + 1) % width
+        x = content_x + 1 - offset
+        self.coords(self.image_items[0], x, content_y + 1)
+        self.coords(self.image_items[1], x + width, content_y + 1)
+
+    def to_pixel(self, timestamp: float) -> int:
+        """
+        Convert an absolute timestamp to an absolute pixel column.
+
+        Args:
+            timestamp: The timestamp.
+
+        Returns:
+            The pixel column, the image column is this modulo the image width.
+        """
+        return math.floor(timestamp * (self.content_rect[2] - 2) / self.painted_window)
+
+    def repaint(self, window: float, rows: int):
+        """
+        Clear the image and paint all samples in the window but the last one.
+
+        Args:
+            window: The length of the time window in seconds.
+            rows: The number of rows (cores).
+        """
+        self.image.blank()
+        self.painted_window = window
+        if rows != self.painted_rows or not self.grid_items:
+            self.build_grid(rows)
+        self.painted_rows = rows
+        self.painted_time = None
+        for timestamp, data in self.values[:-1]:
+            if timestamp > self.start_time and len(data) == rows:
+                self.paint_sample(timestamp, data)
+        if self.painted_time is None:
+            self.painted_time = self.start_time
+
+    def paint_sample(self, timestamp: float, data: Sequence[float]):
+        """
+        Paint one sample as a column band ending at its timestamp. The columns
+        between the previous sample and this one are filled with it, or cleared
+        if there is a gap in the data.
+
+        Args:
+            timestamp: The timestamp of the sample.
+            data: The values of the sample, one per core.
+        """
+        column = self.to_pixel(timestamp)
+        cell = self.cell_width()
+        if self.painted_time is None:
+            start = column - cell
+        else:
+            start = self.to_pixel(self.painted_time)
+            if column - start > 2 * cell:
+                # 数据中断，清除中间的列
+                self.put_columns(self.background, start + 1, column - cell)
+                start = column - cell
+        self.painted_time = timestamp
+        if column <= start or len(data) != self.painted_rows:
+            return
+        self.put_columns(self.column_data(data), start + 1, column)
+
+    def cell_width(self) -> int:
+        """
+        The width in pixels of one sample, from the smallest spacing of the
+        last samples (so that a gap in the data is not taken as the spacing).
+        """
+        recent = [timestamp for timestamp, _ in self.values[-4:]]
+        if len(recent) < 2:
+            return 1
+        step = min(b - a for a, b in zip(recent, recent[1:]))
+        return max(1, round(step * (self.content_rect[2] - 2) / self.painted_window))
+
+    def put_columns(self, data: str, first: int, last: int):
+        """
+        Fill the absolute pixel columns first..last (inclusive) with data,
+        wrapping around the image width.
+
+        Args:
+            data: A PhotoImage data string of one column, or a single color.
+            first: The first absolute pixel column.
+            last: The last absolute pixel column.
+        """
+        width = self.content_rect[2] - 2
+        height = self.content_rect[3] - 2
+        if last < first:
+            return
+        if last - first + 1 >= width:
+            first = last - width + 1
+        if data.startswith("#"):
+            data = "{" + data + "}"
+        start = first % width
+        end = start + last - first + 1
+        # PhotoImage.put 会把一列数据平铺到 to 指定的区域
+        self.image.put(data, to=(start, 0, min(end, width), height))
+        if end > width:
+            self.image.put(data, to=(0, 0, end - width, height))
+
+    def column_data(self, data: Sequence[float]) -> str:
+        """
+        Build the PhotoImage data of one pixel column. When there are more
+        cores than pixel rows, each pixel row shows the maximum of its cores.
+
+        Args:
+            data: The values of the sample, one per core.
+
+        Returns:
+            The data string, one single-pixel row per line.
+        """
+        height = self.content_rect[3] - 2
+        rows = len(data)
+        scale = (PALETTE_SIZE - 1) / (self.max_value - self.min_value)
+        if rows > height:
+            binned = []
+            for y in range(height):
+                first = rows * y // height
+                last = max(rows * (y + 1) // height, first + 1)
+                binned.append(max(data[first:last]))
+            data = binned
+            rows = height
+        pixels = []
+        for i, val in enumerate(data):
+            index = round((val - self.min_value) * scale)
+            color = self.palette[max(0, min(index, PALETTE_SIZE - 1))]
+            band = (i + 1) * height // rows - i * height // rows
+            pixels.extend(("{" + color + "}",) * band)
+        return " ".join(pixels)
+
     def get_color(self, value: float) -> str:
         """
         Get the color for a given value.
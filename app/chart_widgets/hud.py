@@ -0,0 +1,136 @@
+from typing import Optional, Sequence
+
+from .chart import Chart
+
+# (stage name, count, total)
+StageTotal = tuple[str, float, float]
+
+# Timed stages shown on the HUD: (stage name, label, per tick). Stages run
+# once per target or per tick show their mean time; stages run once per
+# analyzer or chart show their summed time per tick.
+TIMED_STAGES = (
+    ("tick_duration", "tick", False),
+    ("scrape_duration", "scrape", False),
+    ("parse_duration", "parse", False),
+    ("analyzer_duration", "analyze", True),
+    ("snapshot_duration", "snapshot", False),
+    ("chart_draw_duration", "draw", True),
+)
+# Stages whose slowest label is shown: (stage name, label)
+SLOWEST_STAGES = (
+    ("analyzer_duration", "slowest analyzer"),
+    ("chart_draw_duration", "slowest chart"),
+)
+# Counters shown as the increase since the previous update: (stage name, label)
+EVENT_STAGES = (
+    ("tick_overruns", "tick overruns"),
+    ("skipped_ticks", "skipped ticks"),
+    ("dropped_snapshots", "dropped snapshots"),
+    ("frame_overruns", "frame overruns"),
+    ("scrape_failures", "scrape failures"),
+    ("collect_failures", "collect failures"),
+)
+
+
+class Hud(Chart):
+    """
+    An overlay listing the dashboard's own pipeline timings.
+
+    Each update receives the cumulative stage totals of the pipeline metrics
+    (observation count and summed seconds per stage). The HUD shows the time
+    of each stage since the previous update, so it follows the current load
+    instead of the average since start.
+    """
+
+    def __init__(self, master=None, **kwargs):
+        """
+        Initialize the HUD.
+
+        Args:
+            master: The parent widget.
+            **kwargs: Additional keyword arguments.
+        """
+        kwargs.setdefault("bg", "#202020")
+        super().__init__(master, **kwargs)
+
+        self.totals: dict[str, tuple[float, float]] = {}
+        self.lines: list[str] = []
+        # Canvas items, created in build_chart
+        self.text_item: Optional[int] = None
+
+    def update_values(self, stage_totals: Sequence[StageTotal]):
+        """
+        Update the HUD with new cumulative stage totals.
+
+        Args:
+            stage_totals: (stage, count, total) for every stage, where stage
+                is either an aggregate name or "name:label".
+        """
+        totals = {name: (count, total) for name, count, total in stage_totals}
+        previous, self.totals = self.totals, totals
+
+        def delta(name: str) -> tuple[float, float]:
+            count, total = totals.get(name, (0.0, 0.0))
+            old_count, old_total = previous.get(name, (0.0, 0.0))
+            return count - old_count, total - old_total
+
+        lines = []
+        ticks = delta("snapshot_duration")[0]
+        for name, label, per_tick in TIMED_STAGES:
+            count, total = delta(name)
+            if per_tick:
+                count = ticks if count else 0
+            text = f"{total / count * 1000:.2f} ms" if count else "-"
+            lines.append(f"{label:<10}{text:>10}")
+        for name, label in SLOWEST_STAGES:
+            slowest = max(
+                (
+                    (total / count, key.split(":", 1)[1])
+                    for key in totals
+                    if key.startswith(name + ":")
+                    for count, total in [delta(key)]
+                    if count
+                ),
+                default=None,
+            )
+            if slowest is not None:
+                lines.append(f"{label}: {slowest[1]} {slowest[0] * 1000:.2f} ms")
+        items = sum(
+            total
+            for key, (_, total) in totals.items()
+            if key.startswith("canvas_items:")
+        )
+        lines.append(f"{'items':<10}{int(items):>10}")
+        for name, label in EVENT_STAGES:
+            total = delta(name)[1]
+            if total:
+                lines.append(f"{label}: +{int(total)}")
+
+        if lines != self.lines:
+            self.dirty = True
+        self.lines = lines
+
+    def build_chart(self):
+        """
+        Create the text item.
+        """
+        content_x, content_y, content_w, content_h = self.content_rect
+        if content_w <= 1 or content_h <= 1:
+            self.text_item = None
+            return
+        self.text_item = self.create_text(
+            content_x + 4,
+            content_y + 4,
+            text="",
+            anchor="nw",
+            fill="#e0e0e0",
+            font=("Courier", 8),
+        )
+
+    def draw_chart(self):
+        """
+        Draw the HUD text.
+        """
+        if self.text_item is None:
+            return
+        self.update_item(self.text_item, text="\n".join(self.lines))
@@ -1,5 +1,6 @@
 import tkinter as tk
 from tkinter import ttk
+from typing import Sequence
 
 from .chart import Chart
 
@@ -27,6 +28,14 @@ class ProgressBar(Chart):
 
         super().__init__(master, **kwargs)
 
+        # Canvas items, created in build_chart
+        self.fill_item = None
+        self.empty_item = None
+        # Geometry and color of the last draw, to skip redundant updates
+        self.drawn_fill_width = None
+        self.drawn_width = None
+        self.drawn_fill_color = None
+
     def update_values(
         self,
         value: float,
@@ -37,56 +46,81 @@ class ProgressBar(Chart):
         Args:
             value: The new value to update the progress bar.
         """
+        if value != self.value:
+            self.dirty = True
         self.value = value
 
-    def draw_chart(self):
+    def build_chart(self):
         """
-        Draw the progress bar chart.
+        Create the canvas items of the progress bar.
         """
         content_x, content_y, content_w, content_h = self.content_rect
+        self.drawn_fill_width = None
+        self.drawn_width = None
+        self.drawn_fill_color = None
 
         if content_w <= 1 or content_h <= 1:
+            self.fill_item = None
             return
 
-        self.draw_clear()
+        # The filled part of the progress bar
+        self.fill_item = self.create_rectangle(0, 0, 0, 0, fill="", outline="")
+        # The non-filled part of the progress bar
+        self.empty_item = self.create_rectangle(0, 0, 0, 0, fill="#e6e6e6", outline="")
+        # The border
+        self.create_rectangle(
+            content_x,
+            content_y,
+            content_x + content_w - 1,
+            content_y + content_h - 1,
+            outline="#bcbcbc",
+            width=1,
+        )
+
+    def draw_chart(self):
+        """
+        Draw the progress bar chart.
+        """
+        content_x, content_y, content_w, content_h = self.content_rect
+
+        if content_w <= 1 or content_h <= 1 or self.fill_item is None:
+            return
 
-        # Draw the progress barfloat()
         self.value = max(self.min_value, min(self.value, self.max_value))
         progress = (self.value - self.min_value) / (self.max_value - self.min_value)
         progress = max(0.0, min(progress, 1.0))
         fill_width = round((content_w - 2) * progress)
-
-        # Draw the filled part of the progress bar
         fill_color = ""
         for level in self.level_color:
             if self.value <= level[0]:
                 fill_color = level[1]
                 break
-        self.create_rectangle(
+        if (
+            fill_width == self.drawn_fill_width
+            and content_w == self.drawn_width
+            and fill_color == self.drawn_fill_color
+        ):
+            return
+        self.drawn_fill_width = fill_width
+        self.drawn_width = content_w
+        self.drawn_fill_color = fill_color
+
+        # Update the filled part of the progress bar
+        self.coords(
+            self.fill_item,
             content_x + 1,
             content_y + 1,
             content_x + fill_width + 1,
             content_y + content_h - 1,
-            fill=fill_color,
-            outline="",
         )
-        # Draw the non-filled part of the progress bar
-        self.create_rectangle(
+        self.update_item(self.fill_item, fill=fill_color)
+        # Update the non-filled part of the progress bar
+        self.coords(
+            self.empty_item,
             content_x + fill_width + 1,
             content_y + 1,
             content_x + content_w - 2,
             content_y + content_h - 1,
-            fill="#e6e6e6",
-            outline="",
-        )
-        # Draw the border
-        self.create_rectangle(
-            content_x,
-            content_y,
-            content_x + content_w - 1,
-            content_y + content_h - 1,
-            outline="#bcbcbc",
-            width=1,
         )
 
 
@@ -109,8 +143,13 @@ class DiskProgressBars(Chart):
         self.disk_labels: list[ttk.Label] = []
         self.disk_size_labels: list[ttk.Label] = []
         self.disk_bars: list[ProgressBar] = []
+        # Texts currently shown by the labels, to skip redundant updates
+        self.disk_name_texts: list[str] = []
+        self.disk_size_texts: list[str] = []
         self.frame = tk.Frame(self)
-        self.disk_data: list[tuple[str, float, float]] = []
+        self.frame_visible = None
+        self.no_data_item = None
+        self.disk_data: Sequence[tuple[str, float, float]] = ()
 
         ttk.Label(
             self.frame,
@@ -129,16 +168,11 @@ class DiskProgressBars(Chart):
             _event: The event object.
         """
         super().on_configure(_event)
-        self.frame.place(
-            x=self.content_rect[0] + 1,
-            y=self.content_rect[1] + 1,
-            width=self.content_rect[2] - 2,
-            height=self.content_rect[3] - 2,
-        )
+        self.frame_visible = None
 
     def update_values(
         self,
-        disk_data: list[tuple[str, float, float]],
+        disk_data: Sequence[tuple[str, float, float]],
     ):
         """
         Update the disk progress bars with new values.
@@ -146,76 +180,21 @@ class DiskProgressBars(Chart):
         Args:
             disk_data: A list of tuples containing disk name, used space, and total space.
         """
+        if disk_data != self.disk_data:
+            self.dirty = True
         self.disk_data = disk_data
 
-    def draw_chart(self):
+    def build_chart(self):
+        """
+        Create the static canvas items: border, title and the "No Data" text.
+        """
         content_x, content_y, content_w, content_h = self.content_rect
 
         if content_w <= 1 or content_h <= 1:
+            self.no_data_item = None
             return
 
-        self.draw_clear()
-
-        if self.disk_data:
-            self.frame.place(
-                x=self.content_rect[0] + 1,
-                y=self.content_rect[1] + 1,
-                width=self.content_rect[2] - 2,
-                height=self.content_rect[3] - 2,
-            )
-
-            row = 1
-            for idx, (disk_name, free_space, total_space) in enumerate(self.disk_data):
-                percent = (total_space - free_space) / total_space * 100
-                value = round(percent)
-                if self.winfo_width() >= 170:
-                    disk_size = convert_bytes(total_space)
-                    free_size = convert_bytes(free_space)
-                    text = f"{free_size} / {disk_size} ({percent:.3g}%)"
-                elif self.winfo_width() >= 150:
-                    disk_size = convert_bytes2(free_space, total_space)
-                    text = f"{disk_size} ({percent:.3g}%)"
-                else:
-                    free_size = convert_bytes(free_space)
-                    text = f"{free_size} ({percent:.3g}%)"
-
-                if idx >= len(self.disk_bars):
-                    disk_size_label = ttk.Label(self.frame, text=text)
-                    disk_size_label.grid(
-                        row=row,
-                        column=0,
-                        columnspan=2,
-                        sticky=tk.E,
-                        padx=5,
-                        pady=(5, 0),
-                    )
-                    self.disk_size_labels.append(disk_size_label)
-                    row += 1
-
-                    label = ttk.Label(self.frame, text=disk_name)
-                    label.grid(row=row, column=0, sticky=tk.E, padx=(5, 2))
-                    self.disk_labels.append(label)
-                    progress_bar = ProgressBar(
-                        master=self.frame, value=value, height=15
-                    )
-                    progress_bar.grid(row=row, column=1, sticky=tk.EW, padx=(2, 5))
-                    self.disk_bars.append(progress_bar)
-                    row += 1
-                else:
-                    self.disk_size_labels[idx].config(text=text)
-                    self.disk_labels[idx].config(text=disk_name)
-                    self.disk_bars[idx].update_values(value)
-
-                self.disk_bars[idx].draw_chart()
-
-            if len(self.disk_bars) > len(self.disk_data):
-                for i in range(len(self.disk_data), len(self.disk_bars)):
-                    self.disk_bars[i].grid_forget()
-                    self.disk_bars[i].destroy()
-                self.disk_bars = self.disk_bars[: len(self.disk_data)]
-        else:
-            self.frame.place_forget()
-            self.draw_no_data()
+        self.no_data_item = self.draw_no_data(state="hidden")
         self.draw_border()
         # Draw the title
         if self.title:
@@ -226,6 +205,114 @@ class DiskProgressBars(Chart):
                 anchor="nw",
             )
 
+    def set_label_text(self, label: ttk.Label, texts: list[str], idx: int, text: str):
+        """
+        Update the text of a label only when it changed.
+
+        Args:
+            label: The label to update.
+            texts: The cached texts of the labels.
+            idx: The index of the label in the cache.
+            text: The new text.
+        """
+        if texts[idx] != text:
+            label.config(text=text)
+            texts[idx] = text
+
+    def show_frame(self, visible: bool):
+        """
+        Place or hide the frame holding the bars, only when its visibility changes.
+
+        Args:
+            visible: Whether the frame should be visible.
+        """
+        if visible == self.frame_visible:
+            return
+        self.frame_visible = visible
+        if visible:
+            self.frame.place(
+                x=self.content_rect[0] + 1,
+                y=self.content_rect[1] + 1,
+                width=self.content_rect[2] - 2,
+                height=self.content_rect[3] - 2,
+            )
+            self.update_item(self.no_data_item, state="hidden")
+        else:
+            self.frame.place_forget()
+            self.update_item(self.no_data_item, state="normal")
+
+    def draw_chart(self):
+        content_x, content_y, content_w, content_h = self.content_rect
+
+        if content_w <= 1 or content_h <= 1 or self.no_data_item is None:
+            return
+
+        self.show_frame(bool(self.disk_data))
+        if not self.disk_data:
+            return
+
+        width = self.winfo_width()
+        for idx, (disk_name, free_space, total_space) in enumerate(self.disk_data):
+            percent = (total_space - free_space) / total_space * 100
+            value = round(percent)
+            if width >= 170:
+                disk_size = convert_bytes(total_space)
+                free_size = convert_bytes(free_space)
+                text = f"{free_size} / {disk_size} ({percent:.3g}%)"
+            elif width >= 150:
+                disk_size = convert_bytes2(free_space, total_space)
+                text = f"{disk_size} ({percent:.3g}%)"
+            else:
+                free_size = convert_bytes(free_space)
+                text = f"{free_size} ({percent:.3g}%)"
+
+            if idx >= len(self.disk_bars):
+                row = 1 + 2 * idx
+                disk_size_label = ttk.Label(self.frame, text=text)
+                disk_size_label.grid(
+                    row=row,
+                    column=0,
+                    columnspan=2,
+                    sticky=tk.E,
+                    padx=5,
+                    pady=(5, 0),
+                )
+                self.disk_size_labels.append(disk_size_label)
+                self.disk_size_texts.append(text)
+
+                label = ttk.Label(self.frame, text=disk_name)
+                label.grid(row=row + 1, column=0, sticky=tk.E, padx=(5, 2))
+                self.disk_labels.append(label)
+                self.disk_name_texts.append(disk_name)
+                progress_bar = ProgressBar(master=self.frame, value=value, height=15)
+                progress_bar.grid(row=row + 1, column=1, sticky=tk.EW, padx=(2, 5))
+                self.disk_bars.append(progress_bar)
+            else:
+                self.set_label_text(
+                    self.disk_size_labels[idx], self.disk_size_texts, idx, text
+                )
+                self.set_label_text(
+                    self.disk_labels[idx], self.disk_name_texts, idx, disk_name
+                )
+                self.disk_bars[idx].update_values(value)
+
+            self.disk_bars[idx].render()
+
+        count = len(self.disk_data)
+        if len(self.disk_bars) > count:
+            for widget in (
+                self.disk_bars[count:]
+                + self.disk_labels[count:]
+                + self.disk_size_labels[count:]
+            ):
+                widget.grid_forget()
+                widget.destroy()
+            del self.disk_bars[count:]
+            del self.disk_labels[count:]
+            del self.disk_size_labels[count:]
+            del self.disk_name_texts[count:]
+            del self.disk_size_texts[count:]
+
 
 # 字节转 KB/MB/GB/TB/PB/EB
 def convert_bytes(num: float) -> str:
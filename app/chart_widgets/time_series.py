@@ -1,6 +1,8 @@
 import math
+from typing import Sequence
 
 from .chart import Chart
+from .downsample import M4Downsampler
 from .utils import rgb_to_hex, blend_color
 
 
@@ -16,69 +18,126 @@ class TimeSeries(Chart):
 
         super().__init__(master, **kwargs)
 
-        self.values: list[tuple[float, float]] = []
+        self.values: Sequence[tuple[float, float]] = ()
         self.start_time = 0
         self.end_time = 0
+        # 点数多于像素列时按 M4 降采样，缓存按 (窗口, 宽度) 增量更新
+        self.downsampler = M4Downsampler()
         self.fill = rgb_to_hex(
             blend_color(self.winfo_rgb(self.outline), self.winfo_rgb(self["bg"]), 0.25)
         )
 
+        # 画布元素，在 build_chart 中创建
+        self.grid_items: list[int] = []
+        self.polygon_item = None
+        self.no_data_item = None
+        self.value_item = None
+
     def update_values(
-            self,
-            values: list[tuple[float, float]],
-            start_time: float,
-            end_time: float,
+        self,
+        values: Sequence[tuple[float, float]],
+        start_time: float,
+        end_time: float,
     ):
+        if (
+            values != self.values
+            or start_time != self.start_time
+            or end_time != self.end_time
+        ):
+            self.dirty = True
         self.values = values
         self.start_time = start_time
         self.end_time = end_time
 
-    def draw_chart(self):
+    def build_chart(self):
         content_x, content_y, content_w, content_h = self.content_rect
 
         if content_w <= 1 or content_h <= 1:
+            self.polygon_item = None
             return
 
-        self.draw_clear()
+        # 竖直网格线随时间移动，在 draw_chart 中更新位置
+        self.grid_items = [
+            self.create_line(0, 0, 0, 0, fill="lightgray", dash=(2, 2))
+            for _ in range(10)
+        ]
+        # 水平网格线
+        for i in range(1, 10):
+            y = int(i * content_h / 10) + content_y
+            self.create_line(
+                content_x,
+                y,
+                content_x + content_w - 1,
+                y,
+                fill="lightgray",
+                dash=(2, 2),
+            )
+
+        # 填充折线（面积图）
+        self.polygon_item = self.create_polygon(
+            0,
+            0,
+            0,
+            0,
+            0,
+            0,
+            fill=self.fill,
+            outline=self.outline,
+            width=1,
+            state="hidden",
+        )
+        self.no_data_item = self.draw_no_data(state="hidden")
+
+        # 画边框
+        self.draw_border()
+
+        # 画标题
+        if self.title:
+            self.create_text(
+                content_x + 5,
+                content_y + 5,
+                text=self.title,
+                anchor="nw",
+            )
+        # 数值
+        self.value_item = self.create_text(
+            content_x + content_w - 5,
+            content_y + 5,
+            text="",
+            anchor="ne",
+        )
+
+    def draw_chart(self):
+        content_x, content_y, content_w, content_h = self.content_rect
+
+        if content_w <= 1 or content_h <= 1 or self.polygon_item is None:
+            return
 
-        # 画内部网格
+        # 更新竖直网格线
         dt = self.end_time - self.start_time
         offset = self.end_time % (dt / 10) if dt > 0 else 0
-        for i in range(0, 10):
+        for i, item in enumerate(self.grid_items):
             x = (
-                    int(((i + 1) / 10 - (offset / dt if dt > 0 else 0)) * content_w)
-                    + content_x
+                int(((i + 1) / 10 - (offset / dt if dt > 0 else 0)) * content_w)
+                + content_x
             )
-            self.create_line(
-                x,
-                content_y,
-                x,
-                content_y + content_h - 1,
-                fill="lightgray",
-                dash=(2, 2),
-            )
-            if i > 0:
-                y = int(i * content_h / 10) + content_y
-                self.create_line(
-                    content_x,
-                    y,
-                    content_x + content_w - 1,
-                    y,
-                    fill="lightgray",
-                    dash=(2, 2),
-                )
-
-        # 画填充折线（面积图）
+            self.coords(item, x, content_y, x, content_y + content_h - 1)
+
+        # 更新填充折线（面积图）
+        poly_coords = []
         if self.values and self.values[-1][0] > self.start_time and dt > 0:
-            # 计算所有点
-            points = []
-            for ts, val in self.values:
+            # 计算所有点（每个像素列最多 4 个点）
+            points = self.downsampler.reduce(
+                self.values, self.start_time, self.end_time, content_w
+            )
+            poly_coords = [0, content_y + content_h - 1]
+            for ts, val in points:
                 val = min(max(val, self.min_value), self.max_value)
                 x = int((ts - self.start_time) * content_w / dt) + content_x
                 if self.log_scale:
                     c = 10
                     norm = (math.log10(val + c) - math.log10(self.min_value + c)) / (
-                            math.log10(self.max_value + c) - math.log10(self.min_value + c)
+                        math.log10(self.max_value + c) - math.log10(self.min_value + c)
                     )
                 else:
                     norm = (
@@ -88,41 +147,23 @@ class TimeSeries(Chart):
                     )
                 y = int(content_h - norm * content_h + content_y)
 
-                points.append((x, y))
-            # 构造多边形点序列（首尾加底边）
-            if len(points) >= 2:
-                poly_points = (
-                        [(points[0][0], content_y + content_h - 1)]
-                        + points
-                        + [(points[-1][0], content_y + content_h - 1)]
-                )
-                # 转为一维坐标序列
-                poly_coords = [coord for point in poly_points for coord in point]
-                self.create_polygon(
-                    poly_coords, fill=self.fill, outline=self.outline, width=1
-                )
+                poly_coords += (x, y)
+            # 首尾加底边
+            poly_coords[0] = poly_coords[2]
+            poly_coords += (poly_coords[-2], content_y + content_h - 1)
+            self.update_item(self.no_data_item, state="hidden")
         else:
-            self.draw_no_data()
+            self.update_item(self.no_data_item, state="normal")
 
-        # 画边框
-        self.draw_border()
+        if len(poly_coords) >= 8:
+            self.coords(self.polygon_item, poly_coords)
+            self.update_item(self.polygon_item, state="normal")
+        else:
+            self.update_item(self.polygon_item, state="hidden")
 
-        # 画标题
-        if self.title:
-            self.create_text(
-                content_x + 5,
-                content_y + 5,
-                text=self.title,
-                anchor="nw",
-            )
-        # 画数值
+        # 更新数值
         if self.values and self.values[-1][0] == self.end_time:
             value_text = f"{self.values[-1][1]:.{self.decimal_places}f}{self.unit}"
         else:
             value_text = "No Data"
-        self.create_text(
-            content_x + content_w - 5,
-            content_y + 5,
-            text=value_text,
-            anchor="ne",
-        )
+        self.update_item(self.value_item, text=value_text)
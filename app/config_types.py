@@ -3,8 +3,21 @@ from typing import TypedDict
 
 class AppConfig(TypedDict):
     url: str
+    targets: list[str]  # 多目标模式下各 Exporter 的地址，为空时只采集 url
+    display_host: str  # 多目标模式下界面显示的目标（host:port），为空时显示第一个
     fullscreen: bool
     title: str
     refresh_interval: float  # 刷新间隔，单位为秒
     fetch_timeout: float  # 数据拉取超时时间，单位为秒
     history_length: int  # 历史数据窗口大小，单位为秒
+    history_tiers: list[list[float]]  # 聚合层级，每项为 [桶时长, 保留时长]，单位为秒
+    history_file: str  # 历史数据和分析器状态的内存映射文件，为空时只保存在内存中
+    history_max_series: int  # 子进程模式和 history_file 中最多保存的序列数
+    engine_mode: str  # "thread"：在线程中采集分析；"process"：在子进程中采集分析
+    expressions: dict[str, str]  # 派生指标：metric 名 -> 表达式（PromQL 的一个小子集）
+    analyzer_workers: int  # 并行运行独立分析器的线程数，0 表示在采集线程中依次运行
+    show_hud: bool  # 在右上角显示仪表盘自身各阶段耗时的 HUD
+    profile: str  # 把各阶段的 span 写入这个 Chrome trace 文件，为空时不记录
+    source: str  # "windows_exporter"：拉取 Windows 主机；"dashboard"：拉取无界面仪表盘的派生指标
+    headless: bool  # 不显示界面，只采集分析并通过 HTTP 提供 /metrics 和区间查询
+    listen: str  # 无界面模式监听的地址和端口
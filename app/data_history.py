@@ -1,13 +1,30 @@
-class DataHistoryManager:
-    def __init__(self):
-        # 用于保存历史数据，便于后续画图
-        self.cpu_history: list[tuple[float, float]] = []
-        self.memory_history: list[tuple[float, float]] = []
-        self.disk0_history: list[tuple[float, float]] = []
-        self.disk1_history: list[tuple[float, float]] = []
-        self.network_history_received: list[tuple[float, float]] = []
-        self.network_history_sent: list[tuple[float, float]] = []
-        self.cpu_heatmap_history: list[tuple[float, list[float]]] = []
-        self.memory_commit_history: list[tuple[float, float]] = []
-        self.logical_disk_space_values: list[tuple[str, float, float]] = []
-        self.gpu_history: list[tuple[float, float]] = []
+from typing import NamedTuple, Optional
+
+# (timestamp, value) 序列
+Points = tuple[tuple[float, float], ...]
+
+
+class DataSnapshot(NamedTuple):
+    """
+    一次刷新中界面要显示的全部数据。
+    在引擎线程中构建，构建完成后不再修改；界面线程整体替换当前快照，
+    图表只从快照中读取数据，两个线程之间不共享可变对象。
+    """
+
+    # 显示的时间窗口
+    start_time: float
+    end_time: float
+    cpu_history: Points = ()
+    memory_history: Points = ()
+    disk0_history: Points = ()
+    disk1_history: Points = ()
+    network_history_received: Points = ()
+    network_history_sent: Points = ()
+    # (timestamp, 各核心的使用率)
+    cpu_heatmap_history: tuple[tuple[float, tuple[float, ...]], ...] = ()
+    memory_commit_history: Points = ()
+    # (卷名, 可用空间, 总空间)，None 表示没有数据、保持图表不变
+    logical_disk_space_values: Optional[tuple[tuple[str, float, float], ...]] = None
+    gpu_history: Points = ()
+    # 仪表盘自身各阶段的累计值 (阶段, 次数, 合计)，只在显示 HUD 时提供
+    stage_totals: Optional[tuple[tuple[str, float, float], ...]] = None
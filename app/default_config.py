@@ -2,9 +2,23 @@ from app.config_types import AppConfig
 
 DEFAULT_CONFIG: AppConfig = {
     "url": "http://localhost:9182/metrics",
+    "targets": [],  # Multi-target mode: exporter URLs scraped concurrently
+    "display_host": "",  # Target (host:port) shown in multi-target mode
     "fullscreen": False,
     "title": "Monitoring Dashboard",
     "refresh_interval": 1.0,  # Refresh interval in seconds
     "fetch_timeout": 0.5,  # Data fetch timeout in seconds
     "history_length": 600,  # History length in seconds
+    # Rollup tiers for long windows: [bucket seconds, retention seconds]
+    "history_tiers": [[10, 21600], [60, 86400]],
+    "history_file": "",  # Memory-mapped history file kept across restarts ("" = off)
+    "history_max_series": 128,  # Series slots in process mode and in history_file
+    "engine_mode": "thread",  # "thread" or "process" (collect/analyze in a child process)
+    "expressions": {},  # Derived metrics: metric name -> PromQL-lite expression
+    "analyzer_workers": 0,  # Threads for independent analyzers (0 = run sequentially)
+    "show_hud": False,  # Overlay the dashboard's own pipeline timings
+    "profile": "",  # Chrome/Perfetto trace file of pipeline spans ("" = off)
+    "source": "windows_exporter",  # Or "dashboard": url/targets are headless dashboards
+    "headless": False,  # No UI: serve derived metrics over HTTP instead
+    "listen": "0.0.0.0:9183",  # Headless mode: address of /metrics and the query API
 }
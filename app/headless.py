@@ -0,0 +1,244 @@
+import json
+import logging
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from prometheus_client import CollectorRegistry, Metric, generate_latest
+from prometheus_client.registry import Collector
+from prometheus_client.utils import floatToGoString
+
+from .config_types import AppConfig
+from .logic.engine import MetricEngine
+from .pipeline import create_engine
+
+# 查询的选择器：metric 名，以及可选的 {label="value", ...}（只支持相等匹配）
+_SELECTOR_RE = re.compile(r"^\s*([a-zA-Z_:][a-zA-Z0-9_:]*)\s*(?:\{(.*)\})?\s*$")
+_MATCHER_RE = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*"((?:[^"\\]|\\.)*)"\s*,?')
+# 没有给出 start 时查询的时长（秒）
+DEFAULT_RANGE = 300.0
+
+
+def parse_selector(query: str) -> tuple[str, dict[str, str]]:
+    """
+    解析 cpu_usage_percent{core="0,1"} 这样的选择器
+    :return: (metric 名, labels)
+    """
+    match = _SELECTOR_RE.match(query)
+    if match is None:
+        raise ValueError(f"Invalid selector: {query!r}")
+    name, matchers = match.groups()
+    labels: dict[str, str] = {}
+    pos = 0
+    matchers = (matchers or "").strip()
+    while pos < len(matchers):
+        matcher = _MATCHER_RE.match(matchers, pos)
+        if matcher is None:
+            raise ValueError(f"Invalid label matcher in {query!r}")
+        label, value = matcher.groups()
+        labels[label] = re.sub(r"\\(.)", r"\1", value)
+        pos = matcher.end()
+    return name, labels
+
+
+class HistoryCollector(Collector):
+    """
+    把引擎历史数据中每个派生指标的最新值作为 Collector 提供。
+    样本不带时间戳，拉取方按自己的采集时间记录，与直接拉取 exporter 时一样。
+    """
+
+    def __init__(self, engine: MetricEngine):
+        self.engine = engine
+
+    def collect(self) -> list[Metric]:
+        history = self.engine.history
+
+        def latest() -> list[Metric]:
+            return [
+                history.to_metric(
+                    name,
+                    [s._replace(timestamp=None) for s in history.latest(name)],
+                )
+                for name in list(history.families)
+            ]
+
+        return [m for m in self.engine.read_history(latest) if m.samples]
+
+
+class HeadlessServer:
+    """
+    不使用 Tk，只运行采集和分析，并通过 HTTP 提供结果：
+    /metrics：派生指标的最新值和仪表盘自身的指标（Prometheus 文本格式）；
+    /api/v1/query_range：历史数据的区间查询（与 Prometheus HTTP API 相同的 JSON 格式）；
+    /api/v1/label/__name__/values：可以查询的 metric 名。
+    其他仪表盘把 source 设为 "dashboard" 后可以直接拉取 /metrics，共用这里的采集。
+    """
+
+    def __init__(self, app_config: AppConfig):
+        """
+        app_config: 应用配置，listen 为监听的 "地址:端口"
+        """
+        self.engine = create_engine(app_config)
+        self.registry = CollectorRegistry()
+        self.registry.register(HistoryCollector(self.engine))
+        # 派生指标的 /metrics 内容按采集时间缓存，多个拉取方共用
+        self._metrics_cache: tuple[Optional[float], bytes] = (None, b"")
+        host, _, port = app_config["listen"].rpartition(":")
+        self.server = ThreadingHTTPServer((host or "0.0.0.0", int(port)), _ApiHandler)
+        self.server.daemon_threads = True
+        self.server.headless = self
+        self._thread: Optional[Thread] = None
+
+    @property
+    def address(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        """
+        启动引擎，并在后台线程中开始服务
+        """
+        self.engine.start()
+        self._thread = Thread(
+            target=self.server.serve_forever, name="HeadlessServer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        停止服务和引擎
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        self.engine.stop()
+
+    def metrics_text(self) -> bytes:
+        """
+        /metrics 的内容：派生指标（同一次采集只生成一次）和仪表盘自身的指标
+        """
+        scrape_time = self.engine.get_last_scrape_time()
+        cached_time, text = self._metrics_cache
+        if cached_time is None or cached_time != scrape_time:
+            text = generate_latest(self.registry)
+            self._metrics_cache = (scrape_time, text)
+        return text + generate_latest(self.engine.pipeline_metrics.registry)
+
+    def metric_names(self) -> list[str]:
+        """
+        历史数据中的所有 metric 名
+        """
+        return self.engine.read_history(lambda: sorted(self.engine.history.families))
+
+    def query_range(
+        self,
+        query: str,
+        start_time: float,
+        end_time: float,
+        step: Optional[float] = None,
+    ) -> list[dict]:
+        """
+        区间查询，返回 Prometheus HTTP API 的 matrix 结果
+        :param query: 选择器，例如 cpu_usage_percent{core="0,1"}
+        :param start_time: 开始时间（时间戳）
+        :param end_time: 结束时间（时间戳）
+        :param step: 期望的点间隔（秒），用于选择聚合层级，None 表示尽量使用原始数据
+        """
+        name, labels = parse_selector(query)
+        width = int((end_time - start_time) / step) if step else None
+
+        def query_series() -> list[dict]:
+            # 在读取锁内把视图中的数据转换出来
+            return [
+                {
+                    "metric": {"__name__": name, **series.labels},
+                    "values": [
+                        [timestamp, floatToGoString(value)]
+                        for timestamp, value in zip(series.timestamps, series.values)
+                    ],
+                }
+                for series in self.engine.history.query(
+                    name, start_time, end_time, labels or None, width
+                )
+            ]
+
+        return self.engine.read_history(query_series)
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    server: ThreadingHTTPServer
+
+    def do_GET(self):
+        headless: HeadlessServer = getattr(self.server, "headless")
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            self._send(
+                200, "text/plain; version=0.0.4; charset=utf-8", headless.metrics_text()
+            )
+        elif url.path == "/api/v1/query_range":
+            self._query_range(headless, parse_qs(url.query))
+        elif url.path == "/api/v1/label/__name__/values":
+            self._send_json(200, {"status": "success", "data": headless.metric_names()})
+        else:
+            self.send_error(404)
+
+    def _query_range(self, headless: HeadlessServer, params: dict[str, list[str]]):
+        def param(key: str) -> Optional[str]:
+            values = params.get(key)
+            return values[-1] if values else None
+
+        try:
+            query = param("query")
+            if not query:
+                raise ValueError("Missing query")
+            end_time = float(param("end") or time.time())
+            start_time = float(param("start") or end_time - DEFAULT_RANGE)
+            step = float(param("step")) if param("step") else None
+            if end_time < start_time:
+                raise ValueError("end is before start")
+            if step is not None and step <= 0:
+                raise ValueError("step must be positive")
+            result = headless.query_range(query, start_time, end_time, step)
+        except ValueError as e:
+            self._send_json(
+                400, {"status": "error", "errorType": "bad_data", "error": str(e)}
+            )
+            return
+        self._send_json(
+            200,
+            {"status": "success", "data": {"resultType": "matrix", "result": result}},
+        )
+
+    def _send_json(self, status: int, data: dict):
+        self._send(status, "application/json", json.dumps(data).encode("utf-8"))
+
+    def _send(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+def run_headless(app_config: AppConfig):
+    """
+    以无界面模式运行，直到 Ctrl+C
+    """
+    logging.basicConfig(level=logging.INFO)
+    server = HeadlessServer(app_config)
+    server.start()
+    logging.info(f"Serving /metrics and /api/v1/query_range on {server.address}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
@@ -1,12 +1,45 @@
 import re
 import statistics
 from collections import defaultdict
-from typing import Iterable
+from typing import Any, Iterable, Optional, Sequence
 
 from prometheus_client import Metric
 from prometheus_client.samples import Sample
 
+from .counters import HAS_NUMPY, BusyRatioCounters
 from .index import avg_by, sum_by, filter_by_labels
+from .parse import label_values, sample_values
+
+# 编码后的字典中，以 tuple 为 key 的条目保存在这个字段中
+_TUPLE_ITEMS = "__tuple_items__"
+
+
+def counter_delta(current: float, previous: float) -> float:
+    """
+    计算计数器的增量。
+    计数器变小说明被重置过（例如被监控的主机重启），此时增量为当前值
+    """
+    if current < previous:
+        return current
+    return current - previous
+
+
+def encode_state(value: Any) -> Any:
+    """
+    把状态转换为可以 JSON 序列化的形式（以 tuple 为 key 的字典转换为条目列表）
+    """
+    if isinstance(value, dict) and any(isinstance(k, tuple) for k in value):
+        return {_TUPLE_ITEMS: [[list(k), v] for k, v in value.items()]}
+    return value
+
+
+def decode_state(value: Any) -> Any:
+    """
+    encode_state 的逆操作
+    """
+    if isinstance(value, dict) and _TUPLE_ITEMS in value:
+        return {tuple(k): v for k, v in value[_TUPLE_ITEMS]}
+    return value
 
 
 class MetricAnalyzer:
@@ -14,6 +47,32 @@ class MetricAnalyzer:
     读取采集到的所有 metrics，分析并生成新的 metrics。
     """
 
+    # 分析器需要读取的 MetricFamily 名，引擎会把所有分析器的 inputs 合并后下推给采集器，
+    # 采集器只解析这些 family。为空表示需要全部 family。
+    inputs: tuple[str, ...] = ()
+
+    # 分析器生成的 metric 名。其他分析器的 inputs 中包含这些名字时，
+    # 引擎会先运行本分析器，再把结果交给下游分析器（见 MetricEngine）
+    outputs: tuple[str, ...] = ()
+
+    # 需要随历史数据一起保存的状态（属性名），重启后恢复，
+    # 这样计数器类的分析器在重启后的第一次分析也能得到正确的增量
+    state_attrs: tuple[str, ...] = ()
+
+    def get_state(self) -> dict[str, Any]:
+        """
+        返回可以 JSON 序列化的状态
+        """
+        return {name: encode_state(getattr(self, name)) for name in self.state_attrs}
+
+    def set_state(self, state: dict[str, Any]):
+        """
+        恢复 get_state 返回的状态
+        """
+        for name in self.state_attrs:
+            if name in state:
+                setattr(self, name, decode_state(state[name]))
+
     def analyze(
         self, metrics: dict[str, Metric], scrape_time: float
     ) -> Iterable[Metric]:
@@ -29,15 +88,33 @@ class CpuUsageAnalyzer(MetricAnalyzer):
     分析 CPU 使用率
     """
 
-    def __init__(self, mode_exclude=("idle",)):
+    inputs = ("windows_cpu_time",)
+    outputs = ("cpu_usage_percent",)
+    state_attrs = ("prev_values",)
+
+    def __init__(self, mode_exclude=("idle",), use_numpy: Optional[bool] = None):
         """
         mode_exclude: 排除的 CPU 模式（如 idle）
+        use_numpy: 是否用 NumPy 向量化计算（核心数多时更快），None 表示已安装时使用
         """
 
         self.prev_values: dict[tuple[str, str], float] = (
             {}
         )  # key: (core, mode), value: (value, timestamp)
         self.mode_exclude = mode_exclude
+        self.use_numpy = HAS_NUMPY if use_numpy is None else use_numpy
+        # 向量化计算时上一次的值保存在这里，get_state 时同步到 prev_values
+        self._counters: Optional[BusyRatioCounters[tuple[str, str]]] = None
+
+    def get_state(self) -> dict[str, Any]:
+        if self._counters is not None:
+            self.prev_values = self._counters.counters()
+        return super().get_state()
+
+    def set_state(self, state: dict[str, Any]):
+        super().set_state(state)
+        # 按恢复的 prev_values 重建
+        self._counters = None
 
     def analyze(
         self, metrics: dict[str, Metric], scrape_time: float
@@ -51,8 +128,11 @@ class CpuUsageAnalyzer(MetricAnalyzer):
         if not cpu_usage_metric:
             return []
 
-        # 2. 计算 CPU 使用率
-        cpu_usage = self.calculate_cpu_usage(cpu_usage_metric.samples)
+        # 2. 计算 CPU 使用率（直接读取 label 值和数值，不创建 Sample）
+        cpu_usage = self.calculate_cpu_usage_from(
+            label_values(cpu_usage_metric, "core", "mode"),
+            sample_values(cpu_usage_metric),
+        )
 
         # 3. 返回新的指标
         new_metric = Metric("cpu_usage_percent", "CPU Usage Percentage", "gauge")
@@ -72,20 +152,37 @@ class CpuUsageAnalyzer(MetricAnalyzer):
         samples: CPU 使用率指标的样本列表
         返回：每个 CPU 核心的使用率（百分比）
         """
+        samples = list(samples)
+        return self.calculate_cpu_usage_from(
+            [(s.labels.get("core"), s.labels.get("mode")) for s in samples],
+            [float(s.value) for s in samples],
+        )
+
+    def calculate_cpu_usage_from(
+        self, keys: list[tuple[str, str]], counters: Sequence[float]
+    ) -> dict[str, float]:
+        """
+        计算CPU使用率（百分比）
+        keys: 每个样本的 (core, mode)
+        counters: 每个样本的值
+        返回：每个 CPU 核心的使用率（百分比）
+        """
+        if self.use_numpy:
+            return self._calculate_cpu_usage_numpy(keys, counters)
 
         # 1. 收集 values
         values: dict[tuple[str, str], list[float]] = defaultdict(list)
-        for sample in samples:
-            core = sample.labels.get("core")
-            mode = sample.labels.get("mode")
-            values[(core, mode)].append(float(sample.value))
+        for key, value in zip(keys, counters):
+            values[key].append(value)
 
         # 2. 统计 usages 和 totals
         usages: dict[str, float] = defaultdict(float)
         totals: dict[str, float] = defaultdict(float)
         for (core, mode), value_list in values.items():
             avg_value = statistics.mean(value_list)
-            delta = avg_value - self.prev_values.get((core, mode), avg_value)
+            delta = counter_delta(
+                avg_value, self.prev_values.get((core, mode), avg_value)
+            )
             self.prev_values[(core, mode)] = avg_value
 
             totals[core] += delta
@@ -100,12 +197,32 @@ class CpuUsageAnalyzer(MetricAnalyzer):
 
         return usages_rate
 
+    def _calculate_cpu_usage_numpy(
+        self, keys: list[tuple[str, str]], counters: Sequence[float]
+    ) -> dict[str, float]:
+        """
+        calculate_cpu_usage_from 的向量化实现，结果相同
+        """
+        if self._counters is None:
+            self._counters = BusyRatioCounters(
+                group=lambda key: key[0],
+                busy=lambda key: key[1] not in self.mode_exclude,
+                initial=self.prev_values,
+            )
+        return self._counters.update(keys, counters)
+
 
 class MemoryUsageAnalyzer(MetricAnalyzer):
     """
     分析内存使用率
     """
 
+    inputs = (
+        "windows_memory_physical_free_bytes",
+        "windows_memory_physical_total_bytes",
+    )
+    outputs = ("memory_usage_percent",)
+
     def analyze(
         self, metrics: dict[str, Metric], scrape_time: float
     ) -> Iterable[Metric]:
@@ -145,8 +262,32 @@ class PhysicalDiskActiveTimeAnalyzer(MetricAnalyzer):
     分析物理磁盘活动时间
     """
 
-    def __init__(self):
+    inputs = (
+        "windows_physical_disk_idle_seconds",
+        "windows_physical_disk_read_seconds",
+        "windows_physical_disk_write_seconds",
+    )
+    outputs = ("disk_io_util_percent",)
+    state_attrs = ("last_disk_counters",)
+
+    def __init__(self, use_numpy: Optional[bool] = None):
+        """
+        use_numpy: 是否用 NumPy 向量化计算（磁盘多时更快），None 表示已安装时使用
+        """
         self.last_disk_counters: dict[tuple[str, str], float] = {}
+        self.use_numpy = HAS_NUMPY if use_numpy is None else use_numpy
+        # 向量化计算时上一次的值保存在这里，get_state 时同步到 last_disk_counters
+        self._counters: Optional[BusyRatioCounters[tuple[str, str]]] = None
+
+    def get_state(self) -> dict[str, Any]:
+        if self._counters is not None:
+            self.last_disk_counters = self._counters.counters()
+        return super().get_state()
+
+    def set_state(self, state: dict[str, Any]):
+        super().set_state(state)
+        # 按恢复的 last_disk_counters 重建
+        self._counters = None
 
     def analyze(
         self, metrics: dict[str, Metric], scrape_time: float
@@ -161,13 +302,24 @@ class PhysicalDiskActiveTimeAnalyzer(MetricAnalyzer):
         if not idle_metric or not read_metric or not write_metric:
             return
 
+        # 每个样本的 (kind, disk) 和值，直接读取 label 值和数值，不创建 Sample
+        keys: list[tuple[str, str]] = []
+        counters: list[float] = []
+        for kind, metric in (
+            ("idle", idle_metric),
+            ("read", read_metric),
+            ("write", write_metric),
+        ):
+            keys += [(kind, disk) for (disk,) in label_values(metric, "disk")]
+            counters += sample_values(metric)
+
+        if self.use_numpy:
+            yield self._analyze_numpy(keys, counters, scrape_time)
+            return
+
         values: dict[str, dict[str, float]] = defaultdict(dict)
-        for sample in idle_metric.samples:
-            values[sample.labels.get("disk")]["idle"] = float(sample.value)
-        for sample in read_metric.samples:
-            values[sample.labels.get("disk")]["read"] = float(sample.value)
-        for sample in write_metric.samples:
-            values[sample.labels.get("disk")]["write"] = float(sample.value)
+        for (kind, disk), value in zip(keys, counters):
+            values[disk][kind] = value
 
         new_metric = Metric(
             "disk_io_util_percent", "Disk IO Utilization Percentage", "gauge"
@@ -177,14 +329,17 @@ class PhysicalDiskActiveTimeAnalyzer(MetricAnalyzer):
         for disk, sample in values.items():
 
             # 3. 计算采集间隔内的增量（需有历史数据，假设你有 self.last_disk_counters）
-            delta_idle = sample["idle"] - self.last_disk_counters.get(
-                ("idle", disk), sample["idle"]
+            delta_idle = counter_delta(
+                sample["idle"],
+                self.last_disk_counters.get(("idle", disk), sample["idle"]),
             )
-            delta_read = sample["read"] - self.last_disk_counters.get(
-                ("read", disk), sample["read"]
+            delta_read = counter_delta(
+                sample["read"],
+                self.last_disk_counters.get(("read", disk), sample["read"]),
             )
-            delta_write = sample["write"] - self.last_disk_counters.get(
-                ("write", disk), sample["write"]
+            delta_write = counter_delta(
+                sample["write"],
+                self.last_disk_counters.get(("write", disk), sample["write"]),
             )
             total = delta_idle + delta_read + delta_write
             io_util = (delta_read + delta_write) / total * 100 if total > 0 else 0.0
@@ -204,12 +359,42 @@ class PhysicalDiskActiveTimeAnalyzer(MetricAnalyzer):
 
         yield new_metric
 
+    def _analyze_numpy(
+        self, keys: list[tuple[str, str]], counters: list[float], scrape_time: float
+    ) -> Metric:
+        """
+        analyze 的向量化实现，结果相同
+        keys: 每个样本的 (kind, disk)
+        counters: 每个样本的值
+        """
+        if self._counters is None:
+            self._counters = BusyRatioCounters(
+                group=lambda key: key[1],
+                busy=lambda key: key[0] != "idle",
+                initial=self.last_disk_counters,
+            )
+        new_metric = Metric(
+            "disk_io_util_percent", "Disk IO Utilization Percentage", "gauge"
+        )
+        for disk, io_util in self._counters.update(keys, counters).items():
+            new_metric.add_sample(
+                "disk_io_util_percent",
+                {"disk": disk},
+                value=io_util,
+                timestamp=scrape_time,
+            )
+        return new_metric
+
 
 class NetworkSpeedAnalyzer(MetricAnalyzer):
     """
     分析网络速度
     """
 
+    inputs = ("windows_net_bytes",)
+    outputs = ("network_speed_mbps",)
+    state_attrs = ("last_network_counters", "last_network_time")
+
     def __init__(self):
         self.last_network_counters: float = 0.0
         self.last_network_time: float = 0.0
@@ -232,7 +417,7 @@ class NetworkSpeedAnalyzer(MetricAnalyzer):
             scrape_time - self.last_network_time if self.last_network_time else 0.0
         )
         delta_bytes = (
-            network_counters - self.last_network_counters
+            counter_delta(network_counters, self.last_network_counters)
             if self.last_network_counters
             else 0.0
         )
@@ -260,6 +445,12 @@ class MemoryCommitAnalyzer(MetricAnalyzer):
     分析内存提交率
     """
 
+    inputs = (
+        "windows_memory_committed_bytes",
+        "windows_memory_commit_limit",
+    )
+    outputs = ("memory_commit_rate_percent",)
+
     def analyze(
         self, metrics: dict[str, Metric], scrape_time: float
     ) -> Iterable[Metric]:
@@ -299,6 +490,10 @@ class NetworkSpeedAnalyzerV2(MetricAnalyzer):
     分析网络速度
     """
 
+    inputs = ("windows_net_bytes_received", "windows_net_bytes_sent")
+    outputs = ("network_speed_mbps",)
+    state_attrs = ("last_network_counters", "last_network_time")
+
     def __init__(self):
         self.last_network_counters: dict[str, float] = {}
         self.last_network_time: float = 0.0
@@ -323,7 +518,10 @@ class NetworkSpeedAnalyzerV2(MetricAnalyzer):
             scrape_time - self.last_network_time if self.last_network_time else 0.0
         )
         network_speed_received = (
-            (network_received_counters - self.last_network_counters.get("received", 0))
+            counter_delta(
+                network_received_counters,
+                self.last_network_counters.get("received", 0),
+            )
             / delta_time
             * 8
             / 1024
@@ -332,7 +530,9 @@ class NetworkSpeedAnalyzerV2(MetricAnalyzer):
             else 0.0
         )
         network_speed_sent = (
-            (network_sent_counters - self.last_network_counters.get("sent", 0))
+            counter_delta(
+                network_sent_counters, self.last_network_counters.get("sent", 0)
+            )
             / delta_time
             * 8
             / 1024
@@ -367,6 +567,12 @@ class LogicalDiskSizeAnalyzer(MetricAnalyzer):
     分析逻辑磁盘大小
     """
 
+    inputs = (
+        "windows_logical_disk_free_bytes",
+        "windows_logical_disk_size_bytes",
+    )
+    outputs = ("logical_disk_size_bytes", "logical_disk_free_bytes")
+
     def __init__(self):
         self.filter_pattern = re.compile(r"^[A-Z]:$")
 
@@ -431,6 +637,10 @@ class GpuUsageAnalyzer(MetricAnalyzer):
     分析 GPU 使用率
     """
 
+    inputs = ("windows_gpu_engine_time_seconds",)
+    outputs = ("gpu_usage_percent",)
+    state_attrs = ("prev_gpu_seconds", "prev_scrape_time")
+
     def __init__(self, device="0"):
         """
         device: 指定 GPU 设备编号，默认为 "0"
@@ -451,8 +661,19 @@ class GpuUsageAnalyzer(MetricAnalyzer):
         if not gpu_usage_metric:
             return []
 
-        # 2. 计算 GPU 使用率
-        gpu_usage = self.calculate_gpu_usage(gpu_usage_metric.samples, scrape_time)
+        # 2. 计算 GPU 使用率（直接读取 label 值和数值，不创建 Sample）
+        engine = (self.device, "0")
+        gpu_usage = self.calculate_gpu_usage_from(
+            sum(
+                value
+                for key, value in zip(
+                    label_values(gpu_usage_metric, "phys", "eng"),
+                    sample_values(gpu_usage_metric),
+                )
+                if key == engine
+            ),
+            scrape_time,
+        )
 
         # 3. 返回新的指标
         new_metric = Metric("gpu_usage_percent", "GPU Usage Percentage", "gauge")
@@ -482,16 +703,49 @@ class GpuUsageAnalyzer(MetricAnalyzer):
                 )
             )
         ).value
+        return self.calculate_gpu_usage_from(current_gpu_seconds, scrape_time)
 
-        # 2. 计算增量和时间差
-        delta_gpu_seconds = current_gpu_seconds - self.prev_gpu_seconds
+    def calculate_gpu_usage_from(
+        self, current_gpu_seconds: float, scrape_time: float
+    ) -> float:
+        """
+        计算 GPU 使用率（百分比）
+        current_gpu_seconds: 该设备 0 号引擎（eng="0"）的累计时间之和
+        scrape_time: 当前采集时间
+        返回：GPU 使用率（百分比）
+        """
+        # 1. 计算增量和时间差
+        delta_gpu_seconds = counter_delta(current_gpu_seconds, self.prev_gpu_seconds)
         delta_time = scrape_time - self.prev_scrape_time
 
-        # 3. 计算 GPU 使用率
+        # 2. 计算 GPU 使用率
         gpu_usage = (delta_gpu_seconds / delta_time * 100) if delta_time > 0 else 0.0
 
-        # 4. 更新历史数据
+        # 3. 更新历史数据
         self.prev_gpu_seconds = current_gpu_seconds
         self.prev_scrape_time = scrape_time
 
         return gpu_usage
+
+
+class PassthroughAnalyzer(MetricAnalyzer):
+    """
+    原样输出采集到的指定 metric。
+    数据源已经是派生指标时使用（例如无界面运行的另一个仪表盘的 /metrics），
+    这样多个显示端可以共用一个采集端，不必各自拉取 Windows 主机。
+    """
+
+    def __init__(self, names: Iterable[str]):
+        """
+        names: 原样输出的 metric 名
+        """
+        self.inputs = self.outputs = tuple(dict.fromkeys(names))
+
+    def analyze(
+        self, metrics: dict[str, Metric], scrape_time: float
+    ) -> Iterable[Metric]:
+        """
+        metrics: 采集到的所有 MetricFamily 或 Sample
+        返回：names 中存在的 MetricFamily
+        """
+        return [metrics[name] for name in self.outputs if name in metrics]
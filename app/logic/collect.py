@@ -1,12 +1,162 @@
+import asyncio
 import logging
 import time
-from typing import Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Collection, Iterable, Optional, Union
+from urllib.parse import urlsplit
 
 import requests
 from prometheus_client import Metric
-from prometheus_client.parser import text_string_to_metric_families
 from prometheus_client.registry import Collector
 
+from .index import HOST_LABEL
+from .instrument import PipelineMetrics
+from .parse import (
+    CompactFamily,
+    FamilyGroup,
+    LabelSetTable,
+    filter_exposition_text,
+    parse_compact,
+)
+from .protobuf import SCRAPE_ACCEPT, is_protobuf, parse_delimited
+from .session import ScrapeSession, ScrapeStats
+from .trace import span
+
+# 期限将到时请求的最短超时（秒）
+MIN_TIMEOUT = 0.05
+# 连续这么多个采集周期没有成功拉取的目标视为过期
+STALE_TICKS = 2
+# 拉取时的请求头：协商 protobuf 格式
+SCRAPE_HEADERS = {"Accept": SCRAPE_ACCEPT}
+# windows_exporter 的 collector，它们输出的 family 名为 windows_<collector>_...
+EXPORTER_COLLECTORS = (
+    "cpu",
+    "cpu_info",
+    "cs",
+    "gpu",
+    "logical_disk",
+    "memory",
+    "net",
+    "os",
+    "physical_disk",
+    "process",
+    "service",
+    "system",
+    "tcp",
+    "thermalzone",
+)
+
+
+def exporter_collectors(
+    families: Optional[Collection[str]],
+) -> Optional[tuple[str, ...]]:
+    """
+    读取这些 family 需要 windows_exporter 运行哪些 collector
+    :param families: family 名集合，None 表示需要全部
+    :return: collector 名（已排序）；需要全部，或有 family 不属于已知的 collector 时返回 None
+    """
+    if not families:
+        return None
+    collectors = set()
+    for family in families:
+        matches = [c for c in EXPORTER_COLLECTORS if family.startswith(f"windows_{c}_")]
+        if not matches:
+            return None
+        # windows_cpu_info_... 属于 cpu_info 而不是 cpu
+        collectors.add(max(matches, key=len))
+    return tuple(sorted(collectors))
+
+
+def collect_params(
+    families: Optional[Collection[str]],
+) -> Optional[dict[str, list[str]]]:
+    """
+    请求的查询参数：用 collect[] 让 windows_exporter 只运行需要的 collector，
+    减少 Windows 主机上的开销和响应大小。无法确定需要哪些 collector 时返回 None
+    """
+    collectors = exporter_collectors(families)
+    if collectors is None:
+        return None
+    return {"collect[]": list(collectors)}
+
+
+def fetch_exposition(
+    session: ScrapeSession,
+    url: str,
+    timeout: float,
+    params: Optional[dict[str, list[str]]],
+) -> tuple[requests.Response, bytes, Optional[dict[str, list[str]]]]:
+    """
+    拉取一次 exporter 的数据。windows_exporter 对 collect[] 中未启用的 collector
+    返回 400，此时不带查询参数重试一次，之后这个目标也不再带参数
+    :param params: 请求的查询参数（collect[]）
+    :return: (响应, 解压后的响应体, 之后使用的查询参数)
+    :raises requests.RequestException: 请求失败
+    """
+    try:
+        resp, body = session.get(
+            url, headers=SCRAPE_HEADERS, timeout=timeout, params=params
+        )
+    except requests.HTTPError as e:
+        status = e.response.status_code if e.response is not None else 0
+        if params is None or not 400 <= status < 500:
+            raise
+        logging.warning(
+            f"{url} rejected the collector filter (HTTP {status}), "
+            f"scraping all collectors from now on"
+        )
+        params = None
+        resp, body = session.get(url, headers=SCRAPE_HEADERS, timeout=timeout)
+    return resp, body, params
+
+
+def request_timeout(timeout: float, deadline: Optional[float]) -> float:
+    """
+    一次请求的超时：不超过配置的 timeout，也不超过引擎给出的这次采集的期限
+    :param timeout: 配置的超时（秒）
+    :param deadline: 这次采集的期限（时间戳），None 表示没有期限
+    """
+    if deadline is None:
+        return timeout
+    return max(MIN_TIMEOUT, min(timeout, deadline - time.time()))
+
+
+def parse_response(
+    resp: requests.Response,
+    body: bytes,
+    metric_filter: Optional[frozenset[str]],
+    table: LabelSetTable,
+) -> list[CompactFamily]:
+    """
+    按响应的 Content-Type 解析 protobuf 或文本格式的数据
+    :param metric_filter: 只解析这些 family，None 表示解析全部
+    :param table: 采集器的驻留表
+    """
+    if is_protobuf(resp.headers.get("Content-Type", "")):
+        return list(parse_delimited(body, table, metric_filter))
+    text = body.decode("utf-8", errors="replace")
+    if metric_filter is not None:
+        text = filter_exposition_text(text, metric_filter)
+    return list(parse_compact(text, table))
+
+
+def observe_scrape(
+    pipeline_metrics: Optional[PipelineMetrics],
+    target: str,
+    stats: Optional[ScrapeStats],
+    parse_duration: float,
+):
+    """
+    记录一次成功拉取的耗时、响应大小和解析耗时
+    """
+    if pipeline_metrics is None:
+        return
+    if stats is not None:
+        pipeline_metrics.scrape_duration.labels(target).observe(stats.total_time)
+        pipeline_metrics.scrape_bytes.labels(target).observe(stats.body_bytes)
+        pipeline_metrics.scrape_wire_bytes.labels(target).inc(stats.wire_bytes)
+    pipeline_metrics.parse_duration.labels(target).observe(parse_duration)
+
 
 class RemoteMetricsCollector(Collector):
     """
@@ -17,16 +167,280 @@ class RemoteMetricsCollector(Collector):
         """
         Args:
             url (str): Prometheus Exporter 的 metrics 接口地址。
+            timeout (float): 拉取超时时间（秒）。
         """
         self.url = url
         self.last_scrape_time = None
         self.timeout = timeout
+        # 长连接会话，复用 TCP 连接并启用 gzip
+        self.session = ScrapeSession(timeout)
+        # 只解析这些 MetricFamily，None 表示解析全部
+        self.metric_filter: Optional[frozenset[str]] = None
+        # 请求的查询参数（collect[]），随 metric_filter 一起设置
+        self.params: Optional[dict[str, list[str]]] = None
+        # 样本的驻留表，在多次采集之间复用
+        self.label_table = LabelSetTable()
+        # 记录拉取和解析耗时的指标，由引擎设置
+        self.pipeline_metrics: Optional[PipelineMetrics] = None
+        self.target = urlsplit(url).netloc
+        # 这次采集的期限（时间戳），由引擎在每次采集前设置
+        self.deadline: Optional[float] = None
 
-    def collect(self) -> Iterable[Metric]:
+    def set_deadline(self, deadline: Optional[float]):
+        """
+        设置这次采集的期限，请求的超时不会超过期限
+        """
+        self.deadline = deadline
+
+    def set_pipeline_metrics(self, pipeline_metrics: Optional[PipelineMetrics]):
+        """
+        设置记录拉取、解析耗时和响应大小的指标
+        """
+        self.pipeline_metrics = pipeline_metrics
+
+    def set_metric_filter(self, families: Optional[Collection[str]]):
+        """
+        设置需要解析的 MetricFamily 名，其余 family 在解析前就被丢弃，
+        并通过 collect[] 参数让 windows_exporter 只运行需要的 collector
+        :param families: family 名集合，None 表示解析全部
+        """
+        self.metric_filter = frozenset(families) if families is not None else None
+        self.params = collect_params(self.metric_filter)
+
+    @property
+    def last_stats(self) -> Optional[ScrapeStats]:
+        """
+        最近一次成功拉取的统计信息（传输字节数、解压后大小、连接耗时、首字节耗时）
+        """
+        return self.session.last_stats
+
+    def close(self):
+        """
+        关闭连接池中的所有连接
+        """
+        self.session.close()
+
+    def collect(self) -> Iterable[CompactFamily]:
         try:
-            resp = requests.get(self.url, timeout=self.timeout)
-            resp.raise_for_status()
-            self.last_scrape_time = time.time()
-            yield from text_string_to_metric_families(resp.text)
+            with span("fetch", target=self.target):
+                resp, body, self.params = fetch_exposition(
+                    self.session,
+                    self.url,
+                    request_timeout(self.timeout, self.deadline),
+                    self.params,
+                )
         except requests.RequestException as e:
             logging.error(f"Failed to collect remote metrics: {e}")
+            if self.pipeline_metrics is not None:
+                self.pipeline_metrics.scrape_failures.labels(self.target).inc()
+            return
+        self.last_scrape_time = time.time()
+        parse_start = time.perf_counter()
+        try:
+            with span("parse", target=self.target):
+                if self.label_table.stale():
+                    self.label_table = LabelSetTable()
+                families = parse_response(
+                    resp, body, self.metric_filter, self.label_table
+                )
+        except ValueError as e:
+            logging.error(f"Invalid response from {self.url}: {e}")
+            if self.pipeline_metrics is not None:
+                self.pipeline_metrics.scrape_failures.labels(self.target).inc()
+            return
+        observe_scrape(
+            self.pipeline_metrics,
+            self.target,
+            self.session.last_stats,
+            time.perf_counter() - parse_start,
+        )
+        yield from families
+
+
+class ScrapeTarget:
+    """
+    多目标采集中的单个目标
+    """
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url
+        # 注入到每个样本中的 host 标签，使用 URL 的 host:port
+        self.host = urlsplit(url).netloc
+        self.session = ScrapeSession(timeout)
+        self.last_success_time: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.consecutive_failures = 0
+        # 样本的驻留表，在多次采集之间复用，登记样本时注入 host 标签
+        self.label_table = LabelSetTable({HOST_LABEL: self.host})
+        # 最近一次解析的耗时（秒）
+        self.last_parse_duration = 0.0
+        # 请求的查询参数（collect[]），目标拒绝时清除
+        self.params: Optional[dict[str, list[str]]] = None
+        # 正在线程池中执行的 fetch。超时后线程仍在运行，会话和驻留表不能并发使用，
+        # 在它结束之前跳过这个目标
+        self.pending: Optional[Future] = None
+
+    def is_stale(self, now: float, stale_after: float) -> bool:
+        """
+        超过 stale_after 秒没有成功拉取即视为过期
+        """
+        return (
+            self.last_success_time is None or now - self.last_success_time > stale_after
+        )
+
+    def fetch(
+        self,
+        metric_filter: Optional[frozenset[str]],
+        timeout: Optional[float] = None,
+    ) -> list[CompactFamily]:
+        """
+        拉取并解析一次（在线程池中执行）
+        :param timeout: 这次请求的超时，None 表示使用会话的超时
+        """
+        with span("fetch", target=self.host):
+            resp, body, self.params = fetch_exposition(
+                self.session, self.url, timeout, self.params
+            )
+        parse_start = time.perf_counter()
+        with span("parse", target=self.host):
+            if self.label_table.stale():
+                self.label_table = LabelSetTable(self.label_table.const_labels)
+            families = parse_response(resp, body, metric_filter, self.label_table)
+        self.last_parse_duration = time.perf_counter() - parse_start
+        return families
+
+
+class MultiTargetCollector(Collector):
+    """
+    并发拉取多个 Prometheus Exporter 的 Collector。
+    所有目标在同一个 asyncio 事件循环上并发拉取，每个目标单独超时，
+    并在每个样本中注入 host 标签。
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        timeout: float = 0.5,
+        stale_after: Optional[float] = None,
+        interval: float = 1.0,
+    ):
+        """
+        Args:
+            urls: 各个 Exporter 的 metrics 接口地址。
+            timeout: 每个目标的拉取超时时间（秒）。
+            stale_after: 超过多少秒没有成功拉取视为过期，默认为 STALE_TICKS 个采集周期。
+            interval: 引擎的采集间隔（秒）。
+        """
+        self.targets = [ScrapeTarget(url, timeout) for url in urls]
+        self.timeout = timeout
+        self.stale_after = (
+            stale_after if stale_after is not None else interval * STALE_TICKS
+        )
+        self.last_scrape_time = None
+        self.metric_filter: Optional[frozenset[str]] = None
+        self.pipeline_metrics: Optional[PipelineMetrics] = None
+        # 这次采集的期限（时间戳），由引擎在每次采集前设置
+        self.deadline: Optional[float] = None
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, len(self.targets)),
+            thread_name_prefix="ScrapeWorker",
+        )
+
+    def set_metric_filter(self, families: Optional[Collection[str]]):
+        """
+        设置需要解析的 MetricFamily 名，其余 family 在解析前就被丢弃，
+        并通过 collect[] 参数让 windows_exporter 只运行需要的 collector
+        :param families: family 名集合，None 表示解析全部
+        """
+        self.metric_filter = frozenset(families) if families is not None else None
+        params = collect_params(self.metric_filter)
+        for target in self.targets:
+            target.params = params
+
+    def set_deadline(self, deadline: Optional[float]):
+        """
+        设置这次采集的期限，各目标的超时不会超过期限
+        """
+        self.deadline = deadline
+
+    def set_pipeline_metrics(self, pipeline_metrics: Optional[PipelineMetrics]):
+        """
+        设置记录各目标拉取、解析耗时和响应大小的指标
+        """
+        self.pipeline_metrics = pipeline_metrics
+
+    def stale_targets(self) -> list[ScrapeTarget]:
+        """
+        返回当前已过期的目标
+        """
+        now = time.time()
+        return [t for t in self.targets if t.is_stale(now, self.stale_after)]
+
+    def close(self):
+        """
+        关闭所有连接和事件循环
+        """
+        for target in self.targets:
+            target.session.close()
+        self._executor.shutdown()
+        self._loop.close()
+
+    async def _scrape(self, target: ScrapeTarget) -> list[CompactFamily]:
+        timeout = request_timeout(self.timeout, self.deadline)
+        try:
+            if target.pending is not None and not target.pending.done():
+                raise asyncio.TimeoutError("previous fetch still running")
+            target.pending = self._executor.submit(
+                target.fetch, self.metric_filter, timeout
+            )
+            families = await asyncio.wait_for(
+                asyncio.wrap_future(target.pending, loop=self._loop),
+                timeout=timeout,
+            )
+        except (requests.RequestException, asyncio.TimeoutError, ValueError) as e:
+            target.consecutive_failures += 1
+            target.last_error = str(e) or type(e).__name__
+            logging.error(f"Failed to collect metrics from {target.url}: {e!r}")
+            if self.pipeline_metrics is not None:
+                self.pipeline_metrics.scrape_failures.labels(target.host).inc()
+            return []
+        observe_scrape(
+            self.pipeline_metrics,
+            target.host,
+            target.session.last_stats,
+            target.last_parse_duration,
+        )
+        target.consecutive_failures = 0
+        target.last_error = None
+        target.last_success_time = time.time()
+        return families
+
+    async def _scrape_all(self) -> list[list[CompactFamily]]:
+        return await asyncio.gather(*(self._scrape(t) for t in self.targets))
+
+    def collect(self) -> Iterable[Metric]:
+        results = self._loop.run_until_complete(self._scrape_all())
+        self.last_scrape_time = time.time()
+
+        # 各目标的同名 family 放在一个 FamilyGroup 中，不合并成 Sample 列表。
+        # host 标签已经由各目标的驻留表注入
+        grouped: dict[str, list[CompactFamily]] = {}
+        for families in results:
+            for family in families:
+                grouped.setdefault(family.name, []).append(family)
+        merged: dict[str, Union[CompactFamily, FamilyGroup, Metric]] = {
+            name: families[0] if len(families) == 1 else FamilyGroup(families)
+            for name, families in grouped.items()
+        }
+
+        up_metric = Metric("up", "Whether the target was scraped recently", "gauge")
+        now = time.time()
+        for target in self.targets:
+            up_metric.add_sample(
+                "up",
+                {HOST_LABEL: target.host},
+                0.0 if target.is_stale(now, self.stale_after) else 1.0,
+            )
+        merged[up_metric.name] = up_metric
+        yield from merged.values()
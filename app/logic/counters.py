@@ -0,0 +1,129 @@
+import math
+from typing import Callable, Generic, Hashable, Optional, Sequence, TypeVar
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy 是可选依赖（例如在 PyPy 上可以不安装），没有时分析器使用纯 Python 实现
+    np = None
+
+HAS_NUMPY = np is not None
+
+K = TypeVar("K", bound=Hashable)
+
+
+class BusyRatioCounters(Generic[K]):
+    """
+    用 NumPy 向量化计算一组计数器的“忙碌比例”（百分比）。
+
+    每个 key（例如 (core, mode)）第一次出现时分配一个固定的下标，
+    上一次的值保存在按下标排列的数组中。每次更新时计算增量（计数器重置时取当前值），
+    按 group 求和后，busy 的增量之和除以全部增量之和。
+    样本的 key 顺序与上一次相同时（通常如此），直接复用样本到下标的映射。
+
+    CPU 使用率（按 core 分组，排除 idle 模式）和磁盘活动时间
+    （按 disk 分组，排除 idle 时间）都是这种形式。
+    """
+
+    def __init__(
+        self,
+        group: Callable[[K], str],
+        busy: Callable[[K], bool],
+        initial: Optional[dict[K, float]] = None,
+    ):
+        """
+        group: 返回 key 所属的分组（例如 core）
+        busy: 返回 key 的增量是否计入忙碌时间
+        initial: 各 key 上一次的值（例如恢复的状态），没有的 key 第一次的增量为 0
+        """
+        self.group = group
+        self.busy = busy
+        self.initial = initial or {}
+        self.keys: list[K] = []
+        self.index: dict[K, int] = {}
+        self.groups: list[str] = []
+        self.group_index: dict[str, int] = {}
+        # 按 key 的下标排列：上一次的值（NaN 表示没有）、所属分组、是否计入忙碌时间
+        self.prev = np.empty(0)
+        self.key_group = np.empty(0, dtype=np.intp)
+        self.key_busy = np.empty(0)
+        # 上一次样本的 key 列表，以及样本到 key 下标的映射
+        self._sample_keys: list[K] = []
+        self._sample_index = np.empty(0, dtype=np.intp)
+
+    def _add_keys(self, keys: Sequence[K]):
+        new_keys = [key for key in dict.fromkeys(keys) if key not in self.index]
+        if not new_keys:
+            return
+        groups, busy, prev = [], [], []
+        for key in new_keys:
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+            group = self.group(key)
+            if group not in self.group_index:
+                self.group_index[group] = len(self.groups)
+                self.groups.append(group)
+            groups.append(self.group_index[group])
+            busy.append(1.0 if self.busy(key) else 0.0)
+            prev.append(self.initial.get(key, math.nan))
+        self.key_group = np.concatenate([self.key_group, np.array(groups, np.intp)])
+        self.key_busy = np.concatenate([self.key_busy, np.array(busy)])
+        self.prev = np.concatenate([self.prev, np.array(prev)])
+
+    def update(self, keys: list[K], values: Sequence[float]) -> dict[str, float]:
+        """
+        keys: 每个样本的 key，重复的 key 取平均值
+        values: 每个样本的值
+        返回：本次出现的每个分组的忙碌比例（百分比）
+        """
+        if not keys:
+            return {}
+        if keys != self._sample_keys:
+            self._add_keys(keys)
+            self._sample_index = np.fromiter(
+                (self.index[key] for key in keys), dtype=np.intp, count=len(keys)
+            )
+            self._sample_keys = keys
+        size = len(self.keys)
+
+        # 1. 每个 key 的当前值（重复的取平均）
+        counts = np.bincount(self._sample_index, minlength=size)
+        current = np.bincount(
+            self._sample_index, weights=np.asarray(values, dtype=float), minlength=size
+        )
+        present = counts > 0
+        np.divide(current, counts, out=current, where=present)
+
+        # 2. 增量：没有上一次的值时为 0，计数器重置时为当前值
+        known = present & ~np.isnan(self.prev)
+        deltas = np.where(known, current - np.where(known, self.prev, 0.0), 0.0)
+        reset = deltas < 0
+        deltas[reset] = current[reset]
+        self.prev = np.where(present, current, self.prev)
+
+        # 3. 按分组求和并计算比例
+        group_count = len(self.groups)
+        totals = np.bincount(self.key_group, weights=deltas, minlength=group_count)
+        busy = np.bincount(
+            self.key_group, weights=deltas * self.key_busy, minlength=group_count
+        )
+        ratios = np.divide(busy, totals, out=np.zeros(group_count), where=totals > 0)
+        ratios *= 100
+        group_present = np.bincount(
+            self.key_group[present], minlength=group_count
+        ).astype(bool)
+        return {
+            group: float(ratio)
+            for group, ratio, seen in zip(self.groups, ratios, group_present)
+            if seen
+        }
+
+    def counters(self) -> dict[K, float]:
+        """
+        各 key 上一次的值，用于保存状态
+        """
+        return {
+            key: float(value)
+            for key, value in zip(self.keys, self.prev)
+            if not math.isnan(value)
+        }
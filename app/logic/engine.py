@@ -1,35 +1,143 @@
-import bisect
+import copy
+import logging
+import math
 import time
-from collections import deque
-from threading import Thread, Event
-from typing import Callable, Optional, Deque
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event, Lock
+from typing import Callable, NamedTuple, Optional, TypeVar
 
 from prometheus_client import CollectorRegistry, Metric
+from prometheus_client.registry import Collector
+from prometheus_client.samples import Sample
 
 from .analyze import MetricAnalyzer
-from .index import filter_by_labels, build_metric_map
+from .history import SeriesStore, SeriesView
+from .index import (
+    HOST_LABEL,
+    add_labels,
+    build_metric_map,
+    split_metric_map_by_label,
+)
+from .instrument import PipelineMetrics
+from .trace import span
 
 # 回调类型：metric, labels, scrape_time
 MetricCallback = Callable[[], None]
 
+T = TypeVar("T")
+
+# 每次拉取的期限，占采集周期的比例
+FETCH_DEADLINE = 0.8
+# 持久化的历史数据每隔多少秒写回一次（断电时最多丢失这么久的数据）
+FLUSH_INTERVAL = 30.0
+
+
+class CollectedTick(NamedTuple):
+    """
+    采集线程交给分析线程的一次采集结果
+    """
+
+    tick_time: float  # 采集点的时间（对齐到 interval 的整数倍），作为这次采集的时间戳
+    start: float  # 开始采集时的 perf_counter，用于统计整个周期的耗时
+    metrics: list[Metric]  # 采集到的所有 MetricFamily
+
+
+class AnalyzerStats(NamedTuple):
+    """
+    单个分析器的运行统计
+    """
+
+    runs: int = 0  # 运行次数
+    failures: int = 0  # 失败次数
+    consecutive_failures: int = 0  # 连续失败次数，成功后清零
+    last_duration: float = 0.0  # 最近一次运行耗时（秒）
+    max_duration: float = 0.0  # 最长运行耗时（秒）
+    total_duration: float = 0.0  # 累计运行耗时（秒）
+    last_error: Optional[str] = None  # 最近一次失败的错误信息
+
+
+def analyzer_levels(analyzers: list[MetricAnalyzer]) -> list[list[int]]:
+    """
+    按 inputs/outputs 的依赖关系把分析器分层（拓扑排序）：
+    每一层只依赖之前各层的输出，同一层的分析器相互独立，可以并行运行。
+    inputs 中不是任何分析器 outputs 的名字视为采集到的原始 family。
+    :param analyzers: 分析器列表
+    :return: 每层的分析器下标，层内保持注册顺序
+    """
+    producers: dict[str, list[int]] = defaultdict(list)
+    for i, analyzer in enumerate(analyzers):
+        for name in analyzer.outputs:
+            producers[name].append(i)
+    dependencies = [
+        {j for name in analyzer.inputs for j in producers.get(name, ()) if j != i}
+        for i, analyzer in enumerate(analyzers)
+    ]
+
+    levels: list[list[int]] = []
+    done: set[int] = set()
+    remaining = list(range(len(analyzers)))
+    while remaining:
+        level = [i for i in remaining if dependencies[i] <= done]
+        if not level:
+            names = ", ".join(type(analyzers[i]).__name__ for i in remaining)
+            raise ValueError(f"Analyzer dependency cycle among: {names}")
+        levels.append(level)
+        done.update(level)
+        remaining = [i for i in remaining if i not in done]
+    return levels
+
 
 class MetricEngine:
-    def __init__(self, interval: float = 2.0, history_size: int = 300):
+    def __init__(
+        self,
+        interval: float = 2.0,
+        history_size: int = 300,
+        history: Optional[SeriesStore] = None,
+        analyzer_workers: int = 0,
+    ):
         """
         interval: 采集周期（秒）
         history_length: 每个表达式/指标保留的历史点数
+        history: 历史数据存储（例如共享内存中的 SlabSeriesStore），None 表示新建
+        analyzer_workers: 并行运行同一层分析器的线程数，0 表示在采集线程中依次运行
         """
         self.registry = CollectorRegistry()
+        self.collectors: list[Collector] = []
         self.analyzers: list[MetricAnalyzer] = []
+        # 多目标采集时每个 host 的分析器实例
+        self._host_analyzers: dict[str, list[MetricAnalyzer]] = {}
+        # 分析器的依赖分层（下标）和统计用的名字，注册分析器时重新计算
+        self._levels: list[list[int]] = []
+        self._analyzer_names: list[str] = []
+        # 分析器名 -> 运行统计（多目标采集时各 host 的实例合并统计）
+        self.analyzer_stats: dict[str, AnalyzerStats] = {}
+        self._stats_lock = Lock()
+        # 引擎自身的耗时等指标（独立的 registry）
+        self.pipeline_metrics = PipelineMetrics()
+        self.analyzer_workers = analyzer_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
         self.update_callbacks: list[MetricCallback] = []
-        self.history: Deque[tuple[float, dict[str, Metric]]] = deque(
-            maxlen=history_size
-        )
+        self.history = history if history is not None else SeriesStore(history_size)
+        # 写入历史时持有，其他线程通过 read_history 读取一致的数据
+        self._history_lock = Lock()
         self.history_size = history_size
         self.interval = interval
         self._stop_event = Event()
+        # 采集线程交给分析线程的最新一次采集结果（只保留一个，分析跟不上时丢弃旧的）
+        self._pending_tick: Optional[CollectedTick] = None
+        self._pending_lock = Lock()
+        self._tick_ready = Event()
+        # 采集/分析超时的次数和上次记录日志的时间，日志最多每分钟记录一次
+        self._overruns: Counter[str] = Counter()
+        self._overrun_logged: dict[str, float] = {}
+        # 上次把历史数据写回持久化存储的时间（time.monotonic）
+        self._last_flush = time.monotonic()
         self.thread_name = "MetricEngineThread"
         self._thread = Thread(target=self._run, name=self.thread_name, daemon=True)
+        self._collect_thread = Thread(
+            target=self._collect_loop, name="MetricCollectThread", daemon=True
+        )
 
     def register_collector(self, collector):
         """
@@ -38,6 +146,10 @@ class MetricEngine:
         :type collector: Collector
         """
         self.registry.register(collector)
+        self.collectors.append(collector)
+        if hasattr(collector, "set_pipeline_metrics"):
+            collector.set_pipeline_metrics(self.pipeline_metrics)
+        self._update_metric_filter()
 
     def register_analyzer(self, analyzer: MetricAnalyzer):
         """
@@ -45,7 +157,45 @@ class MetricEngine:
         :param analyzer: 分析器实例
         :type analyzer: MetricAnalyzer
         """
+        levels = analyzer_levels(self.analyzers + [analyzer])
         self.analyzers.append(analyzer)
+        self._levels = levels
+        # 同一个类注册了多个实例时，用注册顺序区分
+        counts = Counter(type(a).__name__ for a in self.analyzers)
+        self._analyzer_names = [
+            name if counts[name] == 1 else f"{name}#{i}"
+            for i, name in enumerate(type(a).__name__ for a in self.analyzers)
+        ]
+        self._host_analyzers.clear()
+        self._update_metric_filter()
+
+    def get_required_metrics(self) -> Optional[set[str]]:
+        """
+        所有分析器需要的 MetricFamily 名的并集
+        :return: family 名集合，有分析器未声明 inputs 时返回 None（表示需要全部）
+        """
+        required: set[str] = set()
+        for analyzer in self.analyzers:
+            if not analyzer.inputs:
+                return None
+            # 其他分析器的输出不需要采集（分析器自己的输出可以同时是采集到的输入）
+            produced = {
+                name
+                for other in self.analyzers
+                if other is not analyzer
+                for name in other.outputs
+            }
+            required.update(name for name in analyzer.inputs if name not in produced)
+        return required
+
+    def _update_metric_filter(self):
+        """
+        把分析器需要的 family 下推给支持过滤的采集器
+        """
+        required = self.get_required_metrics()
+        for collector in self.collectors:
+            if hasattr(collector, "set_metric_filter"):
+                collector.set_metric_filter(required)
 
     def register_on_update(self, callback: MetricCallback):
         """
@@ -59,17 +209,76 @@ class MetricEngine:
         """
         启动采集线程
         """
+        self._restore_analyzer_state()
+        if self.analyzer_workers > 0 and self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.analyzer_workers, thread_name_prefix="Analyzer"
+            )
         self._stop_event.clear()
         if not self._thread.is_alive():
             self._thread = Thread(target=self._run, name=self.thread_name, daemon=True)
             self._thread.start()
+        if not self._collect_thread.is_alive():
+            self._collect_thread = Thread(
+                target=self._collect_loop, name="MetricCollectThread", daemon=True
+            )
+            self._collect_thread.start()
 
     def stop(self):
         """
-        停止采集线程
+        停止采集线程（等待中的线程立即醒来，正在进行的拉取最多等到这次采集的期限）
         """
         self._stop_event.set()
+        self._tick_ready.set()
+        self._collect_thread.join()
         self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for collector in self.collectors:
+            if hasattr(collector, "close"):
+                collector.close()
+        self.history.flush()
+
+    def _analyzer_groups(self) -> dict[str, list[MetricAnalyzer]]:
+        # "" 表示单目标采集时使用的分析器，其余为每个 host 的分析器
+        return {"": self.analyzers, **self._host_analyzers}
+
+    def _save_analyzer_state(self, scrape_time: float):
+        """
+        把所有分析器的状态随历史数据一起保存（只在历史数据会保存下来时）
+        """
+        if not self.history.persistent:
+            return
+        self.history.save_state(
+            {
+                "time": scrape_time,
+                "analyzers": {
+                    host: [[type(a).__name__, a.get_state()] for a in analyzers]
+                    for host, analyzers in self._analyzer_groups().items()
+                },
+            }
+        )
+
+    def _restore_analyzer_state(self):
+        """
+        恢复上次保存的分析器状态。
+        状态太旧（超出历史数据的时间范围）时不恢复，分析器从头开始计算
+        """
+        state = self.history.load_state()
+        if not state or time.time() - state["time"] > self.interval * self.history_size:
+            return
+        for host, saved in state["analyzers"].items():
+            if host:
+                analyzers = self._host_analyzers.setdefault(
+                    host, copy.deepcopy(self.analyzers)
+                )
+            else:
+                analyzers = self.analyzers
+            # 分析器的注册顺序或类型变化时，只恢复能对应上的部分
+            for analyzer, (name, analyzer_state) in zip(analyzers, saved):
+                if type(analyzer).__name__ == name:
+                    analyzer.set_state(analyzer_state)
 
     def get_metric(
         self, metric_name: str, labels: Optional[dict[str, str]] = None
@@ -77,18 +286,30 @@ class MetricEngine:
         """
         获取最新的指定 metric，并按 labels 过滤。
         """
-        if not self.history or metric_name not in self.history[-1][1]:
+        samples = self.history.latest(metric_name, labels)
+        if not samples:
             return None
+        return self.history.to_metric(metric_name, samples)
 
-        metric = self.history[-1][1][metric_name]
-        if labels is None:
-            return metric
-
-        filed_metric = Metric(
-            metric.name, metric.documentation, metric.type, metric.unit
-        )
-        filed_metric.samples = list(filter_by_labels(metric.samples, labels=labels))
-        return filed_metric
+    def get_series_range(
+        self,
+        metric_name: str,
+        start_time: float,
+        end_time: Optional[float] = None,
+        labels: Optional[dict[str, str]] = None,
+        width: Optional[int] = None,
+    ) -> list[SeriesView]:
+        """
+        获取指定时间范围内的序列视图（原始数据零拷贝），并按 labels 过滤。
+        :param metric_name: 指标名称
+        :param start_time: 开始时间（时间戳）
+        :param end_time: 结束时间（时间戳），None表示当前时间
+        :param labels: 按哪些labels过滤，None表示不过滤
+        :param width: 图表的像素宽度，用于选择聚合层级，None表示尽量使用原始数据
+        """
+        if end_time is None:
+            end_time = time.time()
+        return self.history.query(metric_name, start_time, end_time, labels, width)
 
     def get_metric_range(
         self,
@@ -104,66 +325,253 @@ class MetricEngine:
         :param end_time: 结束时间（时间戳），None表示当前时间
         :param labels: 按哪些labels过滤，None表示不过滤
         """
-        if not self.history:
+        series = self.get_series_range(metric_name, start_time, end_time, labels)
+        if not series:
             return None
+        return self.history.to_metric(
+            metric_name,
+            sorted(
+                (
+                    Sample(metric_name, s.labels, value, timestamp)
+                    for s in series
+                    for timestamp, value in zip(s.timestamps, s.values)
+                ),
+                key=lambda sample: sample.timestamp,
+            ),
+        )
 
-        if end_time is None:
-            end_time = time.time()
-
-        keys = [x[0] for x in self.history]
-        start_idx = bisect.bisect_left(keys, start_time)
-        end_idx = len(self.history)
-        filed_metric: Optional[Metric] = None
-        for i in range(start_idx, end_idx):
-            scrape_time, metric_dict = self.history[i]
-            if scrape_time < start_time or scrape_time > end_time:
-                continue
-            if metric_name not in metric_dict:
-                continue
-            metric = metric_dict[metric_name]
-            if filed_metric is None:
-                filed_metric = Metric(
-                    metric.name, metric.documentation, metric.type, metric.unit
-                )
-            if labels is None:
-                filed_metric.samples += metric.samples
-                continue
-            filed_metric.samples += list(
-                filter_by_labels(metric.samples, labels=labels)
-            )
-        return filed_metric
+    def read_history(self, fn: Callable[[], T]) -> T:
+        """
+        在历史数据不会被写入的情况下执行 fn 并返回其结果（用于采集线程以外的读取方）。
+        查询返回的是指向历史数据的视图，fn 需要在返回前拷贝用到的数据
+        """
+        with self._history_lock:
+            return fn()
 
     def get_last_scrape_time(self) -> Optional[float]:
         """
         获取最后一次采集的时间戳
         :return: 最后一次采集的时间戳
         """
-        if not self.history:
-            return None
-        return self.history[-1][0]
+        return self.history.last_time
 
-    def _run(self):
-        next_time = time.time() + self.interval
-        while not self._stop_event.is_set():
-            # 采集所有指标
-            metrics = self.registry.collect()
-            # 采集时间
-            scrape_time = time.time()
-            # 计算所有表达式
-            metric_map = build_metric_map(metrics)
-            all_metric_dict: dict[str, Metric] = {
+    def _run_analyzer(
+        self,
+        index: int,
+        analyzer: MetricAnalyzer,
+        metrics: dict[str, Metric],
+        scrape_time: float,
+    ) -> list[Metric]:
+        """
+        运行单个分析器并记录耗时。分析器失败时记录错误并返回空列表，
+        不影响其他分析器和这次采集的其余结果。
+        """
+        name = self._analyzer_names[index]
+        start = time.perf_counter()
+        error: Optional[Exception] = None
+        try:
+            with span(name):
+                result = list(analyzer.analyze(metrics, scrape_time) or ())
+        except Exception as e:
+            result = []
+            error = e
+        duration = time.perf_counter() - start
+        self.pipeline_metrics.analyzer_duration.labels(name).observe(duration)
+        if error is not None:
+            self.pipeline_metrics.analyzer_failures.labels(name).inc()
+
+        with self._stats_lock:
+            stats = self.analyzer_stats.get(name, AnalyzerStats())
+            if error is not None and not stats.consecutive_failures:
+                # 连续失败时只记录第一次
+                logging.error(f"Analyzer {name} failed", exc_info=error)
+            elif error is None and stats.consecutive_failures:
+                logging.info(f"Analyzer {name} recovered")
+            self.analyzer_stats[name] = AnalyzerStats(
+                runs=stats.runs + 1,
+                failures=stats.failures + (error is not None),
+                consecutive_failures=(
+                    stats.consecutive_failures + 1 if error is not None else 0
+                ),
+                last_duration=duration,
+                max_duration=max(stats.max_duration, duration),
+                total_duration=stats.total_duration + duration,
+                last_error=(
+                    f"{type(error).__name__}: {error}"
+                    if error is not None
+                    else stats.last_error
+                ),
+            )
+        return result
+
+    def _run_analyzers(
+        self,
+        analyzers: list[MetricAnalyzer],
+        metric_map: dict[str, Metric],
+        scrape_time: float,
+    ) -> list[Metric]:
+        """
+        按依赖分层运行一组分析器（self.analyzers 或某个 host 的副本）。
+        同一层的分析器在线程池中并行运行，每层的输出加入下游分析器看到的 metrics。
+        :return: 所有分析器的输出，按注册顺序排列
+        """
+        outputs: list[list[Metric]] = [[] for _ in analyzers]
+        metrics = metric_map
+        for level_number, level in enumerate(self._levels):
+            if level_number:
+                # 下游分析器可以读取之前各层的输出
+                metrics = {
+                    **metric_map,
+                    **{m.name: m for i in range(len(analyzers)) for m in outputs[i]},
+                }
+            if self._executor is not None and len(level) > 1:
+                futures = [
+                    self._executor.submit(
+                        self._run_analyzer, i, analyzers[i], metrics, scrape_time
+                    )
+                    for i in level
+                ]
+                for i, future in zip(level, futures):
+                    outputs[i] = future.result()
+            else:
+                for i in level:
+                    outputs[i] = self._run_analyzer(
+                        i, analyzers[i], metrics, scrape_time
+                    )
+        return [m for result in outputs for m in result]
+
+    def _analyze(
+        self, metric_map: dict[str, Metric], scrape_time: float
+    ) -> dict[str, Metric]:
+        """
+        运行所有分析器。
+        如果样本带有 host 标签（多目标采集），每个 host 使用一组独立的分析器实例，
+        并把 host 标签加到分析结果上。
+        """
+        metric_maps = split_metric_map_by_label(metric_map, HOST_LABEL)
+        if set(metric_maps) <= {""}:
+            return {
                 m.name: m
-                for analyzer in self.analyzers
-                for m in analyzer.analyze(metric_map, scrape_time)
+                for m in self._run_analyzers(self.analyzers, metric_map, scrape_time)
             }
+
+        all_metric_dict: dict[str, Metric] = {}
+        for host, host_metric_map in metric_maps.items():
+            if host not in self._host_analyzers:
+                # 分析器带有计数器等状态，每个 host 需要独立的实例
+                self._host_analyzers[host] = copy.deepcopy(self.analyzers)
+            for m in self._run_analyzers(
+                self._host_analyzers[host], host_metric_map, scrape_time
+            ):
+                merged = all_metric_dict.get(m.name)
+                if merged is None:
+                    merged = all_metric_dict[m.name] = Metric(
+                        m.name, m.documentation, m.type, m.unit
+                    )
+                merged.samples += add_labels(m.samples, {HOST_LABEL: host})
+        return all_metric_dict
+
+    def _record_overrun(self, stage: str, skipped: int):
+        """
+        记录一次超过期限的采集或分析，以及因此跳过的采集点
+        :param stage: "collect" 或 "analyze"
+        :param skipped: 跳过的采集点数
+        """
+        self._overruns[stage] += 1
+        self.pipeline_metrics.tick_overruns.labels(stage).inc()
+        self.pipeline_metrics.skipped_ticks.inc(skipped)
+        now = time.monotonic()
+        if now - self._overrun_logged.get(stage, -math.inf) >= 60:
+            self._overrun_logged[stage] = now
+            logging.warning(
+                f"Engine {stage} overran the {self.interval}s interval "
+                f"({self._overruns[stage]} times so far), skipped {skipped} tick(s)"
+            )
+
+    def _collect_loop(self):
+        """
+        采集线程：在对齐到 interval 整数倍的采集点上拉取和解析，交给分析线程后
+        立即等待下一个采集点，因此下一次拉取与这一次的分析同时进行。
+        每次采集的期限是下一个采集点，采集器可以据此缩短超时；超过期限才完成时
+        记为超时，其间错过的采集点记为跳过，下一次采集从之后的第一个采集点开始。
+        """
+        # 采集点的序号，采集时间为 tick * interval
+        tick = math.floor(time.time() / self.interval) + 1
+        while not self._stop_event.wait(max(0.0, tick * self.interval - time.time())):
+            tick_time = tick * self.interval
+            # 拉取的期限留出一部分时间用于解析，解析完成前不超过下一个采集点
+            deadline = tick_time + self.interval * FETCH_DEADLINE
+            for collector in self.collectors:
+                if hasattr(collector, "set_deadline"):
+                    collector.set_deadline(deadline)
+            start = time.perf_counter()
+            # collect 返回生成器，在这里取完，拉取和解析都计入 collect
+            try:
+                with span("collect"):
+                    metrics = list(self.registry.collect())
+            except Exception:
+                # 采集器的异常不能结束采集线程，否则分析线程会一直等待
+                logging.exception("Failed to collect metrics")
+                self.pipeline_metrics.collect_failures.inc()
+                metrics = None
+            if self._stop_event.is_set():
+                break
+
+            if metrics is not None:
+                with self._pending_lock:
+                    superseded = self._pending_tick is not None
+                    self._pending_tick = CollectedTick(tick_time, start, metrics)
+                    self._tick_ready.set()
+                if superseded:
+                    # 分析线程还没取走上一次的结果：分析跟不上采集，上一次的结果被丢弃
+                    self._record_overrun("analyze", 1)
+
+            next_tick = max(tick + 1, math.floor(time.time() / self.interval) + 1)
+            if next_tick > tick + 1:
+                self._record_overrun("collect", next_tick - tick - 1)
+            tick = next_tick
+
+    def _run(self):
+        """
+        分析线程：取出最新的采集结果，分析、写入历史并执行回调
+        """
+        while True:
+            self._tick_ready.wait()
+            if self._stop_event.is_set():
+                break
+            with self._pending_lock:
+                collected, self._pending_tick = self._pending_tick, None
+                self._tick_ready.clear()
+            if collected is not None:
+                self._process_tick(collected)
+
+    def _process_tick(self, collected: CollectedTick):
+        """
+        处理一次采集结果，采集时间使用对齐后的采集点
+        """
+        scrape_time = collected.tick_time
+        with span("tick"):
+            # 计算所有表达式
+            with span("build_metric_map"):
+                metric_map = build_metric_map(collected.metrics)
+            with span("analyze"):
+                all_metric_dict = self._analyze(metric_map, scrape_time)
             # 更新历史
-            self.history.append((scrape_time, all_metric_dict))
+            with span("store"), self._history_lock:
+                self.history.append(scrape_time, all_metric_dict.values())
+                self._save_analyzer_state(scrape_time)
+            # 状态写完后定期写回，断电后重启时的数据不会比 FLUSH_INTERVAL 更旧
+            if (
+                self.history.persistent
+                and time.monotonic() - self._last_flush >= FLUSH_INTERVAL
+            ):
+                with span("flush"):
+                    self.history.flush()
+                self._last_flush = time.monotonic()
             # 执行回调
-            for callback in self.update_callbacks:
-                callback()
-            # 计算下次采集时间
-            now_time = time.time()
-            while next_time < now_time:
-                next_time += self.interval
-            sleep_time = next_time - now_time
-            time.sleep(sleep_time)
+            with span("callbacks"):
+                for callback in self.update_callbacks:
+                    callback()
+        self.pipeline_metrics.tick_duration.observe(
+            time.perf_counter() - collected.start
+        )
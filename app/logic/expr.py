@@ -0,0 +1,474 @@
+import math
+import re
+from collections import deque
+from typing import Any, Iterable, Optional, Union
+
+from prometheus_client import Metric
+from prometheus_client.samples import Sample
+
+from .analyze import MetricAnalyzer, counter_delta
+from .history import LabelKey, label_key
+from .index import aggregate_by, filter_by_labels
+
+# 即时向量（同一时刻的一组样本）或标量
+Vector = list[Sample]
+Value = Union[float, Vector]
+
+AGGREGATIONS = ("sum", "avg", "max", "min", "count")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+_METRIC_NAME_PATTERN = re.compile(r"^[a-zA-Z_:][a-zA-Z0-9_:]*$")
+_TOKEN_PATTERN = re.compile(
+    r"""
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+      | (?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)
+      | (?P<string>"(?:[^"\\]|\\.)*")
+      | (?P<op>[-+*/(){}\[\],=])
+    )
+    """,
+    re.VERBOSE,
+)
+
+
+class Node:
+    """
+    查询计划中的一个节点。结构相同的节点在计划中只有一个（key 相同），
+    因此公共子表达式在每次采集中只计算一次。
+    """
+
+    key: tuple = ()
+    children: tuple["Node", ...] = ()
+
+    def evaluate(self, evaluation: "Evaluation") -> Value:
+        raise NotImplementedError
+
+
+class Constant(Node):
+    def __init__(self, value: float):
+        self.value = value
+        self.key = ("const", value)
+
+    def evaluate(self, evaluation: "Evaluation") -> Value:
+        return self.value
+
+
+class Selector(Node):
+    """
+    选择一个 family 中 labels 匹配的样本，例如 windows_net_bytes_total{nic="eth0"}
+    """
+
+    def __init__(self, name: str, matchers: tuple[tuple[str, str], ...]):
+        self.name = name
+        self.matchers = matchers
+        self.key = ("select", name, matchers)
+
+    def evaluate(self, evaluation: "Evaluation") -> Value:
+        metric = evaluation.metrics.get(self.name)
+        if metric is None:
+            return []
+        return list(filter_by_labels(metric.samples, dict(self.matchers)))
+
+
+class Aggregate(Node):
+    """
+    sum/avg/max/min/count，可选 by (label, ...) 分组
+    """
+
+    def __init__(self, op: str, by: Optional[tuple[str, ...]], child: Node):
+        self.op = op
+        self.by = by
+        self.children = (child,)
+        self.key = ("agg", op, by, child.key)
+
+    def evaluate(self, evaluation: "Evaluation") -> Value:
+        value = evaluation.value(self.children[0])
+        if not isinstance(value, list):
+            raise ValueError(f"{self.op}() expects a vector")
+        by = list(self.by) if self.by is not None else None
+        return list(aggregate_by(value, self.op, by))
+
+
+class Rate(Node):
+    """
+    rate(selector[window])：窗口内计数器每秒的平均增量（计数器重置时按 counter_delta 处理）。
+    每条序列保存窗口内的点和窗口开始之前最近的一个点，每次采集只追加新的点，
+    因此窗口比采集间隔短时也至少有两个点。
+    """
+
+    def __init__(self, selector: Selector, window: float):
+        self.window = window
+        self.children = (selector,)
+        self.key = ("rate", window, selector.key)
+        # label_key -> (labels, [(timestamp, value), ...])
+        self.points: dict[LabelKey, tuple[dict[str, str], deque]] = {}
+
+    def evaluate(self, evaluation: "Evaluation") -> Value:
+        result = []
+        points = {}
+        for sample in evaluation.value(self.children[0]):
+            key = label_key(sample.labels)
+            labels, series = self.points.get(key) or (sample.labels, deque())
+            timestamp = (
+                sample.timestamp
+                if sample.timestamp is not None
+                else evaluation.scrape_time
+            )
+            if not series or timestamp > series[-1][0]:
+                series.append((timestamp, float(sample.value)))
+            while len(series) > 2 and series[1][0] < timestamp - self.window:
+                series.popleft()
+            # 本次采集中消失的序列不再保留
+            points[key] = (labels, series)
+            if len(series) < 2:
+                continue
+            increase = sum(
+                counter_delta(b[1], a[1]) for a, b in zip(series, list(series)[1:])
+            )
+            duration = series[-1][0] - series[0][0]
+            result.append(Sample(sample.name, labels, increase / duration, timestamp))
+        self.points = points
+        return result
+
+    def get_state(self) -> list:
+        return [
+            [labels, [list(point) for point in series]]
+            for labels, series in self.points.values()
+        ]
+
+    def set_state(self, state: list):
+        self.points = {
+            label_key(labels): (labels, deque(tuple(point) for point in series))
+            for labels, series in state
+        }
+
+
+class Binary(Node):
+    """
+    四则运算。向量与标量逐个样本计算；两个向量按完全相同的 labels 一一匹配，
+    结果使用左边的 labels
+    """
+
+    def __init__(self, op: str, left: Node, right: Node):
+        self.op = op
+        self.children = (left, right)
+        self.key = ("binary", op, left.key, right.key)
+
+    def apply(self, a: float, b: float) -> float:
+        if self.op == "+":
+            return a + b
+        if self.op == "-":
+            return a - b
+        if self.op == "*":
+            return a * b
+        # 除以 0 的结果在输出时被丢弃
+        return a / b if b != 0 else math.nan
+
+    def evaluate(self, evaluation: "Evaluation") -> Value:
+        left = evaluation.value(self.children[0])
+        right = evaluation.value(self.children[1])
+        if not isinstance(left, list) and not isinstance(right, list):
+            return self.apply(left, right)
+        if not isinstance(right, list):
+            return [s._replace(value=self.apply(s.value, right)) for s in left]
+        if not isinstance(left, list):
+            return [s._replace(value=self.apply(left, s.value)) for s in right]
+        right_values = {label_key(s.labels): s.value for s in right}
+        result = []
+        for s in left:
+            value = right_values.get(label_key(s.labels))
+            if value is not None:
+                result.append(s._replace(value=self.apply(s.value, value)))
+        return result
+
+
+class Evaluation:
+    """
+    一次采集中对计划的求值，每个节点的结果只计算一次
+    """
+
+    def __init__(self, metrics: dict[str, Metric], scrape_time: float):
+        self.metrics = metrics
+        self.scrape_time = scrape_time
+        self.results: dict[int, Value] = {}
+
+    def value(self, node: Node) -> Value:
+        result = self.results.get(id(node))
+        if result is None:
+            result = self.results[id(node)] = node.evaluate(self)
+        return result
+
+
+class ExpressionPlan:
+    """
+    一组表达式编译后的查询计划，结构相同的子表达式共用一个节点
+    """
+
+    def __init__(self):
+        self.nodes: dict[tuple, Node] = {}
+        # 表达式名 -> (表达式文本, 根节点)
+        self.roots: dict[str, tuple[str, Node]] = {}
+
+    def intern(self, node: Node) -> Node:
+        """
+        返回计划中与 node 结构相同的节点（没有时加入 node）
+        """
+        return self.nodes.setdefault(node.key, node)
+
+    def add(self, name: str, text: str):
+        """
+        解析并加入一个表达式
+        :param name: 结果的 metric 名
+        :param text: 表达式文本
+        """
+        if not _METRIC_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid expression name: {name!r}")
+        self.roots[name] = (text, _Parser(text, self).parse())
+
+    @property
+    def inputs(self) -> set[str]:
+        """
+        表达式读取的所有 family 名
+        """
+        return {node.name for node in self.nodes.values() if isinstance(node, Selector)}
+
+    @property
+    def rates(self) -> dict[str, Rate]:
+        """
+        计划中所有带状态的 rate 节点，key 是可以 JSON 序列化的节点标识
+        """
+        return {
+            repr(node.key): node
+            for node in self.nodes.values()
+            if isinstance(node, Rate)
+        }
+
+    def evaluate(
+        self, metrics: dict[str, Metric], scrape_time: float
+    ) -> dict[str, Value]:
+        """
+        对所有表达式求值
+        :return: 表达式名 -> 标量或即时向量
+        """
+        evaluation = Evaluation(metrics, scrape_time)
+        return {name: evaluation.value(root) for name, (_, root) in self.roots.items()}
+
+
+def compile_expressions(expressions: dict[str, str]) -> ExpressionPlan:
+    """
+    把 名字 -> 表达式 编译为一个查询计划
+    """
+    plan = ExpressionPlan()
+    for name, text in expressions.items():
+        plan.add(name, text)
+    return plan
+
+
+class _Parser:
+    """
+    递归下降解析器：
+    expr    := term (('+' | '-') term)*
+    term    := unary (('*' | '/') unary)*
+    unary   := '-' unary | primary
+    primary := NUMBER | '(' expr ')' | rate | aggregate | selector
+    rate    := 'rate' '(' selector '[' NUMBER UNIT ']' ')'
+    aggregate := AGG ['by' '(' labels ')'] '(' expr ')' ['by' '(' labels ')']
+    selector  := NAME ['{' NAME '=' STRING (',' NAME '=' STRING)* '}']
+    """
+
+    def __init__(self, text: str, plan: ExpressionPlan):
+        self.text = text
+        self.plan = plan
+        self.tokens: list[tuple[str, str, int]] = []
+        position = 0
+        while text[position:].strip():
+            match = _TOKEN_PATTERN.match(text, position)
+            if match is None or match.end() == position:
+                raise self.error("unexpected character", position)
+            kind = match.lastgroup
+            self.tokens.append((kind, match.group(kind), match.start(kind)))
+            position = match.end()
+        self.index = 0
+
+    def error(self, message: str, position: Optional[int] = None) -> ValueError:
+        if position is None:
+            position = (
+                self.tokens[self.index][2]
+                if self.index < len(self.tokens)
+                else len(self.text)
+            )
+        return ValueError(f"{message} at {position} in expression {self.text!r}")
+
+    def peek(self) -> tuple[str, str]:
+        if self.index < len(self.tokens):
+            return self.tokens[self.index][:2]
+        return ("end", "")
+
+    def take(self, kind: str, value: Optional[str] = None) -> str:
+        token_kind, token_value = self.peek()
+        if token_kind != kind or (value is not None and token_value != value):
+            raise self.error(f"expected {value or kind}")
+        self.index += 1
+        return token_value
+
+    def accept(self, kind: str, value: str) -> bool:
+        if self.peek() == (kind, value):
+            self.index += 1
+            return True
+        return False
+
+    def parse(self) -> Node:
+        node = self.expr()
+        if self.peek()[0] != "end":
+            raise self.error("unexpected token")
+        return node
+
+    def expr(self) -> Node:
+        node = self.term()
+        while self.peek() in (("op", "+"), ("op", "-")):
+            op = self.take("op")
+            node = self.plan.intern(Binary(op, node, self.term()))
+        return node
+
+    def term(self) -> Node:
+        node = self.unary()
+        while self.peek() in (("op", "*"), ("op", "/")):
+            op = self.take("op")
+            node = self.plan.intern(Binary(op, node, self.unary()))
+        return node
+
+    def unary(self) -> Node:
+        if self.accept("op", "-"):
+            operand = self.unary()
+            return self.plan.intern(
+                Binary("*", self.plan.intern(Constant(-1.0)), operand)
+            )
+        return self.primary()
+
+    def primary(self) -> Node:
+        kind, value = self.peek()
+        if kind == "number":
+            self.index += 1
+            return self.plan.intern(Constant(float(value)))
+        if self.accept("op", "("):
+            node = self.expr()
+            self.take("op", ")")
+            return node
+        if kind != "name":
+            raise self.error("expected an expression")
+        if value == "rate" and self.next_is_call():
+            return self.rate()
+        if value in AGGREGATIONS and (
+            self.next_is_call() or self.tokens_ahead(("name", "by"))
+        ):
+            return self.aggregate()
+        return self.selector()
+
+    def next_is_call(self) -> bool:
+        return self.tokens_ahead(("op", "("))
+
+    def tokens_ahead(self, token: tuple[str, str]) -> bool:
+        return (
+            self.index + 1 < len(self.tokens)
+            and self.tokens[self.index + 1][:2] == token
+        )
+
+    def by_clause(self) -> Optional[tuple[str, ...]]:
+        if not self.accept("name", "by"):
+            return None
+        self.take("op", "(")
+        labels = [self.take("name")]
+        while self.accept("op", ","):
+            labels.append(self.take("name"))
+        self.take("op", ")")
+        return tuple(labels)
+
+    def aggregate(self) -> Node:
+        op = self.take("name")
+        by = self.by_clause()
+        self.take("op", "(")
+        child = self.expr()
+        self.take("op", ")")
+        if by is None:
+            by = self.by_clause()
+        return self.plan.intern(Aggregate(op, by, child))
+
+    def rate(self) -> Node:
+        self.take("name", "rate")
+        self.take("op", "(")
+        selector = self.selector()
+        self.take("op", "[")
+        amount = float(self.take("number"))
+        unit = self.take("name")
+        if unit not in DURATION_UNITS:
+            raise self.error(f"unknown duration unit {unit!r}")
+        self.take("op", "]")
+        self.take("op", ")")
+        return self.plan.intern(Rate(selector, amount * DURATION_UNITS[unit]))
+
+    def selector(self) -> Selector:
+        name = self.take("name")
+        matchers = []
+        if self.accept("op", "{"):
+            while not self.accept("op", "}"):
+                label = self.take("name")
+                self.take("op", "=")
+                matchers.append((label, _unquote(self.take("string"))))
+                if not self.accept("op", ","):
+                    self.take("op", "}")
+                    break
+        return self.plan.intern(Selector(name, tuple(sorted(matchers))))
+
+
+def _unquote(text: str) -> str:
+    return re.sub(r"\\(.)", r"\1", text[1:-1])
+
+
+class ExpressionAnalyzer(MetricAnalyzer):
+    """
+    按配置中的表达式（PromQL 的一个小子集）计算派生指标，例如
+    100 * (1 - avg(windows_memory_physical_free_bytes)
+               / avg(windows_memory_physical_total_bytes))
+    rate(windows_net_bytes_received[5s]) * 8
+    所有表达式编译为一个查询计划，公共子表达式只计算一次，rate 的状态跨采集保留。
+    """
+
+    def __init__(self, expressions: dict[str, str]):
+        """
+        expressions: 结果的 metric 名 -> 表达式
+        """
+        self.plan = compile_expressions(expressions)
+        self.inputs = tuple(sorted(self.plan.inputs))
+        self.outputs = tuple(self.plan.roots)
+
+    def get_state(self) -> dict[str, Any]:
+        return {
+            "rates": {key: node.get_state() for key, node in self.plan.rates.items()}
+        }
+
+    def set_state(self, state: dict[str, Any]):
+        rates = self.plan.rates
+        for key, rate_state in state.get("rates", {}).items():
+            if key in rates:
+                rates[key].set_state(rate_state)
+
+    def analyze(
+        self, metrics: dict[str, Metric], scrape_time: float
+    ) -> Iterable[Metric]:
+        """
+        metrics: 采集到的所有 MetricFamily 或 Sample
+        返回：每个表达式一个 MetricFamily
+        """
+        results = self.plan.evaluate(metrics, scrape_time)
+        for name, value in results.items():
+            metric = Metric(name, self.plan.roots[name][0], "gauge")
+            samples = (
+                value if isinstance(value, list) else [Sample("", {}, value, None)]
+            )
+            for sample in samples:
+                # 除以 0 等得到的非有限值不写入历史
+                if math.isfinite(sample.value):
+                    metric.add_sample(
+                        name, sample.labels, sample.value, timestamp=scrape_time
+                    )
+            yield metric
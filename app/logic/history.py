@@ -1,30 +1,526 @@
-import time
-from collections import deque
-from typing import Callable, Any, Deque, Tuple, List
+import bisect
+import math
+from array import array
+from typing import (
+    Tuple,
+    Iterable,
+    NamedTuple,
+    Optional,
+    Sequence,
+)
 
-class MetricDataService:
+from prometheus_client import Metric
+from prometheus_client.samples import Sample
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def label_key(labels: dict[str, str]) -> LabelKey:
+    """
+    将 labels 转换为可哈希、与顺序无关的 key
+    """
+    return tuple(sorted(labels.items()))
+
+
+class SeriesRing:
+    """
+    单条时间序列的定长环形缓冲区。
+
+    时间戳和值分别存放在预分配的 array('d') 中。每个点同时写入 i 和 i + capacity
+    两个位置（镜像），因此最近的任意 n 个点在内存中总是连续的，
+    区间查询可以直接返回 memoryview 切片，不需要拷贝。
+    """
+
+    __slots__ = ("capacity", "_timestamps", "_values", "_state")
+
+    def __init__(
+        self,
+        capacity: int,
+        timestamps: Optional[memoryview] = None,
+        values: Optional[memoryview] = None,
+        state: Optional[memoryview] = None,
+    ):
+        """
+        capacity: 保留的最大点数
+        timestamps, values: 外部提供的缓冲区（格式 'd'，长度 2 * capacity），
+            例如共享内存中的一段，None 表示自行分配
+        state: 外部提供的状态缓冲区（格式 'q'，长度 1），保存累计写入的点数
+        """
+        self.capacity = capacity
+        if timestamps is None:
+            timestamps = memoryview(array("d", bytes(16 * capacity)))
+        if values is None:
+            values = memoryview(array("d", bytes(16 * capacity)))
+        if state is None:
+            state = memoryview(array("q", [0]))
+        self._timestamps = timestamps
+        self._values = values
+        self._state = state
+
+    @property
+    def count(self) -> int:
+        """
+        累计写入的点数
+        """
+        return self._state[0]
+
+    def __len__(self) -> int:
+        return min(self._state[0], self.capacity)
+
+    def append(self, timestamp: float, value: float):
+        count = self._state[0]
+        pos = count % self.capacity
+        mirror = pos + self.capacity
+        self._timestamps[pos] = self._timestamps[mirror] = timestamp
+        self._values[pos] = self._values[mirror] = value
+        self._state[0] = count + 1
+
+    def last(self) -> Optional[tuple[float, float]]:
+        """
+        获取最新的 (timestamp, value)，没有数据时返回 None
+        """
+        if not self.count:
+            return None
+        pos = (self.count - 1) % self.capacity
+        return self._timestamps[pos], self._values[pos]
+
+    def view(self) -> tuple[memoryview, memoryview]:
+        """
+        按时间顺序返回全部数据的 (timestamps, values) 视图（零拷贝）
+        """
+        end = self.count % self.capacity + self.capacity
+        start = end - len(self)
+        return self._timestamps[start:end], self._values[start:end]
+
+    def range(
+        self, start_time: float, end_time: float
+    ) -> tuple[memoryview, memoryview]:
+        """
+        返回 [start_time, end_time] 区间内的 (timestamps, values) 视图（零拷贝）
+        """
+        timestamps, values = self.view()
+        lo = bisect.bisect_left(timestamps, start_time)
+        hi = bisect.bisect_right(timestamps, end_time, lo)
+        return timestamps[lo:hi], values[lo:hi]
+
+
+class RollupTier(NamedTuple):
+    """
+    一个聚合层级：每 resolution 秒聚合为一个桶，保留 capacity 个桶
+    """
+
+    resolution: float
+    capacity: int
+
+    @classmethod
+    def from_retention(cls, resolution: float, retention: float) -> "RollupTier":
+        """
+        resolution: 桶的时长（秒）
+        retention: 保留的时长（秒）
+        """
+        return cls(float(resolution), max(1, math.ceil(retention / resolution)))
+
+
+class RollupRing:
+    """
+    单条时间序列某个聚合层级的环形缓冲区。
+
+    每个桶保存 start（桶开始时间）、min、max、sum、count 五个字段，
+    按字段连续存放在一个 array('d') 中。新样本落在最新的桶内时原地更新，
+    否则开始一个新桶，覆盖最旧的桶。
+    """
+
+    __slots__ = ("resolution", "capacity", "_data", "_state")
+
+    FIELDS = 5
+    _START, _MIN, _MAX, _SUM, _COUNT = range(FIELDS)
+
+    def __init__(
+        self,
+        tier: RollupTier,
+        data: Optional[memoryview] = None,
+        state: Optional[memoryview] = None,
+    ):
+        """
+        tier: 聚合层级
+        data: 外部提供的缓冲区（格式 'd'，长度 FIELDS * capacity），None 表示自行分配
+        state: 外部提供的状态缓冲区（格式 'q'，长度 1），保存累计开始的桶数
+        """
+        self.resolution = tier.resolution
+        self.capacity = tier.capacity
+        if data is None:
+            data = memoryview(array("d", bytes(8 * self.FIELDS * self.capacity)))
+        if state is None:
+            state = memoryview(array("q", [0]))
+        self._data = data
+        self._state = state
+
+    def __len__(self) -> int:
+        return min(self._state[0], self.capacity)
+
+    def add(self, timestamp: float, value: float):
+        data = self._data
+        capacity = self.capacity
+        start = math.floor(timestamp / self.resolution) * self.resolution
+        count = self._state[0]
+        if count:
+            pos = (count - 1) % capacity
+            last_start = data[pos]
+            if last_start == start:
+                if value < data[self._MIN * capacity + pos]:
+                    data[self._MIN * capacity + pos] = value
+                if value > data[self._MAX * capacity + pos]:
+                    data[self._MAX * capacity + pos] = value
+                data[self._SUM * capacity + pos] += value
+                data[self._COUNT * capacity + pos] += 1
+                return
+            if start < last_start:
+                # 比最新的桶还旧的样本，忽略
+                return
+        pos = count % capacity
+        data[pos] = start
+        data[self._MIN * capacity + pos] = value
+        data[self._MAX * capacity + pos] = value
+        data[self._SUM * capacity + pos] = value
+        data[self._COUNT * capacity + pos] = 1
+        self._state[0] = count + 1
+
+    def first_time(self) -> Optional[float]:
+        """
+        最旧的桶的开始时间，没有数据时返回 None
+        """
+        if not self._state[0]:
+            return None
+        return self._data[(self._state[0] - len(self)) % self.capacity]
+
+    def _bisect(self, first: int, size: int, timestamp: float) -> int:
+        # 在逻辑顺序上二分查找第一个开始时间大于 timestamp 的桶
+        lo, hi = 0, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._data[(first + mid) % self.capacity] > timestamp:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _copy(self, field: int, first: int, lo: int, hi: int) -> array:
+        # 按逻辑顺序拷贝 [lo, hi) 区间的某个字段，最多分成两段
+        base = field * self.capacity
+        start = (first + lo) % self.capacity
+        end = start + hi - lo
+        if end <= self.capacity:
+            return array("d", self._data[base + start : base + end].tobytes())
+        result = array("d", self._data[base + start : base + self.capacity].tobytes())
+        result.frombytes(self._data[base : base + end - self.capacity].tobytes())
+        return result
+
+    def range(self, start_time: float, end_time: float) -> tuple[array, ...]:
+        """
+        返回与 [start_time, end_time] 相交的桶的
+        (starts, mins, maxs, averages, counts) 拷贝
+        """
+        size = len(self)
+        first = (self._state[0] - size) % self.capacity
+        lo = self._bisect(first, size, start_time - self.resolution)
+        hi = self._bisect(first, size, end_time)
+        if hi <= lo:
+            return tuple(array("d") for _ in range(self.FIELDS))
+        starts = self._copy(self._START, first, lo, hi)
+        mins = self._copy(self._MIN, first, lo, hi)
+        maxs = self._copy(self._MAX, first, lo, hi)
+        sums = self._copy(self._SUM, first, lo, hi)
+        counts = self._copy(self._COUNT, first, lo, hi)
+        averages = array("d", [total / n for total, n in zip(sums, counts)])
+        return starts, mins, maxs, averages, counts
+
+
+class SeriesView(NamedTuple):
+    """
+    一条时间序列在某个区间内的只读视图。
+    来自聚合层级时，timestamps 是桶的开始时间，values 是桶内的平均值，
+    并额外提供每个桶的 min/max/count。最新的桶还没有结束时，
+    它的时间和值是原始数据的最新点，下一次查询可能会被替换。
+    """
+
+    name: str
+    labels: dict[str, str]
+    timestamps: Sequence[float]
+    values: Sequence[float]
+    resolution: float = 0.0  # 桶的时长（秒），0 表示原始数据
+    mins: Optional[Sequence[float]] = None
+    maxs: Optional[Sequence[float]] = None
+    counts: Optional[Sequence[float]] = None
+
+
+SeriesEntry = Tuple[dict[str, str], SeriesRing, Tuple[RollupRing, ...]]
+
+
+class SeriesStore:
     """
-    拉模式时序数据服务：每次 get_history 都会实时拉取新数据并缓存。
+    按序列（metric 名 + labels）存储的列式历史数据，每条序列一个 SeriesRing，
+    以及每个聚合层级一个 RollupRing，用于查询较长的时间范围。
     """
-    def __init__(self, data_source: Callable[[], dict], maxlen: int = 300):
+
+    def __init__(self, capacity: int = 300, tiers: Iterable[RollupTier] = ()):
+        """
+        capacity: 每条序列保留的最大点数
+        tiers: 聚合层级，按 resolution 从小到大排列
+        """
+        self.capacity = capacity
+        self.tiers = tuple(sorted(tiers))
+        # name -> (documentation, type, unit)
+        self.families: dict[str, tuple[str, str, str]] = {}
+        # 序列 id -> (labels, ring, rollups)，id 按创建顺序分配，不会变化
+        self.entries: list[SeriesEntry] = []
+        # name -> {label_key: 序列 id}
+        self.series: dict[str, dict[LabelKey, int]] = {}
+        # 倒排索引：name -> {(label, value): 序列 id 集合}
+        self.postings: dict[str, dict[tuple[str, str], set[int]]] = {}
+        self.last_time: Optional[float] = None
+
+    def __bool__(self) -> bool:
+        return self.last_time is not None
+
+    def _create_series(
+        self, name: str, labels: dict[str, str]
+    ) -> Optional[tuple[SeriesRing, tuple[RollupRing, ...]]]:
+        """
+        为新序列分配 SeriesRing 和各聚合层级的 RollupRing，
+        子类可以从共享内存等外部缓冲区分配。
+        返回 None 表示无法分配，该序列会被丢弃。
+        """
+        return SeriesRing(self.capacity), tuple(RollupRing(t) for t in self.tiers)
+
+    def _add_series(
+        self,
+        name: str,
+        labels: dict[str, str],
+        ring: SeriesRing,
+        rollups: tuple[RollupRing, ...],
+    ) -> int:
+        """
+        登记一条新序列：分配序列 id，加入 label_key 映射和倒排索引
+        返回：序列 id
+        """
+        series_id = len(self.entries)
+        self.entries.append((labels, ring, rollups))
+        self.series.setdefault(name, {})[label_key(labels)] = series_id
+        postings = self.postings.setdefault(name, {})
+        for item in labels.items():
+            postings.setdefault(item, set()).add(series_id)
+        return series_id
+
+    def series_ids(
+        self, name: str, labels: Optional[dict[str, str]] = None
+    ) -> list[int]:
+        """
+        查找匹配的序列 id（按创建顺序）。
+        按 labels 过滤时对倒排索引求交集，不需要逐条比较序列的 labels。
+        :param name: 指标名称
+        :param labels: 按哪些labels过滤，None表示不过滤
+        """
+        if not labels:
+            return list(self.series.get(name, {}).values())
+        postings = self.postings.get(name, {})
+        matches = []
+        for item in labels.items():
+            ids = postings.get(item)
+            if not ids:
+                return []
+            matches.append(ids)
+        matches.sort(key=len)
+        return sorted(matches[0].intersection(*matches[1:]))
+
+    @property
+    def persistent(self) -> bool:
+        """
+        数据是否会保存下来（重启后仍然存在），内存中的存储返回 False
+        """
+        return False
+
+    def save_state(self, state: dict):
+        """
+        保存与历史数据配套的状态（例如分析器的计数器），内存中的存储什么也不做
+        """
+
+    def load_state(self) -> Optional[dict]:
+        """
+        读取 save_state 保存的状态，没有时返回 None
+        """
+        return None
+
+    def flush(self):
+        """
+        把数据写回持久化存储，内存中的存储什么也不做
+        """
+
+    def _begin_write(self):
+        """
+        一次写入开始前调用，子类可以用来做读写同步
+        """
+
+    def _end_write(self):
+        """
+        一次写入结束后调用
+        """
+
+    def append(self, scrape_time: float, metrics: Iterable[Metric]):
+        """
+        写入一次采集/分析得到的所有 metric
+        """
+        self._begin_write()
+        try:
+            self._append(scrape_time, metrics)
+        finally:
+            self._end_write()
+
+    def _append(self, scrape_time: float, metrics: Iterable[Metric]):
+        for metric in metrics:
+            if metric.name not in self.families:
+                self.families[metric.name] = (
+                    metric.documentation,
+                    metric.type,
+                    metric.unit,
+                )
+                self.series[metric.name] = {}
+            series = self.series[metric.name]
+            for sample in metric.samples:
+                series_id = series.get(label_key(sample.labels))
+                if series_id is None:
+                    created = self._create_series(metric.name, sample.labels)
+                    if created is None:
+                        continue
+                    series_id = self._add_series(
+                        metric.name, dict(sample.labels), *created
+                    )
+                entry = self.entries[series_id]
+                timestamp = float(
+                    sample.timestamp if sample.timestamp is not None else scrape_time
+                )
+                value = float(sample.value)
+                entry[1].append(timestamp, value)
+                for rollup in entry[2]:
+                    rollup.add(timestamp, value)
+        self.last_time = scrape_time
+
+    def _select(
+        self, name: str, labels: Optional[dict[str, str]] = None
+    ) -> Iterable[SeriesEntry]:
+        for series_id in self.series_ids(name, labels):
+            yield self.entries[series_id]
+
+    def _pick_rollup(
+        self,
+        ring: SeriesRing,
+        rollups: tuple[RollupRing, ...],
+        start_time: float,
+        end_time: float,
+        width: Optional[int],
+    ) -> Optional[RollupRing]:
+        """
+        选择查询使用的层级，None 表示原始数据。
+        只考虑能覆盖整个区间的层级（原始数据未覆盖时也可能是旧数据已被覆盖），
+        其中选择桶数仍不少于 width 的最粗的层级；都不满足时选择最细的层级。
+        """
+        window = end_time - start_time
+        raw_timestamps, _ = ring.view()
+        raw_covers = ring.count <= ring.capacity or (
+            len(raw_timestamps) and raw_timestamps[0] <= start_time
+        )
+        candidates: list[Optional[RollupRing]] = [None] if raw_covers else []
+        for rollup in rollups:
+            first_time = rollup.first_time()
+            if rollup.resolution * rollup.capacity >= window or (
+                first_time is not None and first_time <= start_time
+            ):
+                candidates.append(rollup)
+        if not candidates:
+            # 没有层级能覆盖整个区间，使用保留时间最长的层级
+            return rollups[-1] if rollups else None
+        if width is None:
+            return candidates[0]
+        chosen = candidates[0]
+        for rollup in candidates:
+            if rollup is not None and window / rollup.resolution >= width:
+                chosen = rollup
+        return chosen
+
+    def query(
+        self,
+        name: str,
+        start_time: float,
+        end_time: float,
+        labels: Optional[dict[str, str]] = None,
+        width: Optional[int] = None,
+    ) -> list[SeriesView]:
+        """
+        查询区间内的数据，每条匹配的序列返回一个 SeriesView
+        :param name: 指标名称
+        :param start_time: 开始时间（时间戳）
+        :param end_time: 结束时间（时间戳）
+        :param labels: 按哪些labels过滤，None表示不过滤
+        :param width: 图表的像素宽度，用于选择聚合层级，None表示尽量使用原始数据
+        """
+        result = []
+        for series_labels, ring, rollups in self._select(name, labels):
+            rollup = self._pick_rollup(ring, rollups, start_time, end_time, width)
+            if rollup is None:
+                timestamps, values = ring.range(start_time, end_time)
+                if len(timestamps):
+                    result.append(SeriesView(name, series_labels, timestamps, values))
+                continue
+            starts, mins, maxs, averages, counts = rollup.range(start_time, end_time)
+            last = ring.last()
+            if last is not None and start_time <= last[0] <= end_time:
+                timestamp, value = last
+                if (
+                    len(starts)
+                    and starts[-1] <= timestamp < starts[-1] + rollup.resolution
+                ):
+                    # 最新的桶还没有结束，用原始数据的最新点整个代替它（最小、最大值都是这个点，计数为1），
+                    # 使最新值与原始数据一致；桶结束后这个点会换成完整的桶，图表只缓存最后一个点之前的数据
+                    for column in (starts, mins, maxs, averages, counts):
+                        column.pop()
+                for column, item in zip(
+                    (starts, mins, maxs, averages, counts),
+                    (timestamp, value, value, value, 1),
+                ):
+                    column.append(item)
+            if len(starts):
+                result.append(
+                    SeriesView(
+                        name,
+                        series_labels,
+                        starts,
+                        averages,
+                        rollup.resolution,
+                        mins,
+                        maxs,
+                        counts,
+                    )
+                )
+        return result
+
+    def latest(
+        self, name: str, labels: Optional[dict[str, str]] = None
+    ) -> list[Sample]:
         """
-        data_source: 一个无参函数，返回最新的指标数据（如 {"cpu": 12.3, "mem": 45.6}）
-        maxlen: 历史数据点数
+        获取最近一次写入时仍然存在的序列的最新样本
         """
-        self.data_source = data_source
-        self.maxlen = maxlen
-        # {metric_name: deque([(timestamp, value), ...])}
-        self.history: dict[str, Deque[Tuple[float, Any]]] = {}
+        result = []
+        for series_labels, ring, _ in self._select(name, labels):
+            last = ring.last()
+            if last is None or last[0] != self.last_time:
+                continue
+            result.append(Sample(name, series_labels, last[1], last[0]))
+        return result
 
-    def get_history(self) -> dict[str, List[Tuple[float, Any]]]:
+    def to_metric(self, name: str, samples: Iterable[Sample]) -> Metric:
         """
-        拉取最新数据，加入历史，返回所有历史数据
+        用存储的元数据把样本组装成 Metric
         """
-        now = time.time()
-        latest = self.data_source()  # 获取最新数据
-        for k, v in latest.items():
-            if k not in self.history:
-                self.history[k] = deque(maxlen=self.maxlen)
-            self.history[k].append((now, v))
-        # 返回所有历史
-        return {k: list(deq) for k, deq in self.history.items()}
+        documentation, typ, unit = self.families[name]
+        metric = Metric(name, documentation, typ, unit)
+        metric.samples = list(samples)
+        return metric
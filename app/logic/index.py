@@ -5,8 +5,13 @@ from typing import Iterable, Literal, Optional
 from prometheus_client import Metric
 from prometheus_client.samples import Sample
 
+from .history import SeriesView
+from .parse import CompactFamily, FamilyGroup
 from .utils import assert_samples_consistent
 
+# 多目标采集时标识目标的 label
+HOST_LABEL = "host"
+
 
 def build_metric_map(metrics: Iterable[Metric]) -> dict[str, Metric]:
     """
@@ -15,6 +20,41 @@ def build_metric_map(metrics: Iterable[Metric]) -> dict[str, Metric]:
     return {m.name: m for m in metrics}
 
 
+def add_labels(samples: Iterable[Sample], labels: dict[str, str]) -> list[Sample]:
+    """
+    给样本追加 labels（同名 label 会被覆盖）
+    """
+    return [s._replace(labels={**s.labels, **labels}) for s in samples]
+
+
+def split_metric_map_by_label(
+    metrics: dict[str, Metric], label: str
+) -> dict[str, dict[str, Metric]]:
+    """
+    按某个 label 的值拆分 metric 映射，例如按 host 拆分多目标采集的结果
+    :param metrics: name -> Metric 的映射
+    :param label: 用于拆分的 label 名，没有该 label 的样本归入 ""
+    :return: label 值 -> (name -> Metric) 的映射
+    """
+    result: dict[str, dict[str, Metric]] = defaultdict(dict)
+    for name, metric in metrics.items():
+        parts = metric.families if isinstance(metric, FamilyGroup) else (metric,)
+        for part in parts:
+            if isinstance(part, CompactFamily) and label in part.table.const_labels:
+                # 驻留表为所有样本加上了这个 label，整个 family 属于同一个值，不需要拆分
+                result[part.table.const_labels[label]][name] = part
+                continue
+            for s in part.samples:
+                value = s.labels.get(label, "")
+                split_metric = result[value].get(name)
+                if split_metric is None:
+                    split_metric = result[value][name] = Metric(
+                        part.name, part.documentation, part.type, part.unit
+                    )
+                split_metric.samples.append(s)
+    return result
+
+
 def filter_by_labels(
     samples: Iterable[Sample], labels: Optional[dict[str, str]] = None
 ) -> Iterable[Sample]:
@@ -67,22 +107,27 @@ def aggregate_by(
 
     # 聚合
     for group in group_dict.values():
-        values = group["values"]
-        group_labels = group["labels"]
-        if agg == "avg":
-            agg_value = statistics.mean(values)
-        elif agg == "sum":
-            agg_value = sum(values)
-        elif agg == "max":
-            agg_value = max(values)
-        elif agg == "min":
-            agg_value = min(values)
-        elif agg == "count":
-            agg_value = len(values)
-        else:
-            raise ValueError(f"Unknown agg: {agg}")
+        agg_value = aggregate_values(group["values"], agg)
+        yield Sample(name, group["labels"], agg_value, timestamp)
 
-        yield Sample(name, group_labels, agg_value, timestamp)
+
+def aggregate_values(values: list[float], agg: AggType = "avg") -> float:
+    """
+    对一组数值做聚合
+    agg: "avg", "sum", "max", "min", "count"
+    """
+    if agg == "avg":
+        return statistics.mean(values)
+    elif agg == "sum":
+        return sum(values)
+    elif agg == "max":
+        return max(values)
+    elif agg == "min":
+        return min(values)
+    elif agg == "count":
+        return len(values)
+    else:
+        raise ValueError(f"Unknown agg: {agg}")
 
 
 def sum_by(samples: Iterable[Sample], labels: list[str] = None) -> Iterable[Sample]:
@@ -196,3 +241,61 @@ def get_value_from_metric_group_by(
         (timestamp, grouped_values[timestamp])
         for timestamp in sorted(grouped_values.keys())
     ]
+
+
+def get_value_from_series(
+    series: list[SeriesView],
+    agg: AggType = "avg",
+) -> list[tuple[float, float]]:
+    """
+    从序列视图中获取值，同一时间戳的多条序列按 agg 聚合
+    :param series: 序列视图列表
+    :param agg: 聚合方式
+    :return: 按时间排序的 (timestamp, value) 列表
+    """
+    if not series:
+        return []
+    if len(series) == 1:
+        return list(zip(series[0].timestamps, series[0].values))
+
+    grouped_values: dict[float, list[float]] = defaultdict(list)
+    for s in series:
+        for timestamp, value in zip(s.timestamps, s.values):
+            grouped_values[timestamp].append(value)
+
+    return [
+        (timestamp, aggregate_values(grouped_values[timestamp], agg))
+        for timestamp in sorted(grouped_values.keys())
+    ]
+
+
+def get_value_from_series_group_by(
+    series: list[SeriesView],
+    group_label: str,
+    agg: AggType = "avg",
+) -> list[tuple[float, dict[str, float]]]:
+    """
+    从序列视图中获取值，按 group_label 分组
+    :param series: 序列视图列表
+    :param group_label: 分组标签
+    :param agg: 聚合方式
+    :return: 按时间排序的 (timestamp, {label_value: value}) 列表
+    """
+    grouped_values: dict[float, dict[str, list[float]]] = defaultdict(
+        lambda: defaultdict(list)
+    )
+    for s in series:
+        group = s.labels.get(group_label, "")
+        for timestamp, value in zip(s.timestamps, s.values):
+            grouped_values[timestamp][group].append(value)
+
+    return [
+        (
+            timestamp,
+            {
+                group: aggregate_values(values, agg)
+                for group, values in grouped_values[timestamp].items()
+            },
+        )
+        for timestamp in sorted(grouped_values.keys())
+    ]
@@ -0,0 +1,200 @@
+from typing import NamedTuple, Optional
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+# 各阶段耗时的分桶（秒），从 0.1 毫秒到 2.5 秒
+DURATION_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+# 响应体大小的分桶（字节）
+SIZE_BUCKETS = tuple(2**i for i in range(10, 25, 2))
+
+
+class StageTotal(NamedTuple):
+    """
+    一个阶段的累计值：直方图为观测次数和耗时之和，计数器和 gauge 的 total 为当前值
+    """
+
+    name: str
+    count: float
+    total: float
+
+
+class PipelineMetrics:
+    """
+    仪表盘自身的指标：采集、解析、各分析器、构建快照和绘制每个图表的耗时，
+    以及画布元素数、超时的帧、超时、采集失败和跳过的采集周期。
+    注册在独立的 CollectorRegistry 中（不会混入采集到的数据），可以用
+    prometheus_client 导出，也可以用 stage_totals 读取后显示在界面上。
+    """
+
+    def __init__(self, registry: Optional[CollectorRegistry] = None):
+        """
+        registry: 注册到哪个 registry，None 表示新建一个
+        """
+        self.registry = registry if registry is not None else CollectorRegistry()
+        r = self.registry
+        self.scrape_duration = Histogram(
+            "dashboard_scrape_duration_seconds",
+            "Time to fetch the exporter response, per target",
+            ["target"],
+            buckets=DURATION_BUCKETS,
+            registry=r,
+        )
+        self.scrape_bytes = Histogram(
+            "dashboard_scrape_response_bytes",
+            "Decompressed exporter response size, per target",
+            ["target"],
+            buckets=SIZE_BUCKETS,
+            registry=r,
+        )
+        self.scrape_wire_bytes = Counter(
+            "dashboard_scrape_wire_bytes",
+            "Bytes received from the exporter (compressed), per target",
+            ["target"],
+            registry=r,
+        )
+        self.scrape_failures = Counter(
+            "dashboard_scrape_failures",
+            "Failed scrapes, per target",
+            ["target"],
+            registry=r,
+        )
+        self.parse_duration = Histogram(
+            "dashboard_parse_duration_seconds",
+            "Time to parse the exporter response, per target",
+            ["target"],
+            buckets=DURATION_BUCKETS,
+            registry=r,
+        )
+        self.analyzer_duration = Histogram(
+            "dashboard_analyzer_duration_seconds",
+            "Time spent in each analyzer per tick",
+            ["analyzer"],
+            buckets=DURATION_BUCKETS,
+            registry=r,
+        )
+        self.analyzer_failures = Counter(
+            "dashboard_analyzer_failures",
+            "Analyzer runs that raised, per analyzer",
+            ["analyzer"],
+            registry=r,
+        )
+        self.tick_duration = Histogram(
+            "dashboard_tick_duration_seconds",
+            "Time of a whole engine tick: collect, analyze, store and callbacks",
+            buckets=DURATION_BUCKETS,
+            registry=r,
+        )
+        self.collect_failures = Counter(
+            "dashboard_collect_failures",
+            "Engine ticks whose collect raised an exception",
+            registry=r,
+        )
+        self.skipped_ticks = Counter(
+            "dashboard_skipped_ticks",
+            "Engine ticks not collected, or collected but superseded before analysis",
+            registry=r,
+        )
+        self.tick_overruns = Counter(
+            "dashboard_tick_overruns",
+            "Ticks whose collect or analysis missed the deadline of one interval",
+            ["stage"],
+            registry=r,
+        )
+        self.snapshot_duration = Histogram(
+            "dashboard_snapshot_duration_seconds",
+            "Time to query the history and build the UI snapshot",
+            buckets=DURATION_BUCKETS,
+            registry=r,
+        )
+        self.dropped_snapshots = Counter(
+            "dashboard_dropped_snapshots",
+            "Snapshots replaced by a newer one before the UI applied them",
+            registry=r,
+        )
+        self.chart_draw_duration = Histogram(
+            "dashboard_chart_draw_duration_seconds",
+            "Time to redraw each chart",
+            ["chart"],
+            buckets=DURATION_BUCKETS,
+            registry=r,
+        )
+        self.canvas_items = Gauge(
+            "dashboard_canvas_items",
+            "Canvas items of each chart after its last redraw",
+            ["chart"],
+            registry=r,
+        )
+        self.frame_overruns = Counter(
+            "dashboard_frame_overruns",
+            "Frames whose redraw took longer than the frame interval",
+            registry=r,
+        )
+
+    def stage_totals(self) -> tuple[StageTotal, ...]:
+        """
+        各阶段的累计值，按 label 分开（名字为 "阶段:label 值"）并给出所有 label 的合计。
+        阶段名去掉 dashboard_ 前缀和单位后缀，例如 analyzer_duration:CpuUsageAnalyzer
+        """
+        totals: dict[str, list[float]] = {}
+
+        def add(name: str, count: float, total: float):
+            entry = totals.setdefault(name, [0.0, 0.0])
+            entry[0] += count
+            entry[1] += total
+
+        for collector in (
+            self.scrape_duration,
+            self.scrape_bytes,
+            self.scrape_wire_bytes,
+            self.scrape_failures,
+            self.parse_duration,
+            self.analyzer_duration,
+            self.analyzer_failures,
+            self.tick_duration,
+            self.collect_failures,
+            self.skipped_ticks,
+            self.tick_overruns,
+            self.snapshot_duration,
+            self.dropped_snapshots,
+            self.chart_draw_duration,
+            self.canvas_items,
+            self.frame_overruns,
+        ):
+            for family in collector.collect():
+                stage = family.name.removeprefix("dashboard_")
+                for unit in ("_seconds", "_bytes"):
+                    stage = stage.removesuffix(unit)
+                for sample in family.samples:
+                    label = next(iter(sample.labels.values()), None)
+                    if family.type == "histogram":
+                        if sample.name.endswith("_count"):
+                            values = (sample.value, 0.0)
+                        elif sample.name.endswith("_sum"):
+                            values = (0.0, sample.value)
+                        else:
+                            continue
+                    elif sample.name.endswith("_created"):
+                        continue
+                    else:
+                        values = (1.0, sample.value)
+                    add(stage, *values)
+                    if label is not None:
+                        add(f"{stage}:{label}", *values)
+        return tuple(
+            StageTotal(name, count, total) for name, (count, total) in totals.items()
+        )
@@ -1,76 +1,50 @@
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
-from .index import get_value_from_metric, get_value_from_metric_group_by
+from ..data_history import DataSnapshot
+from .index import (
+    get_value_from_series,
+    get_value_from_series_group_by,
+)
 
 if TYPE_CHECKING:
     from app.main_window import MonitoringDashboardApp
 
 
-def update_metrics(app: "MonitoringDashboardApp"):
-    # 这里实现 update_metrics 逻辑
-    # 通过 app.engine、app.data_history 等访问数据
-
+def build_snapshot(app: "MonitoringDashboardApp") -> DataSnapshot:
+    """
+    查询引擎中的数据，构建界面要显示的快照（在引擎线程中调用）。
+    这里不访问图表的数据，图表在界面线程中从快照更新。
+    """
     scrape_time = app.engine.get_last_scrape_time()
-    cpu_usage_metrics = app.engine.get_metric_range(
-        "cpu_usage_percent", scrape_time - 61, scrape_time
-    )
-    memory_usage_metrics = app.engine.get_metric_range(
-        "memory_usage_percent", scrape_time - 61, scrape_time
-    )
-    memory_commit_metrics = app.engine.get_metric_range(
-        "memory_commit_rate_percent", scrape_time - 61, scrape_time
-    )
-    disk_usage_metrics = app.engine.get_metric_range(
-        "disk_io_util_percent", scrape_time - 61, scrape_time
-    )
-    network_usage_metrics = app.engine.get_metric_range(
-        "network_speed_mbps", scrape_time - 61, scrape_time
-    )
-    logical_disk_total_metrics = app.engine.get_metric("logical_disk_size_bytes")
-    logical_disk_free_metrics = app.engine.get_metric("logical_disk_free_bytes")
-    gpu_usage_metrics = app.engine.get_metric_range(
-        "gpu_usage_percent", scrape_time - 61, scrape_time
-    )
+    # 显示的时间窗口，多查询一点窗口左边的数据，使折线从左边缘开始
+    window = app.time_window
+    start_time = scrape_time - window
+    query_start = start_time - window / 60
+    # 图表的像素宽度，用于选择聚合层级
+    width = app.chart_manager.cpu_chart.content_rect[2] or None
 
-    app.data_history.cpu_history = get_value_from_metric(cpu_usage_metrics)
-    app.chart_manager.cpu_chart.update_values(
-        app.data_history.cpu_history, scrape_time - 60, scrape_time
-    )
-    app.data_history.memory_history = get_value_from_metric(memory_usage_metrics)
-    app.chart_manager.memory_chart.update_values(
-        app.data_history.memory_history, scrape_time - 60, scrape_time
-    )
-    app.data_history.memory_commit_history = get_value_from_metric(
-        memory_commit_metrics
-    )
-    app.chart_manager.memory_commit_chart.update_values(
-        app.data_history.memory_commit_history, scrape_time - 60, scrape_time
-    )
-    app.data_history.disk0_history = get_value_from_metric(
-        disk_usage_metrics, {"disk": "0"}
-    )
-    app.data_history.disk1_history = get_value_from_metric(
-        disk_usage_metrics, {"disk": "1"}
-    )
-    app.chart_manager.disk0_chart.update_values(
-        app.data_history.disk0_history, scrape_time - 60, scrape_time
-    )
-    app.chart_manager.disk1_chart.update_values(
-        app.data_history.disk1_history, scrape_time - 60, scrape_time
-    )
-    app.data_history.network_history_received = get_value_from_metric(
-        network_usage_metrics, {"direction": "received"}
-    )
-    app.chart_manager.network_chart_received.update_values(
-        app.data_history.network_history_received, scrape_time - 60, scrape_time
-    )
-    app.data_history.network_history_sent = get_value_from_metric(
-        network_usage_metrics, {"direction": "sent"}
+    def query_series(metric_name: str, labels: Optional[dict[str, str]] = None):
+        # labels 过滤交给历史存储的倒排索引
+        return app.engine.get_series_range(
+            metric_name,
+            query_start,
+            scrape_time,
+            {**(app.host_labels or {}), **(labels or {})} or None,
+            width,
+        )
+
+    def query_points(metric_name: str, labels: Optional[dict[str, str]] = None):
+        return tuple(get_value_from_series(query_series(metric_name, labels)))
+
+    cpu_usage_series = query_series("cpu_usage_percent")
+    logical_disk_total_metrics = app.engine.get_metric(
+        "logical_disk_size_bytes", app.host_labels
     )
-    app.chart_manager.network_chart_sent.update_values(
-        app.data_history.network_history_sent, scrape_time - 60, scrape_time
+    logical_disk_free_metrics = app.engine.get_metric(
+        "logical_disk_free_bytes", app.host_labels
     )
 
+    logical_disk_space_values = None
     logical_disk_space_values_map: dict[str, tuple[float, float]] = {}
     if logical_disk_total_metrics:
         for disk in logical_disk_total_metrics.samples:
@@ -86,37 +60,47 @@ def update_metrics(app: "MonitoringDashboardApp"):
                 disk.value,
                 logical_disk_space_values_map[disk_name][1],
             )
-        app.data_history.logical_disk_space_values = [
+        logical_disk_space_values = tuple(
             (disk_name, free_space, total_space)
             for disk_name, (
                 free_space,
                 total_space,
             ) in logical_disk_space_values_map.items()
-        ]
-        app.chart_manager.logical_disk_usage_chart.update_values(
-            app.data_history.logical_disk_space_values
         )
 
-    heatmap_map = get_value_from_metric_group_by(
-        cpu_usage_metrics,
-        ["core"],
-    )
+    heatmap_map = get_value_from_series_group_by(cpu_usage_series, "core")
 
     # 处理 CPU 热力图数据
     def sort_key(item):
         x, y = map(int, item[0].split(","))
         return (x + 1) * y
 
-    app.data_history.cpu_heatmap_history = [
-        (timestamp, [value for _, value in sorted(values.items(), key=sort_key)])
+    cpu_heatmap_history = tuple(
+        (
+            timestamp,
+            tuple(value for _, value in sorted(values.items(), key=sort_key)),
+        )
         for timestamp, values in heatmap_map
-    ]
-    app.chart_manager.cpu_heatmap_chart.update_values(
-        app.data_history.cpu_heatmap_history, scrape_time - 60, scrape_time
-    )
-    app.data_history.gpu_history = get_value_from_metric(
-        gpu_usage_metrics, {"device": "0"}
     )
-    app.chart_manager.gpu_chart.update_values(
-        app.data_history.gpu_history, scrape_time - 60, scrape_time
+
+    return DataSnapshot(
+        start_time=start_time,
+        end_time=scrape_time,
+        cpu_history=tuple(get_value_from_series(cpu_usage_series)),
+        memory_history=query_points("memory_usage_percent"),
+        disk0_history=query_points("disk_io_util_percent", {"disk": "0"}),
+        disk1_history=query_points("disk_io_util_percent", {"disk": "1"}),
+        network_history_received=query_points(
+            "network_speed_mbps", {"direction": "received"}
+        ),
+        network_history_sent=query_points("network_speed_mbps", {"direction": "sent"}),
+        cpu_heatmap_history=cpu_heatmap_history,
+        memory_commit_history=query_points("memory_commit_rate_percent"),
+        logical_disk_space_values=logical_disk_space_values,
+        gpu_history=query_points("gpu_usage_percent", {"device": "0"}),
+        stage_totals=(
+            app.pipeline_metrics.stage_totals()
+            if app.chart_manager.hud is not None
+            else None
+        ),
     )
@@ -0,0 +1,400 @@
+import math
+import re
+from array import array
+from typing import Collection, Iterator, Optional, Sequence, Union
+
+from prometheus_client.parser import parse_labels
+from prometheus_client.samples import Sample
+
+# 同一个 MetricFamily 在文本格式中可能出现的样本名后缀
+FAMILY_SUFFIXES = ("", "_total", "_created", "_count", "_sum", "_bucket", "_info")
+
+# 在每个 "# HELP" 行之前切分，windows_exporter 的每个 family 都以 HELP 行开头
+_HELP_BLOCK_PATTERN = re.compile(r"^(?=# HELP )", re.MULTILINE)
+
+
+def expand_family_names(families: Collection[str]) -> set[str]:
+    """
+    把 family 名展开为文本格式中可能出现的所有样本名/HELP 名
+    例如 windows_cpu_time -> windows_cpu_time, windows_cpu_time_total, ...
+    """
+    return {family + suffix for family in families for suffix in FAMILY_SUFFIXES}
+
+
+def _line_metric_name(line: str) -> str:
+    """
+    取出一行文本中的指标名（注释行取 HELP/TYPE 后面的名字）
+    """
+    if line.startswith("#"):
+        parts = line.split(None, 3)
+        if len(parts) > 2 and parts[1] in ("HELP", "TYPE"):
+            return parts[2]
+        return ""
+    end = len(line)
+    for sep in ("{", " "):
+        pos = line.find(sep, 0, end)
+        if pos != -1:
+            end = pos
+    return line[:end]
+
+
+def _filter_lines(text: str, allowed: set[str]) -> str:
+    kept = []
+    for line in text.splitlines(keepends=True):
+        if _line_metric_name(line.strip()) in allowed:
+            kept.append(line)
+    return "".join(kept)
+
+
+def filter_exposition_text(text: str, families: Collection[str]) -> str:
+    """
+    只保留 families 中列出的 MetricFamily 的文本，其余 family 直接跳过，
+    不会为它们创建 Metric 或 Sample 对象。
+    以 "# HELP" 开头的块按块整体判断，其余内容逐行判断。
+    :param text: Prometheus 文本格式的内容
+    :param families: 需要保留的 family 名（与 Metric.name 一致，例如 windows_cpu_time）
+    :return: 过滤后的文本
+    """
+    allowed = expand_family_names(families)
+    kept = []
+    for block in _HELP_BLOCK_PATTERN.split(text):
+        if not block.startswith("# HELP "):
+            kept.append(_filter_lines(block, allowed))
+            continue
+        name_end = block.find(" ", 7)
+        line_end = block.find("\n", 7)
+        if name_end == -1 or (line_end != -1 and line_end < name_end):
+            name_end = line_end if line_end != -1 else len(block)
+        if block[7:name_end] in allowed:
+            kept.append(block)
+    return "".join(kept)
+
+
+# HELP 行中的转义
+_HELP_ESCAPES = {"\\\\": "\\", "\\n": "\n"}
+_HELP_ESCAPE_PATTERN = re.compile(r"\\[\\n]")
+
+# 各类型的 family 允许的样本名后缀（与 prometheus_client 的文本解析器一致）
+_TYPE_SUFFIXES = {
+    "counter": ("",),
+    "gauge": ("",),
+    "summary": ("_count", "_sum", ""),
+    "histogram": ("_count", "_sum", "_bucket"),
+}
+
+
+class LabelSetTable:
+    """
+    样本的驻留表：文本中每个样本的 "name{labels}" 部分对应一个固定的 id，
+    相同的样本在多次采集之间共享同一个 labels dict，只在第一次出现时解析 labels。
+    由一个采集器独占使用，labels dict 是共享的，使用方不能修改。
+    const_labels 会在登记时加入每个样本的 labels（例如多目标采集的 host 标签），
+    这样注入标签不需要为每个样本复制 labels。
+    """
+
+    # 驻留的条目数超过最近一次采集的样本数的这么多倍时，说明积累了大量已经消失的
+    # 序列（例如按进程 id 区分的序列），应该换一个新表
+    STALE_FACTOR = 4
+    # 条目数不超过这个值时不更换
+    MIN_SIZE = 4096
+
+    def __init__(self, const_labels: Optional[dict[str, str]] = None):
+        """
+        :param const_labels: 加入每个样本的 labels（同名 label 会被覆盖），None 表示不加
+        """
+        self.const_labels = const_labels or {}
+        # 文本格式的键为样本行中数值之前的部分，protobuf 格式的键为编码后的字节串
+        self.ids: dict[Union[str, bytes], int] = {}
+        # id -> 样本名 / labels
+        self.names: list[str] = []
+        self.labels: list[dict[str, str]] = []
+        # labels 名元组 -> 按 id 排列的 label 值元组（label_values 的缓存）
+        self.projections: dict[tuple[str, ...], list[tuple[str, ...]]] = {}
+        # 最近一次解析的样本数
+        self.last_count = 0
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def stale(self) -> bool:
+        """
+        是否积累了太多已经消失的条目，此时采集器应该换一个新表
+        """
+        return len(self.names) > max(self.MIN_SIZE, self.STALE_FACTOR * self.last_count)
+
+    def intern(self, series: str) -> int:
+        """
+        series: 样本行中数值之前的部分，例如 windows_cpu_time_total{core="0,0"}
+        返回：样本的 id
+        """
+        series_id = self.ids.get(series)
+        if series_id is not None:
+            return series_id
+        brace = series.find("{")
+        if brace == -1:
+            name, labels = series, {}
+        else:
+            name = series[:brace].strip()
+            labels = parse_labels(series[brace + 1 : series.rfind("}")])
+            if not name:
+                name = labels.pop("__name__", "")
+        if not name:
+            raise ValueError(f"Missing metric name: {series!r}")
+        return self.add(series, name, labels)
+
+    def add(self, key: Union[str, bytes], name: str, labels: dict[str, str]) -> int:
+        """
+        登记一个新的样本，返回它的 id
+        :param key: 样本在 ids 中的键
+        :param name: 样本名
+        :param labels: 样本的 labels，之后由驻留表共享
+        """
+        if self.const_labels:
+            labels.update(self.const_labels)
+        series_id = self.ids[key] = len(self.names)
+        self.names.append(name)
+        self.labels.append(labels)
+        return series_id
+
+    def projection(self, label_names: tuple[str, ...]) -> list[tuple[str, ...]]:
+        """
+        按 id 排列的 label 值元组（缺少的 label 为 None），随驻留表增长
+        """
+        values = self.projections.setdefault(label_names, [])
+        for labels in self.labels[len(values) :]:
+            values.append(tuple(labels.get(name) for name in label_names))
+        return values
+
+
+class CompactFamily:
+    """
+    紧凑的 MetricFamily：样本保存为驻留表中的 id 和 array('d') 中的数值，
+    解析时不为每个样本创建 Sample 和 labels dict。
+    提供与 prometheus_client.Metric 相同的 name/documentation/type/unit，
+    samples 在第一次访问时才创建（labels dict 来自驻留表，是共享的）。
+    """
+
+    __slots__ = (
+        "name",
+        "documentation",
+        "type",
+        "unit",
+        "table",
+        "ids",
+        "values",
+        "timestamps",
+        "name_suffix",
+        "_samples",
+    )
+
+    def __init__(self, name: str, documentation: str, typ: str, table: LabelSetTable):
+        self.name = name
+        self.documentation = documentation
+        self.type = typ
+        self.unit = ""
+        self.table = table
+        self.ids = array("l")
+        self.values = array("d")
+        # 文本中带时间戳的样本（秒），没有时间戳时为 NaN；所有样本都没有时为 None
+        self.timestamps: Optional[array] = None
+        # 样本名需要追加的后缀（counter 的 family 名不以 _total 结尾时）
+        self.name_suffix = ""
+        self._samples: Optional[list[Sample]] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, series_id: int, value: float, timestamp: Optional[float] = None):
+        self.ids.append(series_id)
+        self.values.append(value)
+        if timestamp is not None and self.timestamps is None:
+            self.timestamps = array("d", [math.nan]) * (len(self.ids) - 1)
+        if self.timestamps is not None:
+            self.timestamps.append(math.nan if timestamp is None else timestamp)
+
+    def label_values(self, *label_names: str) -> list[tuple[str, ...]]:
+        """
+        每个样本的指定 label 的值（缺少的 label 为 None），元组在多次采集之间共享
+        """
+        projection = self.table.projection(label_names)
+        return [projection[series_id] for series_id in self.ids]
+
+    @property
+    def samples(self) -> list[Sample]:
+        if self._samples is None:
+            names = self.table.names
+            labels = self.table.labels
+            timestamps = self.timestamps or (None,) * len(self.ids)
+            self._samples = [
+                Sample(
+                    names[series_id] + self.name_suffix,
+                    labels[series_id],
+                    value,
+                    None if timestamp is None or math.isnan(timestamp) else timestamp,
+                )
+                for series_id, value, timestamp in zip(
+                    self.ids, self.values, timestamps
+                )
+            ]
+        return self._samples
+
+
+class FamilyGroup:
+    """
+    多个目标的同名 CompactFamily，每个 family 使用各自目标的驻留表。
+    提供与 prometheus_client.Metric 相同的 name/documentation/type/unit，
+    samples 在第一次访问时才按目标顺序拼接。
+    """
+
+    __slots__ = ("name", "documentation", "type", "unit", "families", "_samples")
+
+    def __init__(self, families: Sequence[CompactFamily]):
+        first = families[0]
+        self.name = first.name
+        self.documentation = first.documentation
+        self.type = first.type
+        self.unit = first.unit
+        self.families = families
+        self._samples: Optional[list[Sample]] = None
+
+    def __len__(self) -> int:
+        return sum(len(family) for family in self.families)
+
+    def label_values(self, *label_names: str) -> list[tuple[str, ...]]:
+        """
+        每个样本的指定 label 的值（缺少的 label 为 None），按目标顺序排列
+        """
+        return [
+            values
+            for family in self.families
+            for values in family.label_values(*label_names)
+        ]
+
+    @property
+    def values(self) -> array:
+        values = array("d")
+        for family in self.families:
+            values += family.values
+        return values
+
+    @property
+    def samples(self) -> list[Sample]:
+        if self._samples is None:
+            self._samples = [s for family in self.families for s in family.samples]
+        return self._samples
+
+
+def label_values(metric, *label_names: str) -> list[tuple[str, ...]]:
+    """
+    每个样本的指定 label 的值（缺少的 label 为 None）。
+    CompactFamily 和 FamilyGroup 直接从驻留表读取，普通的 Metric 逐个样本读取。
+    """
+    if isinstance(metric, (CompactFamily, FamilyGroup)):
+        return metric.label_values(*label_names)
+    return [tuple(s.labels.get(name) for name in label_names) for s in metric.samples]
+
+
+def sample_values(metric) -> Sequence[float]:
+    """
+    每个样本的值，CompactFamily 和 FamilyGroup 直接返回 array('d')
+    """
+    if isinstance(metric, (CompactFamily, FamilyGroup)):
+        return metric.values
+    return [float(s.value) for s in metric.samples]
+
+
+def _parse_value(text: str) -> tuple[float, Optional[float]]:
+    try:
+        return float(text), None
+    except ValueError:
+        parts = text.split()
+        if len(parts) != 2:
+            raise ValueError(f"Invalid sample value: {text!r}") from None
+        # 文本格式中的时间戳单位为毫秒
+        return float(parts[0]), float(parts[1]) / 1000
+
+
+def finish_family(family: CompactFamily) -> CompactFamily:
+    """
+    按 prometheus_client 的规则整理解析完的 family：untyped 记为 unknown，
+    counter 按 OpenMetrics 的方式命名（family 名不带 _total，样本名带 _total）
+    """
+    if family.type == "untyped":
+        family.type = "unknown"
+    if family.type == "counter":
+        if family.name.endswith("_total"):
+            family.name = family.name[:-6]
+        else:
+            family.name_suffix = "_total"
+    return family
+
+
+def parse_compact(text: str, table: LabelSetTable) -> Iterator[CompactFamily]:
+    """
+    把 Prometheus 文本格式解析为 CompactFamily，family 的划分（HELP/TYPE 行、
+    样本名后缀、counter 名去掉 _total）与 prometheus_client 的文本解析器一致。
+    :param text: Prometheus 文本格式的内容
+    :param table: 采集器的驻留表，在多次采集之间复用
+    """
+    family: Optional[CompactFamily] = None
+    allowed: tuple[str, ...] = ()
+    count = 0
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] == "#":
+            parts = line.split(None, 3)
+            if len(parts) < 3 or parts[1] not in ("HELP", "TYPE"):
+                continue
+            name = parts[2]
+            if family is None or name != family.name:
+                if family is not None:
+                    yield finish_family(family)
+                family = CompactFamily(name, "", "untyped", table)
+                allowed = (name,)
+            if parts[1] == "HELP":
+                if len(parts) == 4:
+                    family.documentation = _HELP_ESCAPE_PATTERN.sub(
+                        lambda m: _HELP_ESCAPES[m.group(0)], parts[3]
+                    )
+                else:
+                    family.documentation = ""
+            else:
+                if len(parts) < 4:
+                    raise ValueError(f"Invalid TYPE line: {line!r}")
+                family.type = parts[3]
+                allowed = tuple(
+                    name + suffix for suffix in _TYPE_SUFFIXES.get(parts[3], ("",))
+                )
+            continue
+
+        brace = line.find("{")
+        if brace != -1:
+            end = line.rfind("}") + 1
+        else:
+            end = len(line)
+            for sep in (" ", "\t"):
+                pos = line.find(sep)
+                if pos != -1:
+                    end = min(end, pos)
+        series_id = table.intern(line[:end])
+        value, timestamp = _parse_value(line[end:])
+        count += 1
+        sample_name = table.names[series_id]
+        if sample_name in allowed:
+            family.add(series_id, value, timestamp)
+            continue
+        # 不属于当前 family 的样本，单独作为一个 untyped family
+        if family is not None:
+            yield finish_family(family)
+        family = None
+        allowed = ()
+        single = CompactFamily(sample_name, "", "untyped", table)
+        single.add(series_id, value, timestamp)
+        yield finish_family(single)
+
+    if family is not None:
+        yield finish_family(family)
+    table.last_count = count
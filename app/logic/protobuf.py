@@ -0,0 +1,475 @@
+import math
+import struct
+from typing import Collection, Iterator, Optional
+
+from prometheus_client.utils import floatToGoString
+
+from .parse import CompactFamily, LabelSetTable, expand_family_names, finish_family
+
+# delimited 的 MetricFamily protobuf 的媒体类型
+PROTOBUF_MEDIA_TYPE = "application/vnd.google.protobuf"
+PROTOBUF_CONTENT_TYPE = (
+    "application/vnd.google.protobuf; "
+    "proto=io.prometheus.client.MetricFamily; encoding=delimited"
+)
+# 拉取时的 Accept 头：优先 protobuf，exporter 不支持时会返回文本格式
+SCRAPE_ACCEPT = (
+    "application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily;"
+    "encoding=delimited;q=0.7,text/plain;version=0.0.4;q=0.3,*/*;q=0.2"
+)
+
+# MetricFamily.type 枚举，GAUGE_HISTOGRAM 与文本格式一样按 histogram 处理
+_METRIC_TYPES = {
+    0: "counter",
+    1: "gauge",
+    2: "summary",
+    3: "untyped",
+    4: "histogram",
+    5: "histogram",
+}
+_DOUBLE = struct.Struct("<d")
+_INF_BYTES = _DOUBLE.pack(math.inf)
+
+# 字段的 tag（字段号 << 3 | wire type）
+_TAG_VARINT_1 = 0x08
+_TAG_DOUBLE_1 = 0x09
+_TAG_BYTES_1 = 0x0A
+_TAG_DOUBLE_2 = 0x11
+_TAG_BYTES_2 = 0x12
+_TAG_VARINT_3 = 0x18
+_TAG_BYTES_3 = 0x1A
+_TAG_DOUBLE_4 = 0x21
+_TAG_BYTES_4 = 0x22
+_TAG_VARINT_6 = 0x30
+
+# Metric 中保存值的字段：gauge、counter、summary、untyped、histogram
+_VALUE_FIELDS = (2, 3, 4, 5, 7)
+# 只有字段 1（double）的 Gauge、Counter、Untyped 字段的 tag，这样的字段共 11 字节
+_SIMPLE_VALUE_TAGS = (0x12, 0x1A, 0x2A)
+
+
+def is_protobuf(content_type: str) -> bool:
+    """
+    响应是否为 delimited 的 MetricFamily protobuf
+    :param content_type: 响应的 Content-Type
+    """
+    media_type, _, params = content_type.partition(";")
+    if media_type.strip().lower() != PROTOBUF_MEDIA_TYPE:
+        return False
+    options = {}
+    for param in params.split(";"):
+        key, _, value = param.partition("=")
+        options[key.strip().lower()] = value.strip()
+    return (
+        options.get("proto") == "io.prometheus.client.MetricFamily"
+        and options.get("encoding") == "delimited"
+    )
+
+
+def _varint(data: bytes, pos: int) -> tuple[int, int]:
+    """
+    读取一个 varint，返回 (值, 下一个位置)
+    """
+    byte = data[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    result = byte & 0x7F
+    shift = 7
+    while True:
+        pos += 1
+        byte = data[pos]
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos + 1
+        shift += 7
+
+
+def _skip(data: bytes, pos: int, wire_type: int) -> int:
+    """
+    跳过一个不需要的字段的值，返回下一个位置
+    """
+    if wire_type == 0:
+        return _varint(data, pos)[1]
+    if wire_type == 1:
+        return pos + 8
+    if wire_type == 2:
+        size, pos = _varint(data, pos)
+        return pos + size
+    if wire_type == 5:
+        return pos + 4
+    raise ValueError(f"Unsupported protobuf wire type: {wire_type}")
+
+
+def _decode_labels(
+    labels_key: bytes, extra: Optional[tuple[str, str]]
+) -> dict[str, str]:
+    """
+    解析 Metric 的 LabelPair 字段
+    :param labels_key: 所有 LabelPair 字段的原始字节（含 tag 和长度）
+    :param extra: 追加的 label（le 或 quantile）
+    """
+    labels: dict[str, str] = {}
+    pos = 0
+    while pos < len(labels_key):
+        _, pos = _varint(labels_key, pos)
+        size, pos = _varint(labels_key, pos)
+        end = pos + size
+        name = value = ""
+        while pos < end:
+            tag, pos = _varint(labels_key, pos)
+            if tag == _TAG_BYTES_1 or tag == _TAG_BYTES_2:
+                size, pos = _varint(labels_key, pos)
+                text = labels_key[pos : pos + size].decode("utf-8")
+                pos += size
+                if tag == _TAG_BYTES_1:
+                    name = text
+                else:
+                    value = text
+            else:
+                pos = _skip(labels_key, pos, tag & 7)
+        labels[name] = value
+    if extra is not None:
+        labels[extra[0]] = extra[1]
+    return labels
+
+
+class _MetricDecoder:
+    """
+    把一个 MetricFamily 中的 Metric 解析为 CompactFamily 的样本。
+    样本在驻留表中的键为 family 名、样本种类和 LabelPair 的原始字节，
+    已经见过的样本不需要解析 labels。
+    """
+
+    __slots__ = ("data", "table", "family", "name", "prefix", "value_prefix")
+
+    def __init__(
+        self, data: bytes, table: LabelSetTable, family: CompactFamily, raw_name: bytes
+    ):
+        self.data = data
+        self.table = table
+        self.family = family
+        self.name = family.name
+        # 与文本格式的键（str）不会相同
+        self.prefix = raw_name + b"\0"
+        self.value_prefix = self.prefix + b"v"
+
+    def add(
+        self,
+        kind: bytes,
+        suffix: str,
+        labels_key: bytes,
+        value: float,
+        timestamp: Optional[float],
+        extra: Optional[tuple[str, str]] = None,
+    ):
+        """
+        添加一个样本
+        :param kind: 样本种类（v 值、s _sum、c _count、b + le 或 q + quantile 的原始字节）
+        :param suffix: 样本名相对 family 名的后缀
+        :param labels_key: LabelPair 字段的原始字节
+        """
+        key = self.prefix + kind + labels_key
+        table = self.table
+        series_id = table.ids.get(key)
+        if series_id is None:
+            series_id = table.add(
+                key, self.name + suffix, _decode_labels(labels_key, extra)
+            )
+        self.family.add(series_id, value, timestamp)
+
+    def decode_all(self, metrics: list[tuple[int, int]]):
+        """
+        解析 family 中的所有 Metric 消息，metrics 为每个消息的 (开始, 结束)
+        """
+        data = self.data
+        ids = self.table.ids
+        family = self.family
+        add_id = family.ids.append
+        add_value = family.values.append
+        unpack_double = _DOUBLE.unpack_from
+        value_prefix = self.value_prefix
+        for start, end in metrics:
+            # 快速路径：消息为 LabelPair 加一个 11 字节的值字段，且已经见过这些 labels。
+            # 前面的字节与驻留表中的键相同，说明它们恰好是完整的 LabelPair 字段
+            if (
+                end - start >= 11
+                and data[end - 10] == 9
+                and data[end - 9] == _TAG_DOUBLE_1
+                and data[end - 11] in _SIMPLE_VALUE_TAGS
+                and family.timestamps is None
+            ):
+                series_id = ids.get(value_prefix + data[start : end - 11])
+                if series_id is not None:
+                    add_id(series_id)
+                    add_value(unpack_double(data, end - 8)[0])
+                    continue
+
+            labels_start = labels_end = -1
+            # LabelPair 字段不连续时的各个部分
+            parts: Optional[list[bytes]] = None
+            timestamp: Optional[float] = None
+            value_field = value_start = value_end = 0
+            pos = start
+            while pos < end:
+                field_start = pos
+                tag = data[pos]
+                if tag < 0x80:
+                    pos += 1
+                else:
+                    tag, pos = _varint(data, pos)
+                if tag & 7 != 2:
+                    if tag == _TAG_VARINT_6:
+                        millis, pos = _varint(data, pos)
+                        if millis >= 1 << 63:
+                            millis -= 1 << 64
+                        timestamp = millis / 1000
+                    else:
+                        pos = _skip(data, pos, tag & 7)
+                    continue
+                size = data[pos]
+                if size < 0x80:
+                    pos += 1
+                else:
+                    size, pos = _varint(data, pos)
+                field_end = pos + size
+                if tag == _TAG_BYTES_1:
+                    if parts is not None:
+                        parts.append(data[field_start:field_end])
+                    elif labels_start < 0:
+                        labels_start = field_start
+                    elif labels_end != field_start:
+                        parts = [
+                            data[labels_start:labels_end],
+                            data[field_start:field_end],
+                        ]
+                    labels_end = field_end
+                elif tag >> 3 in _VALUE_FIELDS:
+                    value_field, value_start, value_end = tag >> 3, pos, field_end
+                pos = field_end
+            if pos != end:
+                raise ValueError("Truncated protobuf Metric")
+
+            if parts is not None:
+                labels_key = b"".join(parts)
+            elif labels_start >= 0:
+                labels_key = data[labels_start:labels_end]
+            else:
+                labels_key = b""
+
+            if value_field == 4:
+                self._summary(value_start, value_end, labels_key, timestamp)
+                continue
+            if value_field == 7:
+                self._histogram(value_start, value_end, labels_key, timestamp)
+                continue
+            if not value_field:
+                continue
+            # Gauge、Counter、Untyped 的值都是字段 1，通常是消息中唯一的字段
+            if value_end - value_start == 9 and data[value_start] == _TAG_DOUBLE_1:
+                value = unpack_double(data, value_start + 1)[0]
+            else:
+                value = self._double_field(value_start, value_end)
+            series_id = ids.get(value_prefix + labels_key)
+            if (
+                series_id is None
+                or timestamp is not None
+                or family.timestamps is not None
+            ):
+                self.add(b"v", "", labels_key, value, timestamp)
+            else:
+                add_id(series_id)
+                add_value(value)
+
+    def _double_field(self, start: int, end: int) -> float:
+        # Gauge、Counter、Untyped 消息中字段 1 的值
+        data = self.data
+        value = 0.0
+        pos = start
+        while pos < end:
+            tag, pos = _varint(data, pos)
+            if tag == _TAG_DOUBLE_1:
+                value = _DOUBLE.unpack_from(data, pos)[0]
+                pos += 8
+            else:
+                pos = _skip(data, pos, tag & 7)
+        return value
+
+    def _summary(self, start, end, labels_key, timestamp):
+        data = self.data
+        count = total = 0.0
+        pos = start
+        while pos < end:
+            tag, pos = _varint(data, pos)
+            if tag == _TAG_VARINT_1:
+                count, pos = _varint(data, pos)
+            elif tag == _TAG_DOUBLE_2:
+                total = _DOUBLE.unpack_from(data, pos)[0]
+                pos += 8
+            elif tag == _TAG_BYTES_3:
+                size, pos = _varint(data, pos)
+                quantile_end = pos + size
+                quantile_raw = _INF_BYTES
+                value = 0.0
+                while pos < quantile_end:
+                    tag, pos = _varint(data, pos)
+                    if tag == _TAG_DOUBLE_1:
+                        quantile_raw = data[pos : pos + 8]
+                        pos += 8
+                    elif tag == _TAG_DOUBLE_2:
+                        value = _DOUBLE.unpack_from(data, pos)[0]
+                        pos += 8
+                    else:
+                        pos = _skip(data, pos, tag & 7)
+                quantile = floatToGoString(_DOUBLE.unpack(quantile_raw)[0])
+                self.add(
+                    b"q" + quantile_raw,
+                    "",
+                    labels_key,
+                    value,
+                    timestamp,
+                    ("quantile", quantile),
+                )
+            else:
+                pos = _skip(data, pos, tag & 7)
+        self.add(b"s", "_sum", labels_key, total, timestamp)
+        self.add(b"c", "_count", labels_key, float(count), timestamp)
+
+    def _histogram(self, start, end, labels_key, timestamp):
+        data = self.data
+        count = total = 0.0
+        has_inf = False
+        pos = start
+        while pos < end:
+            tag, pos = _varint(data, pos)
+            if tag == _TAG_VARINT_1:
+                count, pos = _varint(data, pos)
+            elif tag == _TAG_DOUBLE_4:
+                count = _DOUBLE.unpack_from(data, pos)[0]
+                pos += 8
+            elif tag == _TAG_DOUBLE_2:
+                total = _DOUBLE.unpack_from(data, pos)[0]
+                pos += 8
+            elif tag == _TAG_BYTES_3:
+                size, pos = _varint(data, pos)
+                bucket_end = pos + size
+                bound_raw = _INF_BYTES
+                value = 0.0
+                while pos < bucket_end:
+                    tag, pos = _varint(data, pos)
+                    if tag == _TAG_VARINT_1:
+                        value, pos = _varint(data, pos)
+                    elif tag == _TAG_DOUBLE_4:
+                        value = _DOUBLE.unpack_from(data, pos)[0]
+                        pos += 8
+                    elif tag == _TAG_DOUBLE_2:
+                        bound_raw = data[pos : pos + 8]
+                        pos += 8
+                    else:
+                        pos = _skip(data, pos, tag & 7)
+                bound = _DOUBLE.unpack(bound_raw)[0]
+                has_inf = has_inf or bound == math.inf
+                self.add(
+                    b"b" + bound_raw,
+                    "_bucket",
+                    labels_key,
+                    float(value),
+                    timestamp,
+                    ("le", floatToGoString(bound)),
+                )
+            else:
+                pos = _skip(data, pos, tag & 7)
+        # 与文本格式一样，没有 +Inf 桶时补上（值为总数）
+        if not has_inf:
+            self.add(
+                b"b" + _INF_BYTES,
+                "_bucket",
+                labels_key,
+                float(count),
+                timestamp,
+                ("le", "+Inf"),
+            )
+        self.add(b"s", "_sum", labels_key, total, timestamp)
+        self.add(b"c", "_count", labels_key, float(count), timestamp)
+
+
+def _decode_family(
+    data: bytes,
+    start: int,
+    end: int,
+    table: LabelSetTable,
+    allowed: Optional[set[str]],
+) -> Optional[CompactFamily]:
+    """
+    解析一个 MetricFamily 消息，不在 allowed 中的 family 不解析其中的 Metric
+    """
+    raw_name = raw_help = b""
+    metric_type = 0
+    metrics: list[tuple[int, int]] = []
+    pos = start
+    while pos < end:
+        tag, pos = _varint(data, pos)
+        if tag == _TAG_VARINT_3:
+            metric_type, pos = _varint(data, pos)
+            continue
+        if tag & 7 != 2:
+            pos = _skip(data, pos, tag & 7)
+            continue
+        size = data[pos]
+        if size < 0x80:
+            pos += 1
+        else:
+            size, pos = _varint(data, pos)
+        field_end = pos + size
+        if tag == _TAG_BYTES_4:
+            metrics.append((pos, field_end))
+        elif tag == _TAG_BYTES_1:
+            raw_name = data[pos:field_end]
+        elif tag == _TAG_BYTES_2:
+            raw_help = data[pos:field_end]
+        pos = field_end
+    if pos != end:
+        raise ValueError("Truncated protobuf MetricFamily")
+
+    name = raw_name.decode("utf-8")
+    if not name:
+        raise ValueError("Missing metric name in protobuf MetricFamily")
+    if allowed is not None and name not in allowed:
+        return None
+    family = CompactFamily(
+        name,
+        raw_help.decode("utf-8"),
+        _METRIC_TYPES.get(metric_type, "untyped"),
+        table,
+    )
+    _MetricDecoder(data, table, family, raw_name).decode_all(metrics)
+    return family
+
+
+def parse_delimited(
+    data: bytes, table: LabelSetTable, families: Optional[Collection[str]] = None
+) -> Iterator[CompactFamily]:
+    """
+    把 delimited 的 MetricFamily protobuf（每个消息前是 varint 长度）解析为
+    CompactFamily，结果与用 parse_compact 解析同样数据的文本格式一致。
+    :param data: 响应体
+    :param table: 采集器的驻留表，在多次采集之间复用
+    :param families: 只解析这些 family（与 Metric.name 一致），None 表示解析全部
+    :raises ValueError: 数据不完整或格式错误
+    """
+    allowed = expand_family_names(families) if families is not None else None
+    count = 0
+    pos = 0
+    try:
+        while pos < len(data):
+            size, pos = _varint(data, pos)
+            end = pos + size
+            if end > len(data):
+                raise ValueError("Truncated protobuf MetricFamily")
+            family = _decode_family(data, pos, end, table, allowed)
+            pos = end
+            if family is not None:
+                count += len(family)
+                yield finish_family(family)
+    except (IndexError, struct.error) as e:
+        raise ValueError(f"Truncated protobuf message: {e}") from None
+    table.last_count = count
@@ -0,0 +1,227 @@
+import logging
+import socket
+import threading
+import time
+import zlib
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class ScrapeStats(NamedTuple):
+    """
+    单次拉取的统计信息
+    """
+
+    wire_bytes: int  # 网络上传输的响应体字节数（压缩后）
+    body_bytes: int  # 解压后的响应体字节数
+    connect_time: float  # 建立连接耗时（秒），复用连接时为 0
+    ttfb: float  # 从发出请求到收到响应头的耗时（秒）
+    total_time: float  # 整个请求的耗时（秒）
+    content_encoding: str  # 响应的 Content-Encoding
+
+
+class DnsCache:
+    """
+    简单的 DNS 缓存，在 ttl 内复用解析结果，连接失败时由调用方使之失效。
+    """
+
+    def __init__(self, ttl: float = 300.0):
+        """
+        ttl: 解析结果的缓存时间（秒）
+        """
+        self.ttl = ttl
+        self._entries: dict[tuple[str, int], tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int) -> str:
+        """
+        解析主机名，返回 IP 地址字符串
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((host, port))
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        address = infos[0][4][0]
+        with self._lock:
+            self._entries[(host, port)] = (address, now + self.ttl)
+        return address
+
+    def invalidate(self, host: Optional[str] = None):
+        """
+        使缓存失效
+        host: 只清除该主机的缓存，None 表示全部清除
+        """
+        with self._lock:
+            if host is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == host]:
+                del self._entries[key]
+
+
+DNS_CACHE = DnsCache()
+
+
+class _TimedConnectionMixin:
+    """
+    记录建立连接的耗时，并通过 DNS_CACHE 解析主机名。
+    urllib3 用私有属性 _dns_host 中的主机名建立连接，这里在连接前临时换成缓存的地址；
+    没有这个属性的 urllib3 版本不使用 DNS 缓存。
+    """
+
+    connect_time = 0.0
+
+    def _new_conn(self) -> socket.socket:
+        host = getattr(self, "_dns_host", None)
+        if not isinstance(host, str):
+            return super()._new_conn()
+        try:
+            self._dns_host = DNS_CACHE.resolve(host, self.port)
+        except OSError:
+            # 解析失败时交给 urllib3 自己解析并报告错误
+            pass
+        try:
+            return super()._new_conn()
+        except Exception:
+            DNS_CACHE.invalidate(host)
+            raise
+        finally:
+            self._dns_host = host
+
+    def connect(self) -> None:
+        start = time.perf_counter()
+        super().connect()
+        self.connect_time = time.perf_counter() - start
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class ScrapeSession:
+    """
+    长连接的 HTTP 会话：连接池 + keep-alive + gzip + DNS 缓存，
+    请求失败时丢弃所有连接，下次请求重新建立连接。
+    """
+
+    def __init__(self, timeout: float = 0.5, pool_size: int = 2):
+        """
+        timeout: 请求超时时间（秒）
+        pool_size: 每个主机保留的连接数
+        """
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.last_stats: Optional[ScrapeStats] = None
+        self._session = self._create_session()
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = _TimedHTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size, max_retries=0
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Accept-Encoding"] = "gzip"
+        return session
+
+    def reset(self, url: Optional[str] = None):
+        """
+        关闭所有连接并清除 DNS 缓存，下次请求时重新连接
+        """
+        self._session.close()
+        self._session = self._create_session()
+        DNS_CACHE.invalidate(urlsplit(url).hostname if url else None)
+
+    def close(self):
+        self._session.close()
+
+    def get(
+        self,
+        url: str,
+        headers: Optional[dict[str, str]] = None,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> tuple[requests.Response, bytes]:
+        """
+        发送 GET 请求，返回响应和解压后的响应体，并更新 last_stats
+        timeout: 这次请求的超时（秒），None 表示使用会话的 timeout
+        :raises requests.RequestException: 请求失败（此时会话已被重置）
+        """
+        start = time.perf_counter()
+        resp = None
+        try:
+            resp = self._session.get(
+                url,
+                headers=headers,
+                timeout=self.timeout if timeout is None else timeout,
+                stream=True,
+                **kwargs,
+            )
+            ttfb = time.perf_counter() - start
+            connection = resp.raw.connection
+            connect_time = getattr(connection, "connect_time", 0.0)
+            if connection is not None:
+                connection.connect_time = 0.0
+            resp.raise_for_status()
+            raw = resp.raw.read(decode_content=False)
+            encoding = resp.headers.get("Content-Encoding", "").lower()
+            if encoding == "gzip":
+                body = zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+            elif encoding == "deflate":
+                body = zlib.decompress(raw)
+            else:
+                body = raw
+        except (
+            requests.RequestException,
+            urllib3.exceptions.HTTPError,
+            OSError,
+            zlib.error,
+        ) as e:
+            if resp is not None:
+                resp.close()
+            self.reset(url)
+            if isinstance(e, requests.RequestException):
+                raise
+            raise requests.ConnectionError(e) from e
+        # 响应体已读完，把连接还给连接池以便复用
+        resp.raw.release_conn()
+
+        self.last_stats = ScrapeStats(
+            wire_bytes=len(raw),
+            body_bytes=len(body),
+            connect_time=connect_time,
+            ttfb=ttfb,
+            total_time=time.perf_counter() - start,
+            content_encoding=encoding,
+        )
+        logging.debug(f"Scraped {url}: {self.last_stats}")
+        return resp, body
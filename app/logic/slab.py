@@ -0,0 +1,384 @@
+import errno
+import json
+import logging
+import math
+import mmap
+import os
+import time
+from array import array
+from multiprocessing import shared_memory
+from typing import Callable, Iterable, Optional, TypeVar
+
+from .history import RollupRing, RollupTier, SeriesRing, SeriesStore
+
+T = TypeVar("T")
+
+SLAB_MAGIC = 0x4D44534C41420002  # "MDSLAB" + 版本号
+HEADER_SIZE = 128
+DIRECTORY_ENTRY_SIZE = 256
+# 状态区每个槽的字节数，状态区有两个槽，交替写入
+STATE_SLOT_SIZE = 256 * 1024
+
+# header 中各个 int64 字段的下标
+_H_MAGIC = 0
+_H_CAPACITY = 1
+_H_MAX_SERIES = 2
+_H_SEQ = 3  # seqlock 序号，写入过程中为奇数
+_H_SERIES_COUNT = 4
+# header 中 float64 字段的下标（与 int64 字段共用同一块内存）
+_H_LAST_TIME = 5
+_H_SERIES_SIZE = 6  # 每条序列数据区的字节数，用于校验聚合层级的布局
+_H_STATE_SLOT = 7  # 状态区中最新写完的槽（0 或 1），-1 表示没有状态
+
+
+def series_size(capacity: int, tiers: Iterable[RollupTier] = ()) -> int:
+    """
+    计算一条序列在数据区中占用的字节数（原始数据 + 各聚合层级）
+    :param capacity: 每条序列保留的最大点数
+    :param tiers: 聚合层级
+    """
+    return 32 * capacity + sum(8 * RollupRing.FIELDS * t.capacity for t in tiers)
+
+
+def slab_size(capacity: int, max_series: int, tiers: Iterable[RollupTier] = ()) -> int:
+    """
+    计算指定容量的 slab 需要的字节数
+    :param capacity: 每条序列保留的最大点数
+    :param max_series: 最多能保存的序列数
+    :param tiers: 聚合层级
+    """
+    tiers = tuple(tiers)
+    counts_size = 8 * (1 + len(tiers))
+    return (
+        HEADER_SIZE
+        + max_series
+        * (DIRECTORY_ENTRY_SIZE + counts_size + series_size(capacity, tiers))
+        + 2 * STATE_SLOT_SIZE
+    )
+
+
+def reserve_space(fd: int, size: int):
+    """
+    预先分配文件（共享内存或历史文件）的全部空间。tmpfs 和磁盘上的文件都是按需分配页面的，
+    空间不足时进程要到之后写入某一页时才会收到 SIGBUS，预先分配可以在启动时就报错
+    :param fd: 文件描述符
+    :param size: 字节数
+    :raises OSError: 空间不足
+    """
+    if not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as e:
+        if e.errno in (errno.EINVAL, errno.EOPNOTSUPP):
+            # 文件系统不支持预先分配
+            return
+        raise OSError(
+            e.errno,
+            f"Cannot reserve {size / 2**20:.1f} MiB for the history ({e.strerror}), "
+            "lower history_max_series, history_length or history_tiers",
+        ) from e
+
+
+def reserve_shared_memory(shm: shared_memory.SharedMemory):
+    """
+    预先分配共享内存的全部空间（Linux 上 POSIX 共享内存是 /dev/shm 中的文件）
+    :raises OSError: 空间不足
+    """
+    path = os.path.join("/dev/shm", shm.name.lstrip("/"))
+    if not os.path.exists(path):
+        return
+    fd = os.open(path, os.O_RDWR)
+    try:
+        reserve_space(fd, shm.size)
+    finally:
+        os.close(fd)
+
+
+class SlabSeriesStore(SeriesStore):
+    """
+    所有序列都保存在一块固定布局的缓冲区（slab）中的 SeriesStore，
+    缓冲区可以是共享内存，也可以是内存映射文件。
+
+    布局：
+        header（128 字节）：magic、capacity、max_series、seq、series_count、last_time
+        directory（max_series * 256 字节）：每条序列的 name/labels 等元数据（JSON）
+        counts（max_series * 8 * (1 + 层级数) 字节）：每条序列累计写入的点数和各层级的桶数
+        data（max_series * series_size 字节）：每条序列的镜像时间戳和值，以及各层级的桶
+        state（2 * STATE_SLOT_SIZE 字节）：save_state 保存的状态（长度 + JSON），两个槽交替写入
+
+    写入方在每次 append 前后递增 seq（seqlock），读取方通过 read() 获得一致的数据。
+    """
+
+    def __init__(
+        self,
+        buffer: memoryview,
+        capacity: int,
+        max_series: int,
+        create: bool = False,
+        tiers: Iterable[RollupTier] = (),
+    ):
+        """
+        buffer: 至少 slab_size(capacity, max_series, tiers) 字节的可写缓冲区
+        capacity: 每条序列保留的最大点数
+        max_series: 最多能保存的序列数
+        create: True 表示初始化一个新的 slab，False 表示打开已有的 slab
+        tiers: 聚合层级
+        """
+        tiers = tuple(sorted(tiers))
+        self.buffer = buffer
+        self.max_series = max_series
+        self._series_size = series_size(capacity, tiers)
+        self._counts_stride = 1 + len(tiers)
+        self._header_q = buffer[:HEADER_SIZE].cast("q")
+        self._header_d = buffer[:HEADER_SIZE].cast("d")
+        directory_offset = HEADER_SIZE
+        counts_offset = directory_offset + max_series * DIRECTORY_ENTRY_SIZE
+        data_offset = counts_offset + max_series * 8 * self._counts_stride
+        self._directory = buffer[directory_offset:counts_offset]
+        self._counts = buffer[counts_offset:data_offset].cast("q")
+        state_offset = data_offset + max_series * self._series_size
+        self._data = buffer[data_offset:state_offset].cast("d")
+        self._state_region = buffer[state_offset : state_offset + 2 * STATE_SLOT_SIZE]
+        self._state_warned = False
+        # 已经加载到 self.series 中的序列数
+        self._loaded = 0
+        self._full_warned = False
+
+        if create:
+            # 只需清零 header 和 counts，未被计数覆盖的数据区不会被读取
+            self._header_q[_H_MAGIC] = 0
+            buffer[:HEADER_SIZE] = bytes(HEADER_SIZE)
+            self._counts[:] = array("q", bytes(8 * len(self._counts)))
+            self._header_q[_H_CAPACITY] = capacity
+            self._header_q[_H_MAX_SERIES] = max_series
+            self._header_q[_H_SERIES_SIZE] = self._series_size
+            self._header_q[_H_STATE_SLOT] = -1
+            self._header_d[_H_LAST_TIME] = math.nan
+            self._header_q[_H_MAGIC] = SLAB_MAGIC
+        elif not self.is_valid(capacity, max_series):
+            raise ValueError("Slab layout does not match")
+
+        super().__init__(capacity, tiers)
+        self.sync()
+
+    def is_valid(self, capacity: int, max_series: int) -> bool:
+        """
+        检查缓冲区中的 slab 布局是否与参数一致
+        """
+        return (
+            self._header_q[_H_MAGIC] == SLAB_MAGIC
+            and self._header_q[_H_CAPACITY] == capacity
+            and self._header_q[_H_MAX_SERIES] == max_series
+            and self._header_q[_H_SERIES_SIZE] == self._series_size
+        )
+
+    @property
+    def last_time(self) -> Optional[float]:
+        value = self._header_d[_H_LAST_TIME]
+        return None if math.isnan(value) else value
+
+    @last_time.setter
+    def last_time(self, value: Optional[float]):
+        # 基类 __init__ 会把 last_time 设为 None，这里不能覆盖已有的 slab
+        if value is not None:
+            self._header_d[_H_LAST_TIME] = value
+
+    @property
+    def persistent(self) -> bool:
+        """
+        缓冲区是内存映射文件时，数据在重启后仍然存在
+        """
+        return isinstance(self.buffer.obj, mmap.mmap)
+
+    def flush(self):
+        if isinstance(self.buffer.obj, mmap.mmap):
+            self.buffer.obj.flush()
+
+    def save_state(self, state: dict):
+        """
+        把状态写入当前未使用的槽，写完后再切换到该槽，
+        因此写入中途断电时仍然可以读到上一次的状态
+        """
+        data = json.dumps(state, separators=(",", ":")).encode("utf-8")
+        if len(data) > STATE_SLOT_SIZE - 8:
+            if not self._state_warned:
+                logging.warning(f"State is too large to save ({len(data)} bytes)")
+                self._state_warned = True
+            return
+        slot = 1 - max(self._header_q[_H_STATE_SLOT], 0)
+        offset = slot * STATE_SLOT_SIZE
+        self._state_region[offset : offset + 8] = len(data).to_bytes(8, "little")
+        self._state_region[offset + 8 : offset + 8 + len(data)] = data
+        self._header_q[_H_STATE_SLOT] = slot
+
+    def load_state(self) -> Optional[dict]:
+        active = self._header_q[_H_STATE_SLOT]
+        if active not in (0, 1):
+            return None
+        # 先读最新的槽，损坏时（例如断电时没有全部写回）再读另一个槽
+        for slot in (active, 1 - active):
+            offset = slot * STATE_SLOT_SIZE
+            length = int.from_bytes(self._state_region[offset : offset + 8], "little")
+            if not 0 < length <= STATE_SLOT_SIZE - 8:
+                continue
+            try:
+                return json.loads(
+                    bytes(self._state_region[offset + 8 : offset + 8 + length])
+                )
+            except ValueError:
+                continue
+        return None
+
+    @property
+    def seq(self) -> int:
+        """
+        seqlock 序号，每写入一次增加 2
+        """
+        return self._header_q[_H_SEQ]
+
+    def _rings(self, slot: int) -> tuple[SeriesRing, tuple[RollupRing, ...]]:
+        size = 2 * self.capacity
+        offset = slot * (self._series_size // 8)
+        counts = slot * self._counts_stride
+        ring = SeriesRing(
+            self.capacity,
+            self._data[offset : offset + size],
+            self._data[offset + size : offset + 2 * size],
+            self._counts[counts : counts + 1],
+        )
+        offset += 2 * size
+        rollups = []
+        for i, tier in enumerate(self.tiers, 1):
+            tier_size = RollupRing.FIELDS * tier.capacity
+            rollups.append(
+                RollupRing(
+                    tier,
+                    self._data[offset : offset + tier_size],
+                    self._counts[counts + i : counts + i + 1],
+                )
+            )
+            offset += tier_size
+        return ring, tuple(rollups)
+
+    def _create_series(
+        self, name: str, labels: dict[str, str]
+    ) -> Optional[tuple[SeriesRing, tuple[RollupRing, ...]]]:
+        slot = self._header_q[_H_SERIES_COUNT]
+        if slot >= self.max_series:
+            if not self._full_warned:
+                logging.warning(f"Series slab is full, dropping series {name}{labels}")
+                self._full_warned = True
+            return None
+        documentation, typ, unit = self.families[name]
+        entry = json.dumps(
+            [name, labels, documentation, typ, unit], ensure_ascii=False
+        ).encode("utf-8")
+        if len(entry) > DIRECTORY_ENTRY_SIZE - 4:
+            # 元数据太长时丢弃 documentation
+            entry = json.dumps([name, labels, "", typ, unit]).encode("utf-8")
+            if len(entry) > DIRECTORY_ENTRY_SIZE - 4:
+                logging.warning(f"Series metadata too long, dropping {name}{labels}")
+                return None
+        offset = slot * DIRECTORY_ENTRY_SIZE
+        self._directory[offset : offset + 4] = len(entry).to_bytes(4, "little")
+        self._directory[offset + 4 : offset + 4 + len(entry)] = entry
+        counts = slot * self._counts_stride
+        self._counts[counts : counts + self._counts_stride] = array(
+            "q", bytes(8 * self._counts_stride)
+        )
+        # 元数据写完后再发布新序列
+        self._header_q[_H_SERIES_COUNT] = slot + 1
+        self._loaded = slot + 1
+        return self._rings(slot)
+
+    def sync(self):
+        """
+        加载其他进程新建的序列（读取方使用）
+        """
+        count = self._header_q[_H_SERIES_COUNT]
+        for slot in range(self._loaded, count):
+            offset = slot * DIRECTORY_ENTRY_SIZE
+            length = int.from_bytes(self._directory[offset : offset + 4], "little")
+            name, labels, documentation, typ, unit = json.loads(
+                bytes(self._directory[offset + 4 : offset + 4 + length])
+            )
+            self.families.setdefault(name, (documentation, typ, unit))
+            self._add_series(name, labels, *self._rings(slot))
+        self._loaded = max(self._loaded, count)
+
+    def recover(self):
+        """
+        上次写入时进程退出或断电，seq 会停在奇数，读取方会一直等待。
+        最后一次写入可能不完整，但之前的数据仍然可用，只需结束这次写入。
+        只能在没有其他写入方时调用。
+        """
+        if self.seq % 2:
+            self._header_q[_H_SEQ] += 1
+
+    def _begin_write(self):
+        self._header_q[_H_SEQ] += 1
+
+    def _end_write(self):
+        self._header_q[_H_SEQ] += 1
+
+    def read(self, fn: Callable[[], T], retry_interval: float = 0.001) -> T:
+        """
+        在 seqlock 保护下执行 fn 并返回其结果。
+        如果 fn 执行期间写入方写入了新数据，会重新执行 fn，
+        因此 fn 必须拷贝需要的数据，不能返回指向 slab 的视图。
+        """
+        while True:
+            seq = self._header_q[_H_SEQ]
+            if seq % 2:
+                time.sleep(retry_interval)
+                continue
+            self.sync()
+            result = fn()
+            if self._header_q[_H_SEQ] == seq:
+                return result
+
+
+def open_slab_file(
+    path: str,
+    capacity: int,
+    max_series: int,
+    tiers: Iterable[RollupTier] = (),
+) -> SlabSeriesStore:
+    """
+    打开（不存在或布局不一致时新建）内存映射文件中的 SlabSeriesStore。
+    打开已有的文件不需要解析数据，重启后可以立即读到之前的历史数据。
+    文件的空间预先分配，磁盘空间不足时抛出 OSError。
+    :param path: 文件路径
+    :param capacity: 每条序列保留的最大点数
+    :param max_series: 最多能保存的序列数
+    :param tiers: 聚合层级
+    """
+    tiers = tuple(tiers)
+    size = slab_size(capacity, max_series, tiers)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a+b") as f:
+        # 新文件或者配置改变了大小，都需要重新初始化
+        create = os.fstat(f.fileno()).st_size != size
+        if create:
+            f.truncate(size)
+        try:
+            reserve_space(f.fileno(), size)
+        except OSError:
+            if create:
+                # 不留下空间不足的文件，下次启动时重新分配
+                f.truncate(0)
+            raise
+        mapping = mmap.mmap(f.fileno(), size)
+    buffer = memoryview(mapping)
+    if not create:
+        try:
+            store = SlabSeriesStore(buffer, capacity, max_series, tiers=tiers)
+            store.recover()
+            return store
+        except (ValueError, UnicodeDecodeError):
+            # 布局不一致或目录损坏（例如断电时没有全部写回），重新初始化
+            logging.warning(f"History file {path} is invalid, recreating it")
+    return SlabSeriesStore(buffer, capacity, max_series, create=True, tiers=tiers)
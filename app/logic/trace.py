@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Optional
+
+# 最多保留的 span 数，超出时丢弃最早的（长时间运行时只保留最近的一段）。
+# 每个 span 约占 300 多字节（带 args 时），这个上限下约 20 MB，默认配置下能保留十几分钟
+MAX_EVENTS = 50_000
+
+# 未开启记录时 span 返回的空上下文，所有调用共用一个实例
+_NULL_SPAN = nullcontext()
+
+
+class Tracer:
+    """
+    记录带时间戳的 span，写出为 Chrome / Perfetto 的 trace 文件（JSON 格式）。
+    时间戳直接使用 perf_counter（单调时钟，同一台机器上的各进程共用），
+    所以子进程写出的 trace 可以合并到同一条时间线上。
+    """
+
+    def __init__(self, path: str, process_name: str, max_events: int = MAX_EVENTS):
+        """
+        path: trace 文件的路径
+        process_name: 在 trace 中显示的进程名
+        max_events: 最多保留的 span 数
+        """
+        self.path = path
+        self.process_name = process_name
+        self.pid = os.getpid()
+        # (name, 开始纳秒, 结束纳秒, 线程 id, args)；deque.append 是线程安全的
+        self.events: deque[tuple[str, int, int, int, Optional[dict]]] = deque(
+            maxlen=max_events
+        )
+        # 线程 id -> 线程名
+        self.threads: dict[int, str] = {}
+        # 写出时合并进来的其他 trace 文件（子进程的 trace）
+        self.includes: list[str] = []
+
+    def add(self, name: str, start_ns: int, end_ns: int, args: Optional[dict]):
+        """
+        记录一个已经结束的 span（在执行它的线程中调用）
+        """
+        tid = threading.get_native_id()
+        if tid not in self.threads:
+            self.threads[tid] = threading.current_thread().name
+        self.events.append((name, start_ns, end_ns, tid, args))
+
+    def include(self, path: str):
+        """
+        写出时合并另一个进程写出的 trace 文件，文件不存在时忽略
+        """
+        self.includes.append(path)
+
+    def trace_events(self) -> list[dict]:
+        """
+        转换为 Chrome trace 的事件列表（时间单位为微秒）
+        """
+        events: list[dict] = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": self.pid,
+                "args": {"name": self.process_name},
+            }
+        ]
+        for tid, thread_name in list(self.threads.items()):
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": self.pid,
+                    "tid": tid,
+                    "args": {"name": thread_name},
+                }
+            )
+        for name, start_ns, end_ns, tid, args in list(self.events):
+            event = {
+                "name": name,
+                "cat": "dashboard",
+                "ph": "X",
+                "ts": start_ns / 1000,
+                "dur": (end_ns - start_ns) / 1000,
+                "pid": self.pid,
+                "tid": tid,
+            }
+            if args:
+                event["args"] = {k: str(v) for k, v in args.items()}
+            events.append(event)
+        return events
+
+    def write(self):
+        """
+        写出 trace 文件
+        """
+        events = self.trace_events()
+        for path in self.includes:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    events += json.load(f)["traceEvents"]
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"Failed to merge trace {path}: {e}")
+                continue
+            os.remove(path)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start_ns")
+
+    def __init__(self, tracer: Tracer, name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start_ns = 0
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *_exc):
+        self.tracer.add(self.name, self.start_ns, time.perf_counter_ns(), self.args)
+        return False
+
+
+_tracer: Optional[Tracer] = None
+
+
+def span(name: str, **args):
+    """
+    记录一个 span：with span("collect"): ...
+    未开启记录时返回共用的空上下文，开销只有一次函数调用。
+    :param name: span 名
+    :param args: 附加在 span 上的信息（例如分析器名），在 trace 中显示为字符串
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return _Span(tracer, name, args)
+
+
+def active_tracer() -> Optional[Tracer]:
+    """
+    当前正在记录的 Tracer，未开启时为 None
+    """
+    return _tracer
+
+
+def start_trace(path: str, process_name: str = "MonitoringDashboard") -> Tracer:
+    """
+    开始记录本进程的 span，stop_trace 时写出到 path
+    """
+    global _tracer
+    _tracer = Tracer(path, process_name)
+    return _tracer
+
+
+def stop_trace():
+    """
+    停止记录并写出 trace 文件，未开启记录时什么也不做
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return
+    tracer.write()
+    logging.info(f"Trace written to {tracer.path} ({len(tracer.events)} spans)")
@@ -0,0 +1,212 @@
+import logging
+import multiprocessing
+from array import array
+from multiprocessing import shared_memory
+from threading import Thread, Event
+from typing import Callable, Optional, cast
+
+from prometheus_client import Metric
+
+from ..config_types import AppConfig
+from ..pipeline import create_engine, create_history, history_tiers
+from .engine import MetricCallback, T
+from .history import SeriesView
+from .slab import SlabSeriesStore, reserve_shared_memory, slab_size
+from .trace import active_tracer, start_trace, stop_trace
+
+
+def _worker_main(
+    shm_name: Optional[str],
+    app_config: AppConfig,
+    stop_event,
+    updated_event,
+):
+    """
+    子进程入口：运行采集和分析，结果写入共享内存（shm_name 为 None 时写入
+    配置的 history_file，与主进程映射同一个文件）
+    """
+    if app_config["profile"]:
+        start_trace(app_config["profile"], "MetricEngineProcess")
+    shm = None
+    if shm_name is None:
+        history = create_history(app_config)
+    else:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        history = SlabSeriesStore(
+            shm.buf,
+            app_config["history_length"],
+            app_config["history_max_series"],
+            tiers=history_tiers(app_config),
+        )
+    engine = create_engine(app_config, history)
+    engine.register_on_update(updated_event.set)
+    engine.start()
+    stop_event.wait()
+    engine.stop()
+    # 释放所有指向共享内存的视图后才能关闭映射
+    del engine, history
+    if shm is not None:
+        shm.close()
+    stop_trace()
+
+
+class ProcessMetricEngine:
+    """
+    在子进程中运行 MetricEngine（采集、解析和分析），
+    结果写入共享内存（或配置的 history_file）中的 SlabSeriesStore，
+    本进程只读取，不需要 pickle。对外提供与 MetricEngine 相同的查询接口。
+    """
+
+    def __init__(self, app_config: AppConfig):
+        """
+        app_config: 应用配置，子进程按此配置创建引擎。
+        共享内存按 history_max_series 条序列分配，空间不足时抛出 OSError
+        """
+        self.interval = app_config["refresh_interval"]
+        self.history_size = app_config["history_length"]
+        self.update_callbacks: list[MetricCallback] = []
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        if app_config["history_file"]:
+            # 两个进程映射同一个文件，子进程启动前先在这里打开（必要时新建）
+            self.history = create_history(app_config)
+        else:
+            tiers = history_tiers(app_config)
+            max_series = app_config["history_max_series"]
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=slab_size(self.history_size, max_series, tiers)
+            )
+            try:
+                reserve_shared_memory(self._shm)
+            except OSError:
+                self._shm.close()
+                self._shm.unlink()
+                raise
+            self.history = SlabSeriesStore(
+                self._shm.buf, self.history_size, max_series, create=True, tiers=tiers
+            )
+        tracer = active_tracer()
+        if tracer is not None:
+            # 子进程的 span 写到单独的文件，本进程写出 trace 时合并进来
+            app_config = cast(
+                AppConfig, {**app_config, "profile": tracer.path + ".engine"}
+            )
+            tracer.include(app_config["profile"])
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._updated_event = self._context.Event()
+        self._process = self._context.Process(
+            target=_worker_main,
+            args=(
+                self._shm.name if self._shm is not None else None,
+                app_config,
+                self._stop_event,
+                self._updated_event,
+            ),
+            name="MetricEngineProcess",
+            daemon=True,
+        )
+        self._watcher_stop = Event()
+        self._watcher: Optional[Thread] = None
+
+    def register_on_update(self, callback: MetricCallback):
+        """
+        注册一个回调函数，子进程写入新数据后在监听线程中调用
+        """
+        self.update_callbacks.append(callback)
+
+    def start(self):
+        """
+        启动子进程和监听线程
+        """
+        self._process.start()
+        self._watcher = Thread(
+            target=self._watch, name="MetricEngineWatcher", daemon=True
+        )
+        self._watcher.start()
+
+    def stop(self):
+        """
+        停止子进程并释放共享内存（使用 history_file 时保留文件）
+        """
+        self._watcher_stop.set()
+        self._stop_event.set()
+        self._updated_event.set()
+        if self._watcher is not None:
+            self._watcher.join()
+        self._process.join(timeout=self.interval * 2 + 1)
+        if self._process.is_alive():
+            logging.warning("Metric engine process did not stop, terminating")
+            self._process.terminate()
+        self.history = None
+        if self._shm is None:
+            return
+        try:
+            self._shm.close()
+        except BufferError:
+            # 仍有视图引用共享内存，进程退出时会自动释放映射
+            pass
+        self._shm.unlink()
+
+    def _watch(self):
+        while not self._watcher_stop.is_set():
+            if not self._updated_event.wait(self.interval):
+                continue
+            self._updated_event.clear()
+            if self._watcher_stop.is_set():
+                break
+            for callback in self.update_callbacks:
+                callback()
+
+    def get_metric(
+        self, metric_name: str, labels: Optional[dict[str, str]] = None
+    ) -> Optional[Metric]:
+        """
+        获取最新的指定 metric，并按 labels 过滤。
+        """
+        samples = self.history.read(lambda: self.history.latest(metric_name, labels))
+        if not samples:
+            return None
+        return self.history.to_metric(metric_name, samples)
+
+    def get_series_range(
+        self,
+        metric_name: str,
+        start_time: float,
+        end_time: float,
+        labels: Optional[dict[str, str]] = None,
+        width: Optional[int] = None,
+    ) -> list[SeriesView]:
+        """
+        获取指定时间范围内的序列（从共享内存拷贝出来，不会被子进程改写）
+        """
+
+        def query() -> list[SeriesView]:
+            # 聚合层级的查询结果本身就是拷贝，只需要拷贝原始数据的视图
+            return [
+                (
+                    s._replace(
+                        timestamps=memoryview(array("d", s.timestamps.tobytes())),
+                        values=memoryview(array("d", s.values.tobytes())),
+                    )
+                    if not s.resolution
+                    else s
+                )
+                for s in self.history.query(
+                    metric_name, start_time, end_time, labels, width
+                )
+            ]
+
+        return self.history.read(query)
+
+    def read_history(self, fn: Callable[[], T]) -> T:
+        """
+        与 MetricEngine.read_history 相同的接口。子进程写入的共享内存由每次查询
+        自己保护并拷贝出来，这里直接执行 fn
+        """
+        return fn()
+
+    def get_last_scrape_time(self) -> Optional[float]:
+        """
+        获取最后一次采集的时间戳
+        """
+        return self.history.last_time
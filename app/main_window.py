@@ -1,28 +1,21 @@
-import queue
+import time
 import tkinter as tk
+from typing import Optional
 
 from .chart_manager import ChartManager
 from .config_types import AppConfig
-from .data_history import DataHistoryManager
-from .logic.analyze import (
-    CpuUsageAnalyzer,
-    MemoryUsageAnalyzer,
-    PhysicalDiskActiveTimeAnalyzer,
-    MemoryCommitAnalyzer,
-    NetworkSpeedAnalyzerV2,
-    LogicalDiskSizeAnalyzer,
-    GpuUsageAnalyzer,
-)
-from .logic.collect import RemoteMetricsCollector
-from .logic.engine import MetricEngine
-from .logic.metrics import update_metrics
-from .menu import add_right_click_exit_menu
+from .data_history import DataSnapshot
+from .logic.instrument import PipelineMetrics
+from .logic.metrics import build_snapshot
+from .logic.trace import span
+from .logic.worker import ProcessMetricEngine
+from .menu import add_right_click_menu
+from .pipeline import create_engine, display_labels
 
 
 class MonitoringDashboardApp:
     def __init__(self, root: tk.Tk, app_config: AppConfig):
         self.root: tk.Tk = root
-        self.q = queue.Queue()
 
         self.root.title(app_config.get("title", "Monitoring Dashboard"))
         self.w, self.h = 800, 480
@@ -33,45 +26,75 @@ class MonitoringDashboardApp:
 
         self.root.config(padx=2, pady=2)
 
-        self.chart_manager = ChartManager(root)
-        self.data_history = DataHistoryManager()
-        add_right_click_exit_menu(self.root)
-
-        self.engine = MetricEngine(
-            interval=app_config["refresh_interval"],
-            history_size=app_config["history_length"],
+        if app_config["engine_mode"] == "process":
+            # 采集和分析在子进程中运行，结果通过共享内存读取
+            self.engine = ProcessMetricEngine(app_config)
+        else:
+            self.engine = create_engine(app_config)
+        self.host_labels = display_labels(app_config)
+        # 自身的耗时等指标与引擎共用；子进程模式下引擎的指标在子进程中，这里只记录界面部分
+        self.pipeline_metrics: PipelineMetrics = (
+            getattr(self.engine, "pipeline_metrics", None) or PipelineMetrics()
         )
-        self.engine.register_collector(
-            RemoteMetricsCollector(app_config["url"], app_config["fetch_timeout"])
+
+        self.chart_manager = ChartManager(
+            root, self.pipeline_metrics, app_config["show_hud"]
         )
-        self.engine.register_analyzer(CpuUsageAnalyzer())
-        self.engine.register_analyzer(MemoryUsageAnalyzer())
-        self.engine.register_analyzer(PhysicalDiskActiveTimeAnalyzer())
-        self.engine.register_analyzer(NetworkSpeedAnalyzerV2())
-        self.engine.register_analyzer(MemoryCommitAnalyzer())
-        self.engine.register_analyzer(LogicalDiskSizeAnalyzer())
-        self.engine.register_analyzer(GpuUsageAnalyzer())
+        # 双缓冲：引擎线程把新快照放到 pending_snapshot，界面线程取出后替换 snapshot。
+        # 两者都只整体赋值、不修改，所以不需要加锁
+        self.pending_snapshot: Optional[DataSnapshot] = None
+        self.snapshot: Optional[DataSnapshot] = None
+        # 图表显示的时间窗口（秒），可以在右键菜单中切换
+        self.time_window = 60
+        add_right_click_menu(self.root, self.set_time_window, self.time_window)
 
-        self.root.after_idle(self.check_queue)
+        self.root.after_idle(self.check_snapshot)
 
         # 启动引擎
         self.engine.register_on_update(self.refresh_ui)
         self.engine.start()
+        # 历史数据保存在文件中时，重启后立即显示之前的数据
+        if self.engine.get_last_scrape_time() is not None:
+            self.refresh_now()
 
     def refresh_ui(self):
-        update_metrics(self)
-        self.q.put("refresh")
-        # self.root.after_idle(self.draw_charts)
+        """
+        构建新的快照（在引擎线程中调用），由界面线程在 check_snapshot 中取用
+        """
+        start = time.perf_counter()
+        with span("build_snapshot"):
+            snapshot = build_snapshot(self)
+        self.pipeline_metrics.snapshot_duration.observe(time.perf_counter() - start)
+        pending = self.pending_snapshot
+        if pending is not None and pending is not self.snapshot:
+            # 上一个快照还没被界面取用就被替换了
+            self.pipeline_metrics.dropped_snapshots.inc()
+        self.pending_snapshot = snapshot
+
+    def set_time_window(self, seconds: int):
+        """
+        切换图表的时间窗口，已有数据时立即刷新
+        """
+        self.time_window = seconds
+        if self.engine.get_last_scrape_time() is not None:
+            self.refresh_now()
+
+    def refresh_now(self):
+        """
+        在界面线程中立即构建快照。查询在历史数据的读取锁内进行，
+        不会与引擎线程的写入同时发生，快照中的数据在锁内已经拷贝出来
+        """
+        self.engine.read_history(self.refresh_ui)
 
-    def check_queue(self):
-        try:
-            while True:
-                msg = self.q.get_nowait()
-                if msg == "refresh":
-                    self.root.after_idle(self.chart_manager.draw_charts)
-        except queue.Empty:
-            pass
-        self.root.after(50, self.check_queue)
+    def check_snapshot(self):
+        # 只取最新的快照，期间积压的多次刷新只更新和重绘一次
+        snapshot = self.pending_snapshot
+        if snapshot is not None and snapshot is not self.snapshot:
+            self.snapshot = snapshot
+            with span("apply_snapshot"):
+                self.chart_manager.apply_snapshot(snapshot)
+            self.chart_manager.request_draw()
+        self.root.after(50, self.check_snapshot)
 
     def mainloop(self):
         self.root.mainloop()
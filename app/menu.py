@@ -1,9 +1,32 @@
 import tkinter as tk
+from typing import Callable, Optional
 
+# 可以切换的图表时间窗口：(菜单文字, 秒数)
+TIME_WINDOWS = (("1 分钟", 60), ("1 小时", 3600), ("24 小时", 86400))
 
-def add_right_click_exit_menu(root: tk.Tk):
-    # 创建只含有“退出”选项的菜单
+
+def add_right_click_menu(
+    root: tk.Tk,
+    on_time_window: Optional[Callable[[int], None]] = None,
+    time_window: int = 60,
+):
+    """
+    创建右键菜单：时间窗口切换和“退出”
+    :param root: 主窗口
+    :param on_time_window: 选择时间窗口后的回调，参数为秒数，None 表示不显示时间窗口选项
+    :param time_window: 当前的时间窗口（秒）
+    """
     menu = tk.Menu(root, tearoff=0)
+    if on_time_window is not None:
+        window_var = tk.IntVar(root, value=time_window)
+        for label, seconds in TIME_WINDOWS:
+            menu.add_radiobutton(
+                label=label,
+                variable=window_var,
+                value=seconds,
+                command=lambda: on_time_window(window_var.get()),
+            )
+        menu.add_separator()
     menu.add_command(label="退出", command=root.quit)
 
     # 右键弹出菜单的回调
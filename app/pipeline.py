@@ -0,0 +1,117 @@
+from typing import Optional
+from urllib.parse import urlsplit
+
+from .config_types import AppConfig
+from .logic.analyze import (
+    MetricAnalyzer,
+    PassthroughAnalyzer,
+    CpuUsageAnalyzer,
+    MemoryUsageAnalyzer,
+    PhysicalDiskActiveTimeAnalyzer,
+    MemoryCommitAnalyzer,
+    NetworkSpeedAnalyzerV2,
+    LogicalDiskSizeAnalyzer,
+    GpuUsageAnalyzer,
+)
+from .logic.collect import RemoteMetricsCollector, MultiTargetCollector
+from .logic.engine import MetricEngine
+from .logic.expr import ExpressionAnalyzer
+from .logic.history import RollupTier, SeriesStore
+from .logic.index import HOST_LABEL
+from .logic.slab import open_slab_file
+
+
+def create_engine(
+    app_config: AppConfig, history: Optional[SeriesStore] = None
+) -> MetricEngine:
+    """
+    按配置创建引擎，注册采集器和分析器（不启动）
+    :param app_config: 应用配置
+    :param history: 历史数据存储，None 表示按配置创建（内存或内存映射文件）
+    """
+    if history is None:
+        history = create_history(app_config)
+    engine = MetricEngine(
+        interval=app_config["refresh_interval"],
+        history_size=app_config["history_length"],
+        history=history,
+        analyzer_workers=app_config["analyzer_workers"],
+    )
+    if app_config["targets"]:
+        collector = MultiTargetCollector(
+            app_config["targets"],
+            app_config["fetch_timeout"],
+            interval=app_config["refresh_interval"],
+        )
+    else:
+        collector = RemoteMetricsCollector(
+            app_config["url"], app_config["fetch_timeout"]
+        )
+    engine.register_collector(collector)
+    analyzers = create_analyzers(app_config)
+    if app_config["source"] == "dashboard":
+        # 数据源是无界面运行的仪表盘，它已经算好了这些分析器的输出，原样使用即可
+        analyzers = [PassthroughAnalyzer(name for a in analyzers for name in a.outputs)]
+    for analyzer in analyzers:
+        engine.register_analyzer(analyzer)
+    return engine
+
+
+def create_analyzers(app_config: AppConfig) -> list[MetricAnalyzer]:
+    """
+    按配置创建从 windows_exporter 的数据计算派生指标的分析器
+    """
+    analyzers = [
+        CpuUsageAnalyzer(),
+        MemoryUsageAnalyzer(),
+        PhysicalDiskActiveTimeAnalyzer(),
+        NetworkSpeedAnalyzerV2(),
+        MemoryCommitAnalyzer(),
+        LogicalDiskSizeAnalyzer(),
+        GpuUsageAnalyzer(),
+    ]
+    if app_config["expressions"]:
+        analyzers.append(ExpressionAnalyzer(app_config["expressions"]))
+    return analyzers
+
+
+def create_history(app_config: AppConfig) -> SeriesStore:
+    """
+    按配置创建历史数据存储：配置了 history_file 时使用内存映射文件（重启后保留，
+    最多保存 history_max_series 条序列），否则使用内存中的 SeriesStore
+    """
+    tiers = history_tiers(app_config)
+    if app_config["history_file"]:
+        return open_slab_file(
+            app_config["history_file"],
+            app_config["history_length"],
+            app_config["history_max_series"],
+            tiers,
+        )
+    return SeriesStore(app_config["history_length"], tiers)
+
+
+def history_tiers(app_config: AppConfig) -> tuple[RollupTier, ...]:
+    """
+    按配置创建聚合层级
+    """
+    return tuple(
+        RollupTier.from_retention(resolution, retention)
+        for resolution, retention in app_config["history_tiers"]
+    )
+
+
+def display_labels(app_config: AppConfig) -> dict[str, str]:
+    """
+    界面显示数据时使用的 labels。
+    多目标模式下只显示一个目标（display_host，默认第一个目标）的数据。
+    数据源是多目标的无界面仪表盘时，也可以用 display_host 选择显示哪个目标。
+    """
+    if not app_config["targets"]:
+        if app_config["display_host"]:
+            return {HOST_LABEL: app_config["display_host"]}
+        return {}
+    display_host = (
+        app_config["display_host"] or urlsplit(app_config["targets"][0]).netloc
+    )
+    return {HOST_LABEL: display_host}
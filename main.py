@@ -1,12 +1,13 @@
 import argparse
-import tkinter as tk
+import multiprocessing
 from typing import cast
 
 import yaml
 
 from app.config_types import AppConfig
 from app.default_config import DEFAULT_CONFIG
-from app.main_window import MonitoringDashboardApp
+from app.headless import run_headless
+from app.logic.trace import start_trace, stop_trace
 
 
 def load_config() -> AppConfig:
@@ -32,18 +33,55 @@ def load_config() -> AppConfig:
         default=config["fullscreen"],
         help="Start in fullscreen mode (default: %(default)s)",
     )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        default=config["headless"],
+        help="Run without a window and serve /metrics and the query API "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--listen",
+        type=str,
+        default=config["listen"],
+        help="Address of the headless HTTP server (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=config["profile"],
+        metavar="TRACE_FILE",
+        help="Record pipeline spans to a Chrome/Perfetto trace file",
+    )
     args = parser.parse_args()
     config.update(vars(args))
     return config
 
 
 def main():
+    # 打包后以子进程模式运行引擎时需要
+    multiprocessing.freeze_support()
     config = load_config()
 
-    root = tk.Tk()
+    if config["profile"]:
+        start_trace(config["profile"])
+
+    try:
+        if config["headless"]:
+            run_headless(config)
+        else:
+            # 无界面模式不需要 Tk（服务器上可能没有安装）
+            import tkinter as tk
+
+            from app.main_window import MonitoringDashboardApp
+
+            root = tk.Tk()
 
-    app = MonitoringDashboardApp(root, config)
-    app.mainloop()
+            app = MonitoringDashboardApp(root, config)
+            app.mainloop()
+    finally:
+        # 关闭窗口（引擎停止）后写出 trace
+        stop_trace()
 
 
 if __name__ == "__main__":
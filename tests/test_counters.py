@@ -0,0 +1,107 @@
+import random
+
+import pytest
+from prometheus_client import Metric
+
+from app.logic.analyze import CpuUsageAnalyzer, PhysicalDiskActiveTimeAnalyzer
+from app.logic.counters import HAS_NUMPY
+
+pytestmark = pytest.mark.skipif(not HAS_NUMPY, reason="NumPy 未安装")
+
+
+def cpu_ticks(seed: int, count: int) -> list[tuple[list, list]]:
+    """
+    生成多次采集的 (core, mode) 和计数器值：
+    包含重复的 key、中途出现的新 core 和计数器重置
+    """
+    rng = random.Random(seed)
+    modes = ("idle", "user", "privileged", "interrupt")
+    counters: dict[tuple[str, str], float] = {}
+    ticks = []
+    for tick in range(count):
+        cores = 4 if tick < count // 2 else 6
+        keys, values = [], []
+        for core in range(cores):
+            for mode in modes:
+                key = (f"0,{core}", mode)
+                if tick == count // 3 and core == 1:
+                    # 主机重启，计数器从头开始
+                    counters[key] = 0.0
+                counters[key] = counters.get(key, 0.0) + rng.uniform(0, 10)
+                keys.append(key)
+                values.append(counters[key])
+        # 同一个 key 重复出现时取平均值
+        keys.append(keys[0])
+        values.append(values[0] + 2.0)
+        ticks.append((keys, values))
+    return ticks
+
+
+def test_cpu_usage_numpy_matches_python():
+    vectorized = CpuUsageAnalyzer(use_numpy=True)
+    python = CpuUsageAnalyzer(use_numpy=False)
+    for keys, values in cpu_ticks(seed=1, count=12):
+        expected = python.calculate_cpu_usage_from(keys, values)
+        assert vectorized.calculate_cpu_usage_from(keys, values) == pytest.approx(
+            expected
+        )
+    assert vectorized.get_state()["prev_values"] == pytest.approx(
+        python.get_state()["prev_values"]
+    )
+
+
+def test_cpu_usage_numpy_resumes_from_python_state():
+    ticks = cpu_ticks(seed=2, count=6)
+    python = CpuUsageAnalyzer(use_numpy=False)
+    for keys, values in ticks[:3]:
+        python.calculate_cpu_usage_from(keys, values)
+
+    # 恢复纯 Python 实现保存的状态后，向量化实现的第一次分析就有增量
+    vectorized = CpuUsageAnalyzer(use_numpy=True)
+    vectorized.set_state(python.get_state())
+    for keys, values in ticks[3:]:
+        expected = python.calculate_cpu_usage_from(keys, values)
+        result = vectorized.calculate_cpu_usage_from(keys, values)
+        assert result == pytest.approx(expected)
+        assert any(value > 0 for value in result.values())
+
+
+def disk_metrics(idle: dict, read: dict, write: dict) -> dict:
+    """
+    构造磁盘分析器需要的三个 family
+    """
+    metrics = {}
+    for name, values in (
+        ("windows_physical_disk_idle_seconds", idle),
+        ("windows_physical_disk_read_seconds", read),
+        ("windows_physical_disk_write_seconds", write),
+    ):
+        metric = Metric(name, "", "counter")
+        for disk, value in values.items():
+            metric.add_sample(name + "_total", {"disk": disk}, value)
+        metrics[name] = metric
+    return metrics
+
+
+def disk_util(analyzer, metrics: dict) -> dict[str, float]:
+    (metric,) = analyzer.analyze(metrics, 0.0)
+    return {s.labels["disk"]: s.value for s in metric.samples}
+
+
+def test_disk_active_time_numpy_matches_python():
+    rng = random.Random(3)
+    vectorized = PhysicalDiskActiveTimeAnalyzer(use_numpy=True)
+    python = PhysicalDiskActiveTimeAnalyzer(use_numpy=False)
+    disks = ["0 C:", "1 D:"]
+    idle = dict.fromkeys(disks, 0.0)
+    read = dict.fromkeys(disks, 0.0)
+    write = dict.fromkeys(disks, 0.0)
+    for tick in range(8):
+        for disk in disks:
+            idle[disk] += rng.uniform(0, 1)
+            read[disk] = 0.0 if tick == 4 else read[disk] + rng.uniform(0, 1)
+            write[disk] += rng.uniform(0, 1)
+        metrics = disk_metrics(idle, read, write)
+        assert disk_util(vectorized, metrics) == pytest.approx(
+            disk_util(python, metrics)
+        )
@@ -0,0 +1,105 @@
+import math
+import random
+
+from app.chart_widgets.downsample import M4Downsampler
+
+WIDTH = 50
+WINDOW = 100.0
+
+
+def m4_reference(values, start_time: float, end_time: float, width: int) -> list:
+    """
+    不带缓存的 M4：按绝对时间网格分桶，每个桶取第一个、最小、最大和最后一个点
+    """
+    bucket_time = (end_time - start_time) / width
+    first_index = math.floor(start_time / bucket_time) - 1
+    buckets: dict[int, list] = {}
+    for point in values:
+        index = math.floor(point[0] / bucket_time)
+        if index < first_index:
+            continue
+        bucket = buckets.get(index)
+        if bucket is None:
+            buckets[index] = [point, point, point, point]
+            continue
+        if point[1] < bucket[1][1]:
+            bucket[1] = point
+        if point[1] > bucket[2][1]:
+            bucket[2] = point
+        bucket[3] = point
+    reduced = []
+    for index in sorted(buckets):
+        first, low, high, last = buckets[index]
+        for point in (first, *sorted((low, high)), last):
+            if not reduced or point != reduced[-1]:
+                reduced.append(point)
+    return reduced
+
+
+def test_reduce_keeps_extremes():
+    values = [(0.0, 1.0), (0.5, 9.0), (1.0, -3.0), (1.5, 2.0), (2.5, 4.0)]
+    # 每个桶 2 秒
+    assert M4Downsampler().reduce(values, 0.0, 10.0, 5) == [
+        (0.0, 1.0),
+        (0.5, 9.0),
+        (1.0, -3.0),
+        (1.5, 2.0),
+        (2.5, 4.0),
+    ]
+
+
+def test_reduce_incremental_matches_reference():
+    rng = random.Random(1)
+    downsampler = M4Downsampler()
+    values = []
+    t = 0.0
+    for _ in range(400):
+        # 每次追加若干个点，窗口随最新的点滚动
+        for _ in range(rng.randint(1, 6)):
+            t += rng.uniform(0.1, 1.5)
+            values.append((t, rng.uniform(0, 100)))
+        start_time = t - WINDOW
+        assert downsampler.reduce(values, start_time, t, WIDTH) == m4_reference(
+            values, start_time, t, WIDTH
+        )
+
+
+def test_reduce_with_replaced_last_point():
+    rng = random.Random(2)
+    downsampler = M4Downsampler()
+    resolution = 5.0
+    # 已结束的桶 (start, average)，加上原始数据的最新点代替还没结束的桶
+    closed = []
+    bucket = []
+    bucket_start = 0.0
+    for second in range(1, 600):
+        t = float(second)
+        value = rng.uniform(0, 100)
+        start = math.floor(t / resolution) * resolution
+        if bucket and start != bucket_start:
+            closed.append((bucket_start, sum(bucket) / len(bucket)))
+            bucket = []
+        bucket_start = start
+        bucket.append(value)
+        values = closed + [(t, value)]
+        start_time = t - 4 * WINDOW
+        expected = m4_reference(values, start_time, t, WIDTH)
+        assert downsampler.reduce(values, start_time, t, WIDTH) == expected
+        # 同一个时刻再查询一次，最新点的值变了
+        values[-1] = (t, value + 1000)
+        expected = m4_reference(values, start_time, t, WIDTH)
+        assert downsampler.reduce(values, start_time, t, WIDTH) == expected
+
+
+def test_reduce_resets_on_older_data_and_new_width():
+    downsampler = M4Downsampler()
+    values = [(float(t), float(t % 7)) for t in range(200)]
+    downsampler.reduce(values, 100.0, 200.0, WIDTH)
+    older = values[:120]
+    assert downsampler.reduce(older, 20.0, 120.0, WIDTH) == m4_reference(
+        older, 20.0, 120.0, WIDTH
+    )
+    assert downsampler.reduce(values, 100.0, 200.0, 20) == m4_reference(
+        values, 100.0, 200.0, 20
+    )
+    assert downsampler.reduce([], 100.0, 200.0, WIDTH) == []
@@ -0,0 +1,179 @@
+import json
+
+import pytest
+from prometheus_client import Metric
+
+from app.logic.expr import ExpressionAnalyzer, Rate, compile_expressions
+
+
+def counter(name: str, values: dict[str, float]) -> dict[str, Metric]:
+    """
+    一个 counter family，每个 nic 一个样本
+    """
+    metric = Metric(name, "", "counter")
+    for nic, value in values.items():
+        metric.add_sample(name + "_total", {"nic": nic}, value)
+    return {name: metric}
+
+
+def gauges(**families: dict[tuple, float]) -> dict[str, Metric]:
+    """
+    多个 gauge family，样本的 labels 以 ((label, value), ...) 给出
+    """
+    metrics = {}
+    for name, samples in families.items():
+        metric = Metric(name, "", "gauge")
+        for labels, value in samples.items():
+            metric.add_sample(name, dict(labels), value)
+        metrics[name] = metric
+    return metrics
+
+
+def evaluate(text: str, metrics: dict[str, Metric], scrape_time: float = 0.0):
+    return compile_expressions({"result": text}).evaluate(metrics, scrape_time)[
+        "result"
+    ]
+
+
+def vector(value) -> dict[tuple, float]:
+    return {tuple(sorted(s.labels.items())): s.value for s in value}
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("1 + 2 * 3", 7.0),
+        ("(1 + 2) * 3", 9.0),
+        ("10 - 4 - 3", 3.0),
+        ("12 / 3 / 2", 2.0),
+        ("-2 * -3", 6.0),
+        ("2 - -1", 3.0),
+        ("1.5e2 + .5", 150.5),
+    ],
+)
+def test_parse_scalar_precedence(text, expected):
+    assert evaluate(text, {}) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "1 +",
+        "(1 + 2",
+        "1 2",
+        "sum(",
+        "rate(disk[5x])",
+        "rate(disk)",
+        'disk{host="a"',
+        "disk{host=a}",
+        "sum by host (disk)",
+        "1 # 2",
+    ],
+)
+def test_parse_errors(text):
+    with pytest.raises(ValueError, match="in expression"):
+        compile_expressions({"result": text})
+
+
+def test_invalid_expression_name():
+    with pytest.raises(ValueError, match="Invalid expression name"):
+        compile_expressions({"bad name": "1"})
+
+
+def test_selectors_aggregates_and_vector_matching():
+    metrics = gauges(
+        used={
+            (("disk", "C:"), ("host", "a")): 30.0,
+            (("disk", "D:"), ("host", "a")): 10.0,
+            (("disk", "C:"), ("host", "b")): 5.0,
+        },
+        size={
+            (("disk", "C:"), ("host", "a")): 60.0,
+            (("disk", "D:"), ("host", "a")): 40.0,
+        },
+    )
+    assert vector(evaluate('used{host="a", disk="D:"}', metrics)) == {
+        (("disk", "D:"), ("host", "a")): 10.0
+    }
+    assert vector(evaluate("sum by (host) (used)", metrics)) == {
+        (("host", "a"),): 40.0,
+        (("host", "b"),): 5.0,
+    }
+    # by 也可以写在后面
+    assert vector(evaluate("max(used) by (disk)", metrics)) == {
+        (("disk", "C:"),): 30.0,
+        (("disk", "D:"),): 10.0,
+    }
+    # 两个向量按完全相同的 labels 匹配，没有匹配的样本被丢弃
+    assert vector(evaluate("100 * used / size", metrics)) == {
+        (("disk", "C:"), ("host", "a")): 50.0,
+        (("disk", "D:"), ("host", "a")): 25.0,
+    }
+    assert evaluate("missing + 1", metrics) == []
+
+
+def test_plan_shares_subexpressions():
+    plan = compile_expressions(
+        {
+            "free_percent": "100 * avg(free) / avg(total)",
+            "used_percent": "100 - 100 * avg(free) / avg(total)",
+            "received_bps": "rate(received[5s]) * 8",
+            "received_mbps": "rate(received [5s]) / 125000",
+        }
+    )
+    assert plan.inputs == {"free", "total", "received"}
+    free_root = plan.roots["free_percent"][1]
+    used_root = plan.roots["used_percent"][1]
+    assert used_root.children[1] is free_root
+    assert len(plan.rates) == 1
+
+
+def test_rate_over_window():
+    plan = compile_expressions({"result": "rate(net[2s])"})
+    results = []
+    for t, values in enumerate(
+        [
+            {"a": 0.0, "b": 0.0},
+            {"a": 10.0, "b": 1.0},
+            {"a": 30.0, "b": 2.0},
+            {"a": 60.0, "b": 3.0},
+            {"a": 100.0},
+            # 计数器重置，增量为当前值
+            {"a": 5.0},
+        ]
+    ):
+        results.append(
+            vector(plan.evaluate(counter("net", values), float(t))["result"])
+        )
+    assert results == [
+        {},
+        {(("nic", "a"),): 10.0, (("nic", "b"),): 1.0},
+        {(("nic", "a"),): 15.0, (("nic", "b"),): 1.0},
+        {(("nic", "a"),): 20.0, (("nic", "b"),): 1.0},
+        # 窗口开始之前的点只保留最近的一个
+        {(("nic", "a"),): 30.0},
+        {(("nic", "a"),): 25.0},
+    ]
+    # 消失的序列不再保留
+    (rate,) = plan.rates.values()
+    assert isinstance(rate, Rate)
+    assert [labels for labels, _ in rate.points.values()] == [{"nic": "a"}]
+
+
+def test_rate_state_survives_restart():
+    expressions = {"received_bps": "rate(net[10s]) * 8"}
+    analyzer = ExpressionAnalyzer(expressions)
+    for t in range(3):
+        list(analyzer.analyze(counter("net", {"a": 100.0 * t}), float(t)))
+    state = json.loads(json.dumps(analyzer.get_state()))
+
+    restored = ExpressionAnalyzer(expressions)
+    restored.set_state(state)
+    (metric,) = restored.analyze(counter("net", {"a": 300.0}), 3.0)
+    assert [(s.labels, s.value) for s in metric.samples] == [({"nic": "a"}, 800.0)]
+
+    # 没有状态时第一次采集没有结果
+    (metric,) = ExpressionAnalyzer(expressions).analyze(
+        counter("net", {"a": 300.0}), 3.0
+    )
+    assert metric.samples == []
@@ -0,0 +1,129 @@
+import itertools
+
+from prometheus_client import Metric
+
+from app.logic.history import RollupRing, RollupTier, SeriesRing, SeriesStore
+
+SCRAPE_TIME = 1_700_000_000.0
+
+
+def disk_metric(value: float) -> Metric:
+    """
+    每个 (host, disk, kind) 组合一个样本，一部分组合缺少 kind 标签
+    """
+    metric = Metric("disk_bytes", "", "gauge")
+    for host, disk, kind in itertools.product(
+        ("a", "b", "c"), ("C:", "D:"), ("read", "write", None)
+    ):
+        labels = {"host": host, "disk": disk}
+        if kind is not None:
+            labels["kind"] = kind
+        metric.add_sample("disk_bytes", labels, value)
+    return metric
+
+
+def test_series_ids_match_label_scan():
+    store = SeriesStore(capacity=10)
+    store.append(SCRAPE_TIME, [disk_metric(1.0)])
+    entries = [store.entries[i] for i in store.series_ids("disk_bytes")]
+    assert len(entries) == 18
+
+    for labels in (
+        {"host": "a"},
+        {"host": "b", "disk": "D:"},
+        {"disk": "C:", "kind": "write"},
+        {"host": "c", "disk": "C:", "kind": "read"},
+        {"host": "d"},
+        {"host": "a", "disk": "E:"},
+        {"unknown": "x"},
+    ):
+        expected = [
+            i
+            for i in range(len(entries))
+            if labels.items() <= store.entries[i][0].items()
+        ]
+        assert store.series_ids("disk_bytes", labels) == expected
+        latest = store.latest("disk_bytes", labels)
+        assert [s.labels for s in latest] == [store.entries[i][0] for i in expected]
+
+    assert store.series_ids("missing") == []
+    assert store.series_ids("missing", {"host": "a"}) == []
+
+
+def test_series_ids_stable_across_appends():
+    store = SeriesStore(capacity=10)
+    store.append(SCRAPE_TIME, [disk_metric(1.0)])
+    before = store.series_ids("disk_bytes", {"host": "b"})
+
+    # 已有的序列不会重复登记，新序列追加在后面
+    metric = disk_metric(2.0)
+    metric.add_sample("disk_bytes", {"host": "b", "disk": "E:"}, 2.0)
+    store.append(SCRAPE_TIME + 1, [metric])
+    after = store.series_ids("disk_bytes", {"host": "b"})
+    assert after[:-1] == before
+    assert store.entries[after[-1]][0] == {"host": "b", "disk": "E:"}
+    assert len(store.series_ids("disk_bytes")) == 19
+    assert [s.value for s in store.latest("disk_bytes", {"disk": "E:"})] == [2.0]
+
+
+def test_series_ring_wraparound():
+    ring = SeriesRing(5)
+    assert ring.last() is None
+    assert len(ring.view()[0]) == 0
+    for i in range(13):
+        ring.append(float(i), i * 10.0)
+        timestamps, values = ring.view()
+        expected = [float(t) for t in range(max(0, i - 4), i + 1)]
+        assert list(timestamps) == expected
+        assert list(values) == [t * 10 for t in expected]
+    assert ring.count == 13
+    assert len(ring) == 5
+    assert ring.last() == (12.0, 120.0)
+    timestamps, values = ring.range(9.5, 11.0)
+    assert list(timestamps) == [10.0, 11.0]
+    assert list(values) == [100.0, 110.0]
+    assert len(ring.range(0.0, 7.5)[0]) == 0
+
+
+def test_rollup_ring_wraparound():
+    ring = RollupRing(RollupTier(10.0, 3))
+    assert ring.first_time() is None
+    for t in range(45):
+        ring.add(float(t), float(t))
+    # 0 和 10 开始的桶已被覆盖，40 开始的桶还没有结束
+    assert ring.first_time() == 20.0
+    starts, mins, maxs, averages, counts = ring.range(0.0, 100.0)
+    assert list(starts) == [20.0, 30.0, 40.0]
+    assert list(mins) == [20.0, 30.0, 40.0]
+    assert list(maxs) == [29.0, 39.0, 44.0]
+    assert list(averages) == [24.5, 34.5, 42.0]
+    assert list(counts) == [10.0, 10.0, 5.0]
+
+    # 比最新的桶还旧的样本被忽略
+    ring.add(5.0, 1000.0)
+    ring.add(35.0, 1000.0)
+    assert list(ring.range(0.0, 100.0)[2]) == [29.0, 39.0, 44.0]
+
+    for t in range(45, 75):
+        ring.add(float(t), float(t))
+    assert ring.first_time() == 50.0
+    assert list(ring.range(55.0, 65.0)[0]) == [50.0, 60.0]
+    assert list(ring.range(0.0, 45.0)[0]) == []
+    assert list(ring.range(70.0, 70.0)[3]) == [72.0]
+
+
+def test_query_replaces_open_bucket_with_tail():
+    store = SeriesStore(capacity=5, tiers=(RollupTier(10.0, 100),))
+    for t, value in enumerate([1.0, 100.0, 5.0, 7.0, 3.0, 9.0, 11.0, 2.0, 4.0]):
+        metric = Metric("cpu", "", "gauge")
+        metric.add_sample("cpu", {}, value)
+        store.append(SCRAPE_TIME + t, [metric])
+
+    # 原始数据只保留 5 个点，查询整个区间时使用聚合层级
+    (view,) = store.query("cpu", SCRAPE_TIME, SCRAPE_TIME + 8, width=1)
+    assert view.resolution == 10.0
+    assert list(view.timestamps) == [SCRAPE_TIME + 8]
+    assert list(view.values) == [4.0]
+    assert list(view.mins) == [4.0]
+    assert list(view.maxs) == [4.0]
+    assert list(view.counts) == [1.0]
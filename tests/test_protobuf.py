@@ -0,0 +1,251 @@
+import random
+import struct
+import types
+
+import pytest
+import requests
+
+from app.logic.collect import RemoteMetricsCollector
+from app.logic.parse import LabelSetTable, parse_compact
+from app.logic.protobuf import SCRAPE_ACCEPT, is_protobuf, parse_delimited
+from app.logic.protobuf import _varint as _read_varint
+from tools import simulator as simulator_module
+from tools.payload import PayloadSpec, generate_payload, generate_protobuf_payload
+from tools.simulator import ExporterSimulator, SimulatorOptions
+
+SCRAPE_TIME = 1_700_000_000.0
+START_TIME = SCRAPE_TIME - 3600
+SPEC = PayloadSpec(cores=4, processes=10)
+
+
+def families_data(families) -> list[tuple]:
+    """
+    family 的可比较表示：名字、类型、说明和所有样本
+    """
+    return [
+        (
+            f.name,
+            f.type,
+            f.documentation,
+            [(s.name, s.labels, s.value, s.timestamp) for s in f.samples],
+        )
+        for f in families
+    ]
+
+
+@pytest.fixture
+def fixed_time(monkeypatch):
+    """
+    模拟器按同一个时间生成数据，两次拉取的值相同
+    """
+    fake_time = types.SimpleNamespace(
+        time=lambda: SCRAPE_TIME, sleep=simulator_module.time.sleep
+    )
+    monkeypatch.setattr(simulator_module, "time", fake_time)
+
+
+@pytest.fixture
+def simulators(fixed_time):
+    """
+    同一份数据的两个模拟器：一个按 Accept 头返回 protobuf，一个只返回文本格式
+    """
+    started = []
+    for protobuf in (True, False):
+        sim = ExporterSimulator(
+            0, SimulatorOptions(payload=SPEC, protobuf=protobuf), seed="test"
+        )
+        sim.start_time = START_TIME
+        sim.start()
+        started.append(sim)
+    yield started
+    for sim in started:
+        sim.stop()
+
+
+def scrape(url: str, metric_filter=None) -> list:
+    collector = RemoteMetricsCollector(url, timeout=5.0)
+    if metric_filter is not None:
+        collector.set_metric_filter(metric_filter)
+    try:
+        return list(collector.collect())
+    finally:
+        collector.close()
+
+
+def test_simulator_negotiates_format(simulators):
+    protobuf_sim, text_sim = simulators
+    headers = {"Accept": SCRAPE_ACCEPT}
+    resp = requests.get(protobuf_sim.url, headers=headers, timeout=5)
+    assert is_protobuf(resp.headers["Content-Type"])
+    resp = requests.get(protobuf_sim.url, timeout=5)
+    assert resp.headers["Content-Type"].startswith("text/plain")
+    resp = requests.get(text_sim.url, headers=headers, timeout=5)
+    assert resp.headers["Content-Type"].startswith("text/plain")
+
+
+def test_collect_same_families_from_both_formats(simulators):
+    protobuf_sim, text_sim = simulators
+    from_protobuf = families_data(scrape(protobuf_sim.url))
+    from_text = families_data(scrape(text_sim.url))
+    assert from_protobuf
+    assert from_protobuf == from_text
+
+
+def test_collect_with_metric_filter(simulators):
+    protobuf_sim, text_sim = simulators
+    metric_filter = {"windows_cpu_time", "windows_memory_physical_free_bytes"}
+    from_protobuf = families_data(scrape(protobuf_sim.url, metric_filter))
+    from_text = families_data(scrape(text_sim.url, metric_filter))
+    assert sorted(f[0] for f in from_protobuf) == sorted(metric_filter)
+    assert from_protobuf == from_text
+
+
+def test_parse_delimited_matches_text_across_scrapes():
+    # 驻留表在多次采集之间复用，第二次走已知序列的路径
+    text_table = LabelSetTable()
+    protobuf_table = LabelSetTable()
+    for t in (SCRAPE_TIME, SCRAPE_TIME + 1, SCRAPE_TIME + 2):
+        text = generate_payload(SPEC, t, START_TIME)
+        data = generate_protobuf_payload(SPEC, t, START_TIME)
+        assert families_data(parse_delimited(data, protobuf_table)) == families_data(
+            parse_compact(text, text_table)
+        )
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _double(number: int, value: float) -> bytes:
+    return _varint(number << 3 | 1) + struct.pack("<d", value)
+
+
+def _label(name: str, value: str) -> bytes:
+    return _field(1, _field(1, name.encode()) + _field(2, value.encode()))
+
+
+def _delimited(*messages: bytes) -> bytes:
+    return b"".join(_varint(len(m)) + m for m in messages)
+
+
+def test_parse_delimited_summary_histogram_and_timestamps():
+    summary = (
+        _field(1, b"rpc_seconds")
+        + _field(2, b"RPC latency")
+        + _varint(0x18)
+        + _varint(2)
+        + _field(
+            4,
+            _label("svc", "a")
+            + _field(
+                4,
+                _varint(0x08)
+                + _varint(10)
+                + _double(2, 3.5)
+                + _field(3, _double(1, 0.5) + _double(2, 0.1))
+                + _field(3, _double(1, 0.99) + _double(2, 0.9)),
+            )
+            + _varint(0x30)
+            + _varint(1_700_000_000_123),
+        )
+    )
+    # labels 之间夹着时间戳（不连续），没有 +Inf 桶
+    histogram = (
+        _field(1, b"req_seconds")
+        + _field(2, b"h")
+        + _varint(0x18)
+        + _varint(4)
+        + _field(
+            4,
+            _label("a", "1")
+            + _varint(0x30)
+            + _varint(5)
+            + _label("b", "2")
+            + _field(
+                7,
+                _varint(0x08)
+                + _varint(7)
+                + _double(2, 1.5)
+                + _field(3, _varint(0x08) + _varint(3) + _double(2, 0.1))
+                + _field(3, _varint(0x08) + _varint(6) + _double(2, 1.0)),
+            ),
+        )
+    )
+    untyped = (
+        _field(1, b"x")
+        + _varint(0x18)
+        + _varint(3)
+        + _field(4, _field(5, _double(1, 2.0)))
+    )
+    data = _delimited(summary, histogram, untyped)
+    text = """# HELP rpc_seconds RPC latency
+# TYPE rpc_seconds summary
+rpc_seconds{svc="a",quantile="0.5"} 0.1 1700000000123
+rpc_seconds{svc="a",quantile="0.99"} 0.9 1700000000123
+rpc_seconds_sum{svc="a"} 3.5 1700000000123
+rpc_seconds_count{svc="a"} 10.0 1700000000123
+# HELP req_seconds h
+# TYPE req_seconds histogram
+req_seconds_bucket{a="1",b="2",le="0.1"} 3.0 5
+req_seconds_bucket{a="1",b="2",le="1.0"} 6.0 5
+req_seconds_bucket{a="1",b="2",le="+Inf"} 7.0 5
+req_seconds_sum{a="1",b="2"} 1.5 5
+req_seconds_count{a="1",b="2"} 7.0 5
+# TYPE x untyped
+x 2.0
+"""
+    expected = families_data(parse_compact(text, LabelSetTable()))
+    table = LabelSetTable()
+    assert families_data(parse_delimited(data, table)) == expected
+    assert families_data(parse_delimited(data, table)) == expected
+
+
+def test_parse_delimited_truncated_raises():
+    data = generate_protobuf_payload(SPEC, SCRAPE_TIME, START_TIME)
+    # 第一个 MetricFamily 内部的任何位置截断都是不完整的数据
+    size, pos = _read_varint(data, 0)
+    first_end = pos + size
+    for end in range(1, first_end):
+        with pytest.raises(ValueError):
+            list(parse_delimited(data[:end], LabelSetTable()))
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"<html><head><title>Not Found</title></head><body>Not Found</body></html>",
+        b"\xff" * 16,
+        _delimited(_field(2, b"no name")),
+        _delimited(_field(1, b"x") + bytes([0x0B])),  # 不支持的 wire type
+    ],
+)
+def test_parse_delimited_garbage_raises(data):
+    with pytest.raises(ValueError):
+        list(parse_delimited(data, LabelSetTable()))
+
+
+def test_parse_delimited_random_input_only_raises_value_error():
+    rng = random.Random(0)
+    valid = generate_protobuf_payload(SPEC, SCRAPE_TIME, START_TIME)
+    for _ in range(300):
+        if rng.random() < 0.5:
+            data = bytes(rng.getrandbits(8) for _ in range(rng.randint(1, 64)))
+        else:
+            # 在有效数据中随机改写几个字节
+            mutated = bytearray(valid)
+            for _ in range(rng.randint(1, 8)):
+                mutated[rng.randrange(len(mutated))] = rng.getrandbits(8)
+            data = bytes(mutated)
+        try:
+            list(parse_delimited(data, LabelSetTable()))
+        except ValueError:
+            pass
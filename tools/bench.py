@@ -0,0 +1,490 @@
+"""
+各处理阶段的基准测试：解析、分析、历史查询和图表绘制。
+
+用法：
+    python -m tools.bench --payload cores=64,processes=500 --output bench.json
+    python -m tools.bench --compare bench.json
+
+每个阶段按采集周期连续运行多次（每次使用下一次采集的数据），记录每次的耗时，
+输出每秒次数、耗时分位数和每次的内存分配量，结果保存为 JSON，可以和之前的结果比较。
+"""
+
+import argparse
+import copy
+import json
+import math
+import platform
+import sys
+import time
+import tkinter as tk
+import tracemalloc
+import types
+from collections import Counter
+from typing import Any, Callable, NamedTuple, Optional, cast
+
+import yaml
+from prometheus_client.parser import text_string_to_metric_families
+
+from app.chart_manager import ChartManager
+from app.config_types import AppConfig
+from app.default_config import DEFAULT_CONFIG
+from app.logic.counters import HAS_NUMPY
+from app.logic.index import (
+    build_metric_map,
+    get_value_from_metric,
+    get_value_from_metric_group_by,
+)
+from app.logic.metrics import build_snapshot
+from app.logic.parse import LabelSetTable, parse_compact
+from app.logic.protobuf import parse_delimited
+from app.pipeline import create_engine, create_history
+
+from .payload import PayloadSpec, generate_payload, generate_protobuf_payload
+
+# 第一次采集的时间，exporter 在这之前一小时启动
+START_TIME = 1_700_000_000.0
+UPTIME = 3600.0
+# 查询阶段使用的指标
+QUERY_METRIC = "cpu_usage_percent"
+# 绘制阶段的窗口尺寸（像素）
+WINDOW_SIZE = (800, 480)
+
+
+class Stage(NamedTuple):
+    """
+    一个基准测试阶段
+    """
+
+    name: str
+    # 参数为第几次采集，返回值在计算内存分配时保留到调用结束之后
+    run: Callable[[int], Any]
+    # 每次调用之后读取的附加计数（例如画布命令数），累计后取平均
+    counters: Optional[Callable[[], dict[str, int]]] = None
+
+
+class RecordingTk:
+    """
+    记录命令的 Tcl 解释器替身：不需要显示器，图表的每个 Tk/画布命令只计数，
+    返回足够让图表代码继续运行的值。用来测量绘制代码自身的开销和命令数。
+    """
+
+    def __init__(self, width: int, height: int):
+        self.commands: Counter[str] = Counter()
+        self.size = {"width": width, "height": height}
+        self.next_item = 0
+
+    def call(self, *args):
+        if len(args) == 1 and isinstance(args[0], tuple):
+            args = args[0]
+        command = str(args[0])
+        if command.startswith((".", "pyimage")) and len(args) > 1:
+            # 控件或图像的子命令，例如 "<canvas> coords"、"<image> put"
+            prefix = "image " if command.startswith("pyimage") else ""
+            command = prefix + str(args[1])
+        elif command == "winfo" and len(args) > 1:
+            command = f"winfo {args[1]}"
+        self.commands[command] += 1
+
+        if command == "create":
+            self.next_item += 1
+            return self.next_item
+        if command == "after":
+            # 定时器不会执行，只返回一个 id
+            if args[1] == "info":
+                return ("", "timer")
+            self.next_item += 1
+            return f"after#{self.next_item}"
+        if command == "winfo rgb":
+            return (0, 0, 0)
+        if command in ("winfo width", "winfo height"):
+            return self.size[command[6:]]
+        if command == "cget":
+            # 颜色选项返回白色，尺寸选项（borderwidth 等）返回 0
+            return "0" if str(args[2]).endswith(("width", "thickness")) else "white"
+        return ""
+
+    def getint(self, value) -> int:
+        return int(value) if value != "" else 0
+
+    def getdouble(self, value) -> float:
+        return float(value) if value != "" else 0.0
+
+    def getboolean(self, value) -> bool:
+        return bool(value)
+
+    def splitlist(self, value) -> tuple:
+        return value if isinstance(value, tuple) else tuple(str(value).split())
+
+    def createcommand(self, _name, _func):
+        pass
+
+    def deletecommand(self, _name):
+        pass
+
+
+class RecordingRoot(tk.Misc):
+    """
+    使用 RecordingTk 的根窗口，可以在上面创建图表
+    """
+
+    def __init__(self, width: int, height: int):
+        self.tk = cast(Any, RecordingTk(width, height))
+        self._w = "."
+        self.master = None
+        self.children = {}
+        self._last_child_ids = None
+        self._tclCommands = []
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """
+    最近秩法的分位数
+    :param sorted_values: 升序排列的值
+    :param p: 百分位（0~100）
+    """
+    if not sorted_values:
+        return math.nan
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def measure(stage: Stage, warmup: int, ticks: int, alloc_ticks: int) -> dict:
+    """
+    依次运行 warmup 次预热、ticks 次计时和 alloc_ticks 次内存分配统计
+    :return: 该阶段的结果
+    """
+    for i in range(warmup):
+        stage.run(i)
+    if stage.counters is not None:
+        # 丢弃预热期间的计数
+        stage.counters()
+
+    durations = []
+    totals: Counter[str] = Counter()
+    for i in range(warmup, warmup + ticks):
+        start = time.perf_counter_ns()
+        stage.run(i)
+        durations.append((time.perf_counter_ns() - start) / 1e6)
+        if stage.counters is not None:
+            totals.update(stage.counters())
+
+    # 计时之后单独统计内存分配，tracemalloc 会明显拖慢运行
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for i in range(warmup + ticks, warmup + ticks + alloc_ticks):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            result = stage.run(i)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(current - before)
+            del result
+    finally:
+        tracemalloc.stop()
+
+    durations.sort()
+    total_ms = sum(durations)
+    result = {
+        "ops_per_sec": ticks / total_ms * 1000 if total_ms > 0 else math.inf,
+        "mean_ms": total_ms / ticks,
+        "p50_ms": percentile(durations, 50),
+        "p90_ms": percentile(durations, 90),
+        "p99_ms": percentile(durations, 99),
+        "max_ms": durations[-1],
+        # 每次调用期间的内存分配峰值，以及调用结束后仍然保留的内存（例如返回值）
+        "alloc_peak_bytes": int(percentile(sorted(peaks), 50)) if peaks else None,
+        "alloc_retained_bytes": (
+            int(percentile(sorted(retained), 50)) if retained else None
+        ),
+    }
+    if stage.counters is not None:
+        result["counters"] = {
+            name: count / ticks for name, count in sorted(totals.items())
+        }
+    return result
+
+
+def load_config(path: Optional[str]) -> AppConfig:
+    """
+    默认配置，指定了 path 时用 YAML 文件中的配置覆盖（例如 expressions）
+    """
+    config = cast(AppConfig, copy.deepcopy(DEFAULT_CONFIG))
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            config.update(yaml.safe_load(f) or {})
+    # 基准测试只使用单个目标、内存中的历史存储，分析器依次运行以便分别计时
+    config.update(targets=[], history_file="", analyzer_workers=0)
+    return config
+
+
+def build_stages(spec: PayloadSpec, config: AppConfig, count: int) -> list[Stage]:
+    """
+    准备 count 次采集的输入，创建所有阶段
+    """
+    interval = config["refresh_interval"]
+    times = [START_TIME + i * interval for i in range(count)]
+    texts = [generate_payload(spec, t, START_TIME - UPTIME) for t in times]
+    protobufs = [generate_protobuf_payload(spec, t, START_TIME - UPTIME) for t in times]
+
+    table = LabelSetTable()
+    protobuf_table = LabelSetTable()
+    families = [list(parse_compact(text, table)) for text in texts]
+    metric_maps = [build_metric_map(f) for f in families]
+
+    # 用一个完整的引擎算出每次采集的分析结果，作为历史写入和下游分析器的输入
+    engine = create_engine(config)
+    analyzers = copy.deepcopy(engine.analyzers)
+    outputs = [engine._analyze(m, t) for m, t in zip(metric_maps, times)]
+    # 下游分析器（例如表达式）还能看到上游分析器的输出
+    analyzer_inputs = [{**m, **o} for m, o in zip(metric_maps, outputs)]
+
+    # 写满 history_length 的历史，使查询覆盖完整的窗口
+    history_points = int(config["history_length"] / interval)
+    history = create_history(config)
+    for i in range(history_points):
+        t = times[0] - (history_points - i) * interval
+        engine.history.append(t, outputs[i % count].values())
+        history.append(t, outputs[i % count].values())
+    # 查询阶段的引擎预先写入所有采集，history.append 阶段写入另一个相同的存储
+    for i in range(count):
+        engine.history.append(times[i], outputs[i].values())
+
+    stages = [
+        Stage(
+            "parse.text_string_to_metric_families",
+            lambda i: list(text_string_to_metric_families(texts[i])),
+        ),
+        Stage("parse.parse_compact", lambda i: list(parse_compact(texts[i], table))),
+        Stage(
+            "parse.parse_delimited",
+            lambda i: list(parse_delimited(protobufs[i], protobuf_table)),
+        ),
+        Stage("index.build_metric_map", lambda i: build_metric_map(families[i])),
+    ]
+    for name, analyzer in zip(engine._analyzer_names, analyzers):
+        stages.append(
+            Stage(
+                f"analyze.{name}",
+                lambda i, a=analyzer: list(a.analyze(analyzer_inputs[i], times[i])),
+            )
+        )
+    stages.append(
+        Stage(
+            "history.append",
+            lambda i: history.append(times[i], outputs[i].values()),
+        )
+    )
+
+    window = 60.0
+    stages += [
+        Stage(
+            "engine.get_series_range",
+            lambda i: engine.get_series_range(
+                QUERY_METRIC, times[i] - window, times[i]
+            ),
+        ),
+        Stage(
+            "engine.get_metric_range",
+            lambda i: engine.get_metric_range(
+                QUERY_METRIC, times[i] - window, times[i]
+            ),
+        ),
+    ]
+    # get_value_from_metric 的输入是已经查询出来的 Metric，不计入查询的耗时
+    ranges = [
+        engine.get_metric_range(QUERY_METRIC, times[i] - window, times[i])
+        for i in range(count)
+    ]
+    stages += [
+        Stage(
+            "index.get_value_from_metric",
+            lambda i: get_value_from_metric(ranges[i]),
+        ),
+        Stage(
+            "index.get_value_from_metric_group_by",
+            lambda i: get_value_from_metric_group_by(ranges[i], ["core"]),
+        ),
+    ]
+
+    # 绘制：在记录命令的 Tk 上创建完整的图表布局
+    root = RecordingRoot(*WINDOW_SIZE)
+    default_root = tk._default_root
+    # DiskProgressBars 中的 ttk.Style 使用默认根窗口
+    tk._default_root = root
+    try:
+        chart_manager = ChartManager(cast(tk.Tk, root))
+    finally:
+        tk._default_root = default_root
+    columns = math.ceil(len(chart_manager.charts) / 2)
+    recorder = cast(RecordingTk, root.tk)
+    recorder.size = {
+        "width": WINDOW_SIZE[0] // columns,
+        "height": WINDOW_SIZE[1] // 2,
+    }
+    for chart in chart_manager.charts:
+        chart.on_configure(None)
+
+    # 查询第 i 次采集时的快照：引擎的最后采集时间取 times[i]
+    current = [0]
+    app = types.SimpleNamespace(
+        engine=types.SimpleNamespace(
+            get_last_scrape_time=lambda: times[current[0]],
+            get_series_range=engine.get_series_range,
+            get_metric=engine.get_metric,
+        ),
+        chart_manager=chart_manager,
+        host_labels={},
+        time_window=window,
+    )
+
+    def build(i: int):
+        current[0] = i
+        return build_snapshot(app)
+
+    # 绘制的输入是已经构建好的快照，不计入绘制的耗时
+    snapshots = [build(i) for i in range(count)]
+
+    def render(i: int):
+        chart_manager.apply_snapshot(snapshots[i])
+        chart_manager.draw_charts()
+
+    last_commands: Counter[str] = Counter()
+
+    def render_commands() -> dict[str, int]:
+        # 这一次绘制发出的 Tk 命令数
+        nonlocal last_commands
+        delta = recorder.commands - last_commands
+        last_commands = recorder.commands.copy()
+        return {"tk_commands": sum(delta.values()), **delta}
+
+    stages += [
+        Stage("metrics.build_snapshot", build),
+        Stage("render.draw_charts", render, render_commands),
+    ]
+    render_commands()
+
+    # 完整的一次采集（不含网络）：解析、分析、写入历史和构建快照
+    pipeline_engine = create_engine(config)
+    pipeline_table = LabelSetTable()
+    pipeline_app = types.SimpleNamespace(
+        engine=pipeline_engine,
+        chart_manager=chart_manager,
+        host_labels={},
+        time_window=window,
+    )
+
+    def tick(i: int):
+        metric_map = build_metric_map(parse_compact(texts[i], pipeline_table))
+        result = pipeline_engine._analyze(metric_map, times[i])
+        pipeline_engine.history.append(times[i], result.values())
+        return build_snapshot(pipeline_app)
+
+    stages.append(Stage("pipeline.tick", tick))
+    return stages
+
+
+def compare(previous: dict, current: dict):
+    """
+    打印两次结果中各阶段 p50 耗时的变化
+    """
+    print(f"{'stage':<48} {'before ms':>10} {'after ms':>10} {'change':>8}")
+    for name, result in current["stages"].items():
+        old = previous["stages"].get(name)
+        if old is None:
+            print(f"{name:<48} {'-':>10} {result['p50_ms']:>10.3f} {'new':>8}")
+            continue
+        change = (result["p50_ms"] / old["p50_ms"] - 1) * 100 if old["p50_ms"] else 0
+        print(
+            f"{name:<48} {old['p50_ms']:>10.3f} {result['p50_ms']:>10.3f} "
+            f"{change:>+7.1f}%"
+        )
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Monitoring Dashboard benchmarks")
+    parser.add_argument(
+        "--payload",
+        type=PayloadSpec.parse,
+        default=PayloadSpec(),
+        help="Payload scale, e.g. cores=64,disks=4,nics=2,processes=500 "
+        "(fields: %s)" % ", ".join(PayloadSpec._fields),
+    )
+    parser.add_argument(
+        "--ticks", type=int, default=100, help="Timed runs per stage (default: 100)"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=10, help="Untimed runs first (default: 10)"
+    )
+    parser.add_argument(
+        "--alloc-ticks",
+        type=int,
+        default=5,
+        help="Runs traced for allocations after timing (default: 5)",
+    )
+    parser.add_argument(
+        "--stages",
+        type=str,
+        default="",
+        help="Only run stages whose name starts with one of these, comma-separated",
+    )
+    parser.add_argument(
+        "--config", type=str, default="", help="YAML config overriding the defaults"
+    )
+    parser.add_argument("--output", type=str, default="", help="Write results as JSON")
+    parser.add_argument(
+        "--compare", type=str, default="", help="Compare with a previous JSON result"
+    )
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    count = args.warmup + args.ticks + args.alloc_ticks
+    text = generate_payload(args.payload, START_TIME, START_TIME - UPTIME)
+    stages = build_stages(args.payload, config, count)
+    prefixes = tuple(filter(None, args.stages.split(",")))
+    if prefixes:
+        stages = [stage for stage in stages if stage.name.startswith(prefixes)]
+
+    results = {
+        "version": 1,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "numpy": HAS_NUMPY,
+        "payload": args.payload._asdict(),
+        "payload_bytes": len(text.encode()),
+        "payload_samples": sum(
+            1 for line in text.splitlines() if line and line[0] != "#"
+        ),
+        "ticks": args.ticks,
+        "stages": {},
+    }
+    print(
+        f"{'stage':<48} {'ops/s':>10} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} "
+        f"{'alloc KiB':>10}"
+    )
+    for stage in stages:
+        result = measure(stage, args.warmup, args.ticks, args.alloc_ticks)
+        results["stages"][stage.name] = result
+        alloc = result["alloc_peak_bytes"]
+        print(
+            f"{stage.name:<48} {result['ops_per_sec']:>10.1f} "
+            f"{result['p50_ms']:>9.3f} {result['p90_ms']:>9.3f} "
+            f"{result['p99_ms']:>9.3f} "
+            f"{alloc / 1024 if alloc is not None else math.nan:>10.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        print()
+        compare(previous, results)
+
+
+if __name__ == "__main__":
+    main()
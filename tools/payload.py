@@ -0,0 +1,332 @@
+import math
+import struct
+import zlib
+from typing import Collection, NamedTuple, Optional
+
+# CPU 时间的各个模式，以及非 idle 时间在其中的分配比例
+CPU_MODES = (("dpc", 0.02), ("interrupt", 0.03), ("privileged", 0.25), ("user", 0.7))
+# GPU 引擎类型
+GPU_ENGINE_TYPES = ("3D", "Copy", "VideoDecode", "VideoEncode")
+# 生成的数据所属的 windows_exporter collector
+COLLECTORS = ("cpu", "gpu", "logical_disk", "memory", "net", "physical_disk", "process")
+# 负载变化的周期（秒）
+LOAD_PERIOD = 120.0
+# 填充序列的 family 名
+PADDING_FAMILY = "windows_simulator_padding"
+# protobuf 格式中 MetricFamily.type 的枚举值，以及 Metric 中保存值的字段号
+_PROTOBUF_TYPES = {"counter": (0, 3), "gauge": (1, 2)}
+
+
+class PayloadSpec(NamedTuple):
+    """
+    合成的 windows_exporter 数据的规模
+    """
+
+    cores: int = 8
+    disks: int = 2
+    nics: int = 1
+    processes: int = 100
+    volumes: int = 2
+    gpus: int = 1
+
+    @classmethod
+    def parse(cls, text: str) -> "PayloadSpec":
+        """
+        从 "cores=64,processes=500" 这样的字符串创建，没有写的项使用默认值
+        """
+        values = {}
+        for item in filter(None, (part.strip() for part in text.split(","))):
+            key, _, value = item.partition("=")
+            if key not in cls._fields:
+                raise ValueError(f"Unknown payload field: {key!r}")
+            values[key] = int(value)
+        return cls(**values)
+
+
+def _phase(key: str) -> float:
+    # 每条序列固定的相位，使各序列的负载错开
+    return zlib.crc32(key.encode()) / 0xFFFFFFFF * 2 * math.pi
+
+
+def load(key: str, t: float, mean: float = 0.3, amplitude: float = 0.2) -> float:
+    """
+    序列 key 在时间 t 的负载（0~1），按正弦变化
+    """
+    return mean + amplitude * math.sin(2 * math.pi * t / LOAD_PERIOD + _phase(key))
+
+
+def busy_seconds(
+    key: str, t: float, mean: float = 0.3, amplitude: float = 0.2
+) -> float:
+    """
+    负载为 load(key, t) 时，从 0 到 t 的累计忙碌时间，即 load 的积分。
+    mean >= amplitude 时单调递增，可以作为计数器
+    """
+    omega = 2 * math.pi / LOAD_PERIOD
+    phase = _phase(key)
+    return mean * t - amplitude / omega * (
+        math.cos(omega * t + phase) - math.cos(phase)
+    )
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    # 长度前缀的字段（字符串或子消息）
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _sample_text(name: str, labels: dict[str, str], value: float) -> str:
+    if labels:
+        label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+        return f"{name}{{{label_text}}} {value!r}"
+    return f"{name} {value!r}"
+
+
+def _metric_protobuf(typ: str, labels: dict[str, str], value: float) -> bytes:
+    # 一个 Metric 消息：LabelPair 和 Gauge/Counter 的值
+    message = b"".join(
+        _field(1, _field(1, k.encode()) + _field(2, v.encode()))
+        for k, v in labels.items()
+    )
+    return message + _field(_PROTOBUF_TYPES[typ][1], b"\x09" + struct.pack("<d", value))
+
+
+class _Writer:
+    def __init__(self):
+        # (family 名, 类型, HELP, [(样本名, labels, 值)])
+        self.families: list[
+            tuple[str, str, str, list[tuple[str, dict[str, str], float]]]
+        ] = []
+
+    def family(self, name: str, typ: str, help_text: str):
+        self.families.append((name, typ, help_text, []))
+
+    def sample(self, name: str, labels: dict[str, str], value: float):
+        self.families[-1][3].append((name, labels, value))
+
+    def text(self) -> str:
+        lines = []
+        for name, typ, help_text, samples in self.families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {typ}")
+            lines += [_sample_text(*sample) for sample in samples]
+        return "\n".join(lines) + "\n"
+
+    def protobuf(self) -> bytes:
+        """
+        delimited 的 MetricFamily 序列（与 windows_exporter 协商 protobuf 时的响应体）
+        """
+        out = []
+        for name, typ, help_text, samples in self.families:
+            message = (
+                _field(1, name.encode())
+                + _field(2, help_text.encode())
+                + b"\x18"
+                + _varint(_PROTOBUF_TYPES[typ][0])
+                + b"".join(
+                    _field(4, _metric_protobuf(typ, labels, value))
+                    for _, labels, value in samples
+                )
+            )
+            out.append(_varint(len(message)) + message)
+        return b"".join(out)
+
+
+def generate_payload(
+    spec: PayloadSpec,
+    t: float,
+    uptime: float = 0.0,
+    seed: str = "",
+    collectors: Optional[Collection[str]] = None,
+) -> str:
+    """
+    生成 windows_exporter 在时间 t 的文本格式数据。
+    计数器按各自的负载随时间增长，同一个 spec 在不同时间生成的数据是一次
+    连续运行的前后两次采集，可以用来计算速率和使用率。
+    :param spec: 数据规模
+    :param t: 采集时间（秒）
+    :param uptime: 计数器的起点（秒），t == uptime 时计数器为 0
+    :param seed: 区分不同主机，seed 不同时各序列的负载曲线不同
+    :param collectors: 只输出这些 collector 的数据（与 collect[] 参数相同），None 表示全部
+    """
+    return _write_payload(spec, t, uptime, seed, collectors).text()
+
+
+def generate_protobuf_payload(
+    spec: PayloadSpec,
+    t: float,
+    uptime: float = 0.0,
+    seed: str = "",
+    collectors: Optional[Collection[str]] = None,
+) -> bytes:
+    """
+    生成与 generate_payload 相同的数据，编码为 delimited 的 MetricFamily protobuf
+    """
+    return _write_payload(spec, t, uptime, seed, collectors).protobuf()
+
+
+def padding_payload(size: int, protobuf: bool = False) -> bytes:
+    """
+    大约 size 字节的填充序列（gauge，不会被任何分析器使用）
+    :param protobuf: 编码为 protobuf，否则为文本格式
+    """
+    w = _Writer()
+    w.family(PADDING_FAMILY, "gauge", "Padding to reach the configured payload size")
+    written = 0
+    i = 0
+    while written < size:
+        labels = {"series": str(i)}
+        w.sample(PADDING_FAMILY, labels, float(i))
+        if protobuf:
+            written += len(_metric_protobuf("gauge", labels, float(i))) + 2
+        else:
+            written += len(_sample_text(PADDING_FAMILY, labels, float(i))) + 1
+        i += 1
+    return w.protobuf() if protobuf else w.text().encode("utf-8")
+
+
+def _write_payload(
+    spec: PayloadSpec,
+    t: float,
+    uptime: float,
+    seed: str,
+    collectors: Optional[Collection[str]],
+) -> _Writer:
+    elapsed = max(0.0, t - uptime)
+    w = _Writer()
+
+    def enabled(collector: str) -> bool:
+        return collectors is None or collector in collectors
+
+    if enabled("cpu"):
+        w.family(
+            "windows_cpu_time_total",
+            "counter",
+            "Time that processor spent in different modes (dpc, idle, interrupt, privileged, user)",
+        )
+        for core in range(spec.cores):
+            core_label = f"{core // 64},{core % 64}"
+            busy = busy_seconds(seed + f"cpu{core}", elapsed)
+            w.sample(
+                "windows_cpu_time_total",
+                {"core": core_label, "mode": "idle"},
+                elapsed - busy,
+            )
+            for mode, share in CPU_MODES:
+                w.sample(
+                    "windows_cpu_time_total",
+                    {"core": core_label, "mode": mode},
+                    busy * share,
+                )
+
+    if enabled("memory"):
+        total_memory = 16 * 2**30
+        for name, value in (
+            ("windows_memory_physical_total_bytes", total_memory),
+            (
+                "windows_memory_physical_free_bytes",
+                total_memory * (1 - load(seed + "memory", t, 0.5, 0.1)),
+            ),
+            ("windows_memory_commit_limit", total_memory * 1.25),
+            (
+                "windows_memory_committed_bytes",
+                total_memory * load(seed + "commit", t, 0.6, 0.1),
+            ),
+        ):
+            w.family(name, "gauge", "Memory information")
+            w.sample(name, {}, float(int(value)))
+
+    if enabled("physical_disk"):
+        for kind in ("idle", "read", "write"):
+            name = f"windows_physical_disk_{kind}_seconds_total"
+            w.family(name, "counter", f"Seconds that the disk spent {kind}")
+            for disk in range(spec.disks):
+                key = f"disk{disk}"
+                busy = busy_seconds(seed + key, elapsed, 0.1, 0.08)
+                value = elapsed - busy if kind == "idle" else busy / 2
+                w.sample(name, {"disk": str(disk)}, value)
+
+    if enabled("logical_disk"):
+        volumes = [f"{chr(ord('C') + i)}:" for i in range(spec.volumes)]
+        for kind in ("size", "free"):
+            name = f"windows_logical_disk_{kind}_bytes"
+            w.family(name, "gauge", f"Logical disk {kind} in bytes")
+            for i, volume in enumerate(volumes):
+                size = float(256 * 2**30 * (i + 1))
+                value = (
+                    size if kind == "size" else size * load(seed + volume, t, 0.5, 0.01)
+                )
+                w.sample(name, {"volume": volume}, float(int(value)))
+
+    if enabled("net"):
+        nics = [f"Ethernet {i}" for i in range(spec.nics)]
+        link_speed = 125_000_000
+        for kind in ("received", "sent", "total"):
+            name = f"windows_net_bytes_{kind}_total"
+            w.family(name, "counter", f"Bytes {kind} on the network interface")
+            for nic in nics:
+                received = (
+                    busy_seconds(seed + f"{nic}rx", elapsed, 0.05, 0.04) * link_speed
+                )
+                sent = (
+                    busy_seconds(seed + f"{nic}tx", elapsed, 0.02, 0.015) * link_speed
+                )
+                value = {"received": received, "sent": sent, "total": received + sent}
+                w.sample(name, {"nic": nic}, float(int(value[kind])))
+
+    if enabled("gpu"):
+        name = "windows_gpu_engine_time_seconds"
+        w.family(name, "counter", "Total running time of the GPU engine in seconds")
+        for gpu in range(spec.gpus):
+            luid = f"0x00000000_0x0000{gpu:04x}"
+            for eng, engine_type in enumerate(GPU_ENGINE_TYPES):
+                w.sample(
+                    name,
+                    {
+                        "luid": luid,
+                        "phys": str(gpu),
+                        "eng": str(eng),
+                        "engtype": engine_type,
+                        "pid": "4",
+                    },
+                    busy_seconds(seed + f"gpu{gpu}.{eng}", elapsed, 0.2, 0.15),
+                )
+
+    if enabled("process"):
+        process_families = (
+            ("windows_process_cpu_time_total", "counter", "Process CPU time"),
+            ("windows_process_working_set_bytes", "gauge", "Process working set"),
+            ("windows_process_handles", "gauge", "Process handles"),
+        )
+        for name, typ, help_text in process_families:
+            w.family(name, typ, help_text)
+            for pid in range(spec.processes):
+                labels = {"process": f"proc{pid % 37}", "process_id": str(1000 + pid)}
+                if name == "windows_process_cpu_time_total":
+                    busy = busy_seconds(seed + f"proc{pid}", elapsed, 0.01, 0.01)
+                    for mode, share in (("privileged", 0.3), ("user", 0.7)):
+                        w.sample(name, {**labels, "mode": mode}, busy * share)
+                elif name == "windows_process_working_set_bytes":
+                    w.sample(name, labels, float(2**20 * (10 + pid % 200)))
+                else:
+                    w.sample(name, labels, float(100 + pid % 900))
+
+    name = "windows_exporter_collector_duration_seconds"
+    w.family(name, "gauge", "windows_exporter: Duration of a collection.")
+    for collector in COLLECTORS:
+        if not enabled(collector):
+            continue
+        w.sample(
+            name,
+            {"collector": collector},
+            0.001 + load(seed + collector, t, 0.01, 0.005),
+        )
+    return w
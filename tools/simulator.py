@@ -0,0 +1,361 @@
+"""
+本地的 windows_exporter 模拟器，用于在没有 Windows 主机时做负载和延迟测试。
+
+用法：
+    python -m tools.simulator --port 9182 --instances 20 --payload cores=64,processes=500
+    python -m tools.simulator --latency 0.2 --jitter 0.3 --failure-rate 0.1 --failure-mode hang
+
+每个实例在自己的端口上提供 /metrics，计数器随时间连续增长；
+各实例的负载曲线不同，可以作为多目标采集的目标，并测试 fetch_timeout 的表现。
+与 windows_exporter 一样按 Accept 头返回 protobuf 或文本格式（--no-protobuf 只返回文本格式）。
+"""
+
+import argparse
+import gzip
+import logging
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Collection, NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from app.logic.protobuf import PROTOBUF_CONTENT_TYPE, PROTOBUF_MEDIA_TYPE
+
+from .payload import (
+    COLLECTORS,
+    PayloadSpec,
+    generate_payload,
+    generate_protobuf_payload,
+    padding_payload,
+)
+
+# 失败注入的方式
+FAILURE_MODES = ("status", "hang", "reset", "truncate")
+
+
+class SimulatorOptions(NamedTuple):
+    """
+    模拟器的行为
+    """
+
+    payload: PayloadSpec = PayloadSpec()
+    # 每次响应前的延迟（秒），以及在其上叠加的 [-jitter, jitter] 均匀随机抖动
+    latency: float = 0.0
+    jitter: float = 0.0
+    # 注入失败的概率，以及失败的方式：
+    # status 返回 500；hang 不响应直到 hang_time 秒后断开；
+    # reset 直接关闭连接；truncate 只发送一半的响应体后断开
+    failure_rate: float = 0.0
+    failure_mode: str = "status"
+    hang_time: float = 30.0
+    # 响应体至少这么多字节，不足时用填充的序列补齐
+    min_bytes: int = 0
+    # 拉取方的 Accept 头接受 protobuf 时返回 protobuf 格式，否则只返回文本格式
+    protobuf: bool = True
+    # 启用的 collector，collect[] 中有其他 collector 时与 windows_exporter 一样返回 400
+    collectors: tuple[str, ...] = COLLECTORS
+
+
+class ExporterSimulator:
+    """
+    一个模拟的 windows_exporter 实例，在后台线程中运行 HTTP 服务
+    """
+
+    def __init__(
+        self,
+        port: int,
+        options: SimulatorOptions = SimulatorOptions(),
+        host: str = "127.0.0.1",
+        seed: Optional[str] = None,
+    ):
+        """
+        port: 监听端口，0 表示由系统分配
+        options: 模拟器的行为
+        host: 监听地址
+        seed: 区分不同实例的负载曲线，默认使用端口号
+        """
+        self.options = options
+        self.server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.simulator = self
+        self.seed = seed if seed is not None else f"{self.port}:"
+        # exporter 的启动时间，计数器从这时开始增长
+        self.start_time = time.time() - random.uniform(600, 86400)
+        self.random = random.Random(self.seed)
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        host = self.server.server_address[0]
+        return f"http://{host}:{self.port}/metrics"
+
+    def start(self):
+        """
+        在后台线程中开始服务
+        """
+        self._thread = threading.Thread(
+            target=self.server.serve_forever,
+            name=f"ExporterSimulator-{self.port}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        停止服务并关闭端口
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def payload(
+        self,
+        now: float,
+        collectors: Optional[Collection[str]] = None,
+        protobuf: bool = False,
+    ) -> bytes:
+        """
+        生成 now 时刻的响应体
+        :param collectors: 只输出这些 collector 的数据（collect[] 参数），None 表示全部
+        :param protobuf: 编码为 delimited 的 MetricFamily protobuf，否则为文本格式
+        """
+        args = (self.options.payload, now, self.start_time, self.seed, collectors)
+        if protobuf:
+            body = generate_protobuf_payload(*args)
+        else:
+            body = generate_payload(*args).encode("utf-8")
+        if len(body) < self.options.min_bytes:
+            body += padding_payload(self.options.min_bytes - len(body), protobuf)
+        return body
+
+    def next_request(self) -> tuple[float, Optional[str]]:
+        """
+        为一次请求抽取延迟和失败方式（None 表示正常响应）
+        """
+        options = self.options
+        with self._lock:
+            self.requests += 1
+            delay = options.latency + self.random.uniform(
+                -options.jitter, options.jitter
+            )
+            failure = None
+            if self.random.random() < options.failure_rate:
+                failure = options.failure_mode
+                self.failures += 1
+        return max(0.0, delay), failure
+
+
+def is_protobuf_accepted(accept: str) -> bool:
+    """
+    Accept 头是否接受 delimited 的 MetricFamily protobuf（q=0 表示不接受）
+    """
+    for item in accept.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        if media_type.lower() != PROTOBUF_MEDIA_TYPE:
+            continue
+        options = dict(param.partition("=")[::2] for param in params)
+        if (
+            options.get("proto") == "io.prometheus.client.MetricFamily"
+            and options.get("encoding") == "delimited"
+            and options.get("q") not in ("0", "0.0")
+        ):
+            return True
+    return False
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    server: ThreadingHTTPServer
+    protocol_version = "HTTP/1.1"
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # 拉取方超时后断开了连接
+            pass
+
+    def do_GET(self):
+        simulator: ExporterSimulator = getattr(self.server, "simulator")
+        url = urlsplit(self.path)
+        if url.path != "/metrics":
+            self.send_error(404)
+            return
+        # 与 windows_exporter 一样，collect[] 参数限制运行的 collector，
+        # 其中有未启用的 collector 时返回 400
+        enabled = simulator.options.collectors
+        collectors = parse_qs(url.query).get("collect[]") or enabled
+        unavailable = [c for c in collectors if c not in enabled]
+        if unavailable:
+            self.send_error(400, f"Unavailable collector: {', '.join(unavailable)}")
+            return
+
+        delay, failure = simulator.next_request()
+        if delay:
+            time.sleep(delay)
+        if failure == "status":
+            self.send_error(500, "Injected failure")
+            return
+        if failure == "hang":
+            time.sleep(simulator.options.hang_time)
+            self.close_connection = True
+            return
+        if failure == "reset":
+            # SO_LINGER 为 0 时 close 发送 RST
+            self.connection.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+            )
+            self.close_connection = True
+            return
+
+        # 与 windows_exporter 一样按 Accept 头协商格式
+        protobuf = simulator.options.protobuf and is_protobuf_accepted(
+            self.headers.get("Accept", "")
+        )
+        body = simulator.payload(time.time(), collectors, protobuf)
+        encoding = None
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            encoding = "gzip"
+        self.send_response(200)
+        self.send_header(
+            "Content-Type",
+            (
+                PROTOBUF_CONTENT_TYPE
+                if protobuf
+                else "text/plain; version=0.0.4; charset=utf-8"
+            ),
+        )
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if failure == "truncate":
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="windows_exporter simulator")
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Listen address (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--port", type=int, default=9182, help="First port (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--instances",
+        type=int,
+        default=1,
+        help="Number of exporters on consecutive ports (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--payload",
+        type=PayloadSpec.parse,
+        default=PayloadSpec(),
+        help="Payload scale, e.g. cores=64,disks=4,nics=2,processes=500 "
+        "(fields: %s)" % ", ".join(PayloadSpec._fields),
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Response delay in seconds"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Random +/- delay in seconds"
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="Probability of an injected failure per request",
+    )
+    parser.add_argument(
+        "--failure-mode",
+        choices=FAILURE_MODES,
+        default="status",
+        help="status: HTTP 500, hang: no response, reset: TCP reset, "
+        "truncate: half the body (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--hang-time",
+        type=float,
+        default=30.0,
+        help="How long a hung request stays open (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--collectors",
+        type=lambda text: tuple(filter(None, text.split(","))),
+        default=COLLECTORS,
+        help="Enabled collectors; collect[] naming others gets HTTP 400 "
+        "(default: %s)" % ",".join(COLLECTORS),
+    )
+    parser.add_argument(
+        "--no-protobuf",
+        action="store_true",
+        help="Serve only the text format, even if protobuf is accepted",
+    )
+    parser.add_argument(
+        "--min-bytes",
+        type=int,
+        default=0,
+        help="Pad each response to at least this many bytes",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    options = SimulatorOptions(
+        payload=args.payload,
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        failure_mode=args.failure_mode,
+        hang_time=args.hang_time,
+        min_bytes=args.min_bytes,
+        protobuf=not args.no_protobuf,
+        collectors=args.collectors,
+    )
+    simulators = [
+        ExporterSimulator(args.port + i, options, args.host)
+        for i in range(args.instances)
+    ]
+    for simulator in simulators:
+        simulator.start()
+    # 可以直接复制到 config.yaml 的 targets
+    print("targets:")
+    for simulator in simulators:
+        print(f'  - "{simulator.url}"')
+    sys.stdout.flush()
+
+    try:
+        while True:
+            time.sleep(10)
+            requests = sum(s.requests for s in simulators)
+            failures = sum(s.failures for s in simulators)
+            logging.info(f"Requests: {requests}, injected failures: {failures}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+
+
+if __name__ == "__main__":
+    main()